@@ -1,16 +1,24 @@
 "Commands and their implementations for the courseraprogramming sdk."
 
 __all__ = [
+    "agent",
+    "analyze",
     "cat",
     "config",
+    "deploy",
+    "find",
     "grade",
+    "grep",
+    "image_diff",
     "inspect",
     "ls",
     "publish",
+    "pull",
     "reregister",
     "sanity",
+    "serve",
+    "status",
+    "sync",
     "upload",
     "version",
 ]
-
-from . import *  # noqa
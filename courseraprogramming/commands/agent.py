@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from courseraprogramming.commands import oauth2
+import json
+import logging
+import os
+import os.path
+import socketserver
+import time
+
+
+class TokenAgent(object):
+    '''
+    Holds OAuth2 tokens in memory, keeps them fresh, and hands them out to
+    other courseraprogramming commands.
+    '''
+
+    def __init__(self, oauth2_instance):
+        self.oauth2_instance = oauth2_instance
+        self.auth = oauth2_instance.build_refreshing_authorizer()
+
+    def handle(self, request):
+        'Answers a token request. Returns the response dict.'
+        if request.get('client_id') != self.oauth2_instance.client_id or \
+                request.get('scopes') != self.oauth2_instance.scopes:
+            return {'error': 'The agent serves a different OAuth2 client.'}
+        stale_token = request.get('stale_token')
+        if stale_token is not None:
+            self.auth.refresh(stale_token=stale_token)
+        elif time.time() + self.auth.refresh_margin >= self.auth.expires:
+            self.auth.refresh(stale_token=self.auth.token)
+        return {'token': self.auth.token, 'expires': self.auth.expires}
+
+
+class _TokenRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            response = self.server.agent.handle(
+                json.loads(line.decode('utf-8')))
+        except:
+            logging.exception('Could not answer token request.')
+            response = {'error': 'Internal agent error.'}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def agent_is_running(socket_path):
+    'Determines if an agent is listening on socket_path.'
+    try:
+        oauth2.agent_request(socket_path, {}, timeout=1)
+    except:
+        return False
+    return True
+
+
+def make_server(agent, socket_path):
+    '''
+    Binds a token server to a Unix socket only the current user may connect
+    to. Returns None if another agent is already listening there.
+    '''
+    directory = os.path.dirname(socket_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    if os.path.exists(socket_path):
+        if agent_is_running(socket_path):
+            logging.error('An agent is already listening on %s', socket_path)
+            return None
+        os.remove(socket_path)
+    # Never let the socket be connectable by other users, not even briefly.
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(
+            socket_path, _TokenRequestHandler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, 0o600)
+    server.daemon_threads = True
+    server.agent = agent
+    return server
+
+
+def serve(agent, socket_path):
+    "Serves tokens on socket_path until interrupted."
+    server = make_server(agent, socket_path)
+    if server is None:
+        return 1
+    logging.info('Serving OAuth2 tokens on %s', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        agent.auth.close()
+    return 0
+
+
+def command_agent(args):
+    "Implements the agent subcommand"
+    cfg = oauth2.configuration()
+    socket_path = args.socket
+    if socket_path is None:
+        socket_path = cfg.get('oauth2', 'agent_socket')
+    oauth2_instance = oauth2.build_oauth2(args, cfg, use_agent=False)
+    return serve(TokenAgent(oauth2_instance),
+                 os.path.expanduser(socket_path))
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the agent command
+    parser_agent = subparsers.add_parser(
+        'agent',
+        help='Hold OAuth2 tokens in memory and serve them to other '
+        'courseraprogramming commands over a Unix socket, so scripted runs '
+        'do not each read the token cache or call the token endpoint. Runs '
+        'until interrupted.')
+    parser_agent.set_defaults(func=command_agent)
+    parser_agent.add_argument(
+        '--socket',
+        help='The socket to listen on. (Default: the agent_socket option of '
+        'the oauth2 configuration section, ~/.coursera/agent.sock.)')
+    return parser_agent
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from courseraprogramming.commands import common
+from courseraprogramming import layers
+from courseraprogramming import utils
+import posixpath
+import sys
+
+
+def layer_instructions(index):
+    """
+    Pairs every layer with the Dockerfile instruction that created it, based
+    on the image history. Instructions that did not create a layer (e.g. ENV)
+    are skipped.
+    """
+    history = [h for h in index.config.get('history', [])
+               if not h.get('empty_layer', False)]
+    instructions = []
+    for position in range(len(index.layers)):
+        if position < len(history):
+            created_by = history[position].get('created_by', '')
+        else:
+            created_by = ''
+        # Strip the shell wrapper docker adds to RUN instructions.
+        created_by = created_by.replace('/bin/sh -c #(nop) ', '')
+        created_by = created_by.replace('/bin/sh -c ', 'RUN ')
+        instructions.append(' '.join(created_by.split()))
+    return instructions
+
+
+def directory_of(path, depth):
+    "Truncates path to its first depth components."
+    parts = [p for p in path.split('/') if p][:depth]
+    return '/' + '/'.join(parts)
+
+
+def analyze_index(index, depth=2, top=10):
+    """
+    Computes a size breakdown of the image. Returns a dict with the bytes
+    added per layer (and instruction), the bytes per directory of the merged
+    file system, the wasted bytes, and the largest files.
+    """
+    files = index.files
+    instructions = layer_instructions(index)
+    layer_reports = []
+    wasted = []
+    for position, layer in enumerate(index.layers):
+        size = 0
+        for entry in layer['entries']:
+            if entry[layers.TYPE] != layers.FILE:
+                continue
+            size += entry[layers.SIZE]
+            merged = files.get(entry[layers.PATH])
+            if merged is not None and merged[-1] == position:
+                continue
+            # A later layer overwrote or deleted this file, yet its bytes
+            # still ship with the image.
+            wasted.append({
+                'path': entry[layers.PATH],
+                'size': entry[layers.SIZE],
+                'layer': position,
+                'reason': 'deleted' if merged is None else 'overwritten',
+            })
+        layer_reports.append({
+            'layer': position,
+            'diff_id': layer['diff_id'],
+            'instruction': instructions[position],
+            'size': size,
+        })
+
+    directories = {}
+    surviving = []
+    for path, entry in files.items():
+        if entry[layers.TYPE] != layers.FILE:
+            continue
+        directory = directory_of(posixpath.dirname(path), depth)
+        directories[directory] = \
+            directories.get(directory, 0) + entry[layers.SIZE]
+        surviving.append({'path': path, 'size': entry[layers.SIZE],
+                          'layer': entry[-1]})
+
+    def by_size(item):
+        return (-item['size'], item['path'])
+    wasted.sort(key=by_size)
+    surviving.sort(key=by_size)
+    return {
+        'total_size': sum(layer['size'] for layer in layer_reports),
+        'layers': layer_reports,
+        'directories': sorted(directories.items(),
+                              key=lambda d: (-d[1], d[0])),
+        'wasted_size': sum(w['size'] for w in wasted),
+        'wasted': wasted[:top],
+        'largest_files': surviving[:top],
+    }
+
+
+def print_report(report, top, out):
+    "Writes the report in a human readable format."
+    size = utils.human_size
+
+    def write(line=''):
+        out.write(line + '\n')
+
+    write('Total size: %s in %d layers' %
+          (size(report['total_size']), len(report['layers'])))
+    write('Wasted: %s (files overwritten or deleted by later layers)' %
+          size(report['wasted_size']))
+    write()
+    write('Layers:')
+    for layer in report['layers']:
+        write('  %2d %8s  %s' % (layer['layer'], size(layer['size']),
+                                 layer['instruction'][:100]))
+    write()
+    write('Largest directories:')
+    for directory, dir_size in report['directories'][:top]:
+        write('  %8s  %s' % (size(dir_size), directory))
+    write()
+    write('Largest files:')
+    for f in report['largest_files']:
+        write('  %8s  %s (layer %d)' % (size(f['size']), f['path'],
+                                        f['layer']))
+    if len(report['wasted']) > 0:
+        write()
+        write('Largest wasted files:')
+        for w in report['wasted']:
+            write('  %8s  %s (layer %d, %s later)' % (
+                size(w['size']), w['path'], w['layer'], w['reason']))
+
+
+def command_analyze(args):
+    "Implements the analyze subcommand"
+    d = utils.docker_client(args)
+    index = layers.image_index(d, args.imageId, rebuild=args.rebuild_index)
+    report = analyze_index(index, depth=args.depth, top=args.top)
+    print_report(report, args.top, sys.stdout)
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the analyze command
+    parser_analyze = subparsers.add_parser(
+        'analyze',
+        help='Break down the size of your container image by layer, '
+             'Dockerfile instruction and directory, and find wasted bytes.',
+        parents=[common.container_parser()])
+    parser_analyze.set_defaults(func=command_analyze)
+    parser_analyze.add_argument(
+        '--depth',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=2,
+        help='Number of path components to group directories by.')
+    parser_analyze.add_argument(
+        '--top',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=10,
+        help='Number of directories and files to list in each ranking.')
+    parser_analyze.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file system instead of using the cache.')
+
+    return parser_analyze
@@ -20,37 +20,78 @@ Coursera's asynchronous grader command line SDK.
 You may install it from source, or via pip.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from courseraprogramming.commands import common
 from courseraprogramming import utils
 import logging
+import shutil
 import sys
+import tempfile
 
 
-def command_cat(args):
-    "Implements the cat subcommand"
-    d = utils.docker_client(args)
+# Files smaller than this are buffered in memory while waiting for their turn
+# to be written to stdout; larger ones spill over to a temporary file.
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+
+def fetch_file(d, container, path):
+    "Reads a file out of the container into a (rewound) temporary file."
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
     try:
-        container = d.create_container(
-            image=args.imageId,
-            entrypoint="/bin/cat",
-            command=args.file)
+        common.copy_file_from_container(d, container, path, spool)
     except:
-        logging.error(
-            "Could not set up the container to run the cat command in. Most "
-            "likely, this means that you specified an inappropriate container "
-            "id.")
+        spool.close()
         raise
-    d.start(container)
-    exit_code = d.wait(container, timeout=2)
-    if exit_code != 0:
-        logging.warn("The cat command did not exit cleanly within the "
-                     "container. Exit code: %s", exit_code)
+    spool.seek(0)
+    return spool
+
 
-    command_output = d.logs(container)
-    if type(command_output) is bytes:
-        command_output = command_output.decode("utf-8")
-    # Use sys.stdout to avoid extra trailing newline. (Py3.x compatible)
-    sys.stdout.write(command_output)
+def cat_files(d, container, files, parallelism, out):
+    """
+    Writes the files from the container to out, in order. Returns 0 on
+    success, or 1 if any file could not be read.
+    """
+    verbose = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if len(files) == 1:
+        # Nothing to reorder: stream straight to the output.
+        try:
+            common.copy_file_from_container(d, container, files[0], out)
+        except:
+            logging.error('cat: %s: could not read file.', files[0],
+                          exc_info=verbose)
+            return 1
+        return 0
+
+    exit_code = 0
+    with ThreadPoolExecutor(max_workers=min(len(files), parallelism)) as pool:
+        futures = [pool.submit(fetch_file, d, container, path)
+                   for path in files]
+        # Output in command line order, regardless of which fetch finishes
+        # first.
+        for path, future in zip(files, futures):
+            try:
+                spool = future.result()
+            except:
+                logging.error('cat: %s: could not read file.', path,
+                              exc_info=verbose)
+                exit_code = 1
+                continue
+            with spool:
+                shutil.copyfileobj(spool, out, common.ARCHIVE_CHUNK_SIZE)
+    return exit_code
+
+
+def command_cat(args):
+    "Implements the cat subcommand"
+    d = utils.docker_client(args)
+    # Write raw bytes so that binary files survive intact, after anything
+    # already written to the text layer above them.
+    sys.stdout.flush()
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    with common.stopped_container(d, args.imageId) as container:
+        exit_code = cat_files(d, container, args.file, args.parallelism, out)
+    out.flush()
+    return exit_code
 
 
 def parser(subparsers):
@@ -62,4 +103,9 @@ def parser(subparsers):
         parents=[common.container_parser()])
     parser_cat.set_defaults(func=command_cat)
     parser_cat.add_argument('file', help='File(s) to output.', nargs='+')
+    parser_cat.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='Maximum number of files to fetch from the image concurrently.')
     return parser_cat
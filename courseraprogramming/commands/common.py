@@ -20,8 +20,21 @@ Coursera's asynchronous grader command line SDK.
 You may install it from source, or via pip.
 """
 
+from courseraprogramming import tracing
 import argparse
+import contextlib
+import logging
 import os
+import posixpath
+import shutil
+import tarfile
+
+
+# Size of the chunks copied out of docker archive streams.
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of symlinks followed when reading a single path.
+MAX_SYMLINK_HOPS = 8
 
 
 def container_parser():
@@ -55,3 +68,66 @@ def arg_fq_dir(dirname):
 def mk_submission_volume_str(fq_local_dir_name):
     "Converts a local fully-qualified path to a docker volume string"
     return '%s:/shared/submission' % fq_local_dir_name
+
+
+@contextlib.contextmanager
+def stopped_container(d, image_id):
+    """
+    Creates (but never starts) a container from the image so that its file
+    system can be read through the docker archive API. The container is always
+    removed when the block exits.
+    """
+    # The entrypoint is never executed; it only keeps images without an
+    # ENTRYPOINT or CMD from being rejected at creation time.
+    try:
+        container = d.create_container(image=image_id,
+                                       entrypoint='/bin/true')
+    except:
+        logging.error(
+            "Could not set up a container to read files from. Most likely, "
+            "this means that you specified an inappropriate container id.")
+        raise
+    try:
+        yield container
+    finally:
+        try:
+            d.remove_container(container, force=True)
+        except:
+            logging.warn('Could not remove container %s.', container,
+                         exc_info=True)
+
+
+def copy_file_from_container(d, container, path, out):
+    """
+    Streams the regular file at path out of the container into the binary file
+    object out, following symlinks. Returns the number of bytes written.
+
+    Raises IsADirectoryError if path refers to a directory.
+    """
+    with tracing.span(tracing.EXPORT, 'copy %s' % path) as span:
+        span['bytes'] = size = _copy_file_from_container(
+            d, container, path, out)
+        return size
+
+
+def _copy_file_from_container(d, container, path, out):
+    for _ in range(MAX_SYMLINK_HOPS):
+        stream, _ = d.get_archive(container, path)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as archive:
+                member = archive.next()
+                if member is None:
+                    raise IOError('Empty archive returned for %s' % path)
+                if member.isdir():
+                    raise IsADirectoryError(path)
+                if not member.issym():
+                    contents = archive.extractfile(member)
+                    if contents is None:
+                        raise IOError('%s is not a regular file' % path)
+                    shutil.copyfileobj(contents, out, ARCHIVE_CHUNK_SIZE)
+                    return member.size
+                path = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(path), member.linkname))
+        finally:
+            stream.close()
+    raise IOError('Too many levels of symbolic links: %s' % path)
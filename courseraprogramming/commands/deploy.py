@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from courseraprogramming.commands import oauth2
+from courseraprogramming.commands import publish
+from courseraprogramming.commands import upload
+from courseraprogramming import registry
+from courseraprogramming import utils
+import argparse
+import collections
+import logging
+import os.path
+import requests
+import sys
+import time
+
+
+class DeployError(Exception):
+    pass
+
+
+def group_targets(targets):
+    """
+    Groups the (image, item, part) targets by image, keeping their order.
+    Each image is uploaded once, however many parts it grades.
+    """
+    images = collections.OrderedDict()
+    for image, item, part in targets:
+        images.setdefault(image, []).append((item, part))
+    return images
+
+
+def register_image(args, d, session, image, parts, registry_db=None):
+    """
+    Uploads and registers one grader image and attaches it to its (item,
+    part) pairs. Returns the executor id and the location of its status.
+    """
+    image_args = argparse.Namespace(**vars(args))
+    image_args.imageId = image
+    image_args.file_name = None
+    image_args.item, image_args.part = parts[0]
+    image_args.additional_item_and_part = [list(p) for p in parts[1:]] or None
+
+    logging.info('%s: uploading...', image)
+    upload_information = upload.upload_grader_image(image_args, d)
+    if upload_information is None:
+        raise DeployError('upload timed out')
+
+    logging.info('%s: registering...', image)
+    grader_id, location = upload.register_grader_with_location(
+        session.auth, image_args,
+        bucket=upload_information[0],
+        key=upload_information[1],
+        registry_db=registry_db)
+    if upload.update_assignments(session.auth, grader_id, image_args,
+                                 registry_db=registry_db) != 0:
+        raise DeployError('part update failed')
+    return grader_id, location
+
+
+def wait_for_grader(args, session, image, grader_id, location,
+                    registry_db=None):
+    "Waits until the registered grader of an image is ready."
+    logging.info('%s: waiting for grader %s to be ready...', image, grader_id)
+    status = publish.wait_for_location(
+        session, location, time.time() + args.wait_timeout)
+    if registry_db is not None:
+        registry_db.record_grader(args.course, grader_id, status=status)
+    if status != publish.GraderExecutorStatus.COMPLETED:
+        raise DeployError('grader %s' % status.lower())
+    logging.info('%s: grader %s is ready.', image, grader_id)
+    return grader_id
+
+
+def command_deploy(args):
+    "Implements the deploy subcommand"
+    images = group_targets(args.target)
+    images_of_item = collections.OrderedDict()
+    for image, parts in images.items():
+        for item, _ in parts:
+            images_of_item.setdefault(item, set()).add(image)
+
+    image_args = args
+    if len(images) > 1:
+        # Concurrent uploads would garble each other's progress output.
+        image_args = argparse.Namespace(**vars(args))
+        image_args.quiet = 2
+    d = utils.docker_client(args)
+    oauth2_instance = oauth2.build_oauth2(args)
+    session = requests.Session()
+    session.auth = oauth2_instance.build_refreshing_authorizer()
+    cache_file = args.pa_id_cache
+    if cache_file is not None:
+        cache_file = os.path.expanduser(cache_file)
+    cache = publish.AuthoringPaIdCache(cache_file, args.pa_id_cache_ttl)
+    grader_registry = registry.open_registry()
+    start = time.time()
+
+    def publish_item(item_id):
+        outcome, error = publish.publish_one(
+            session, args, args.course, item_id, cache)
+        return outcome, error, time.time() - start
+
+    image_results = {}
+    item_results = {}
+    failed_images = set()
+    try:
+        # Only uploads are bounded by --parallelism. Waiting for a grader to
+        # be ready takes a thread of its own, so a slow grader never keeps
+        # the uploads of other images from starting.
+        with ThreadPoolExecutor(max_workers=args.parallelism) as images_pool, \
+                ThreadPoolExecutor(max_workers=len(images)) as waits_pool, \
+                ThreadPoolExecutor(max_workers=args.parallelism) as items_pool:
+            pending = dict(
+                (images_pool.submit(register_image, image_args, d, session,
+                                    image, parts, grader_registry),
+                 (image, 'register'))
+                for image, parts in images.items())
+            item_futures = {}
+            # Publish every item as soon as all of its graders are ready,
+            # without waiting for the graders of other items.
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image, step = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except DeployError as e:
+                        logging.error('%s: %s', image, e)
+                        image_results[image] = (str(e), 1,
+                                                time.time() - start)
+                        failed_images.add(image)
+                    except:
+                        logging.exception('%s: deploy failed.', image)
+                        image_results[image] = ('failed', 1,
+                                                time.time() - start)
+                        failed_images.add(image)
+                    else:
+                        if step == 'register':
+                            grader_id, location = result
+                            pending[waits_pool.submit(
+                                wait_for_grader, args, session, image,
+                                grader_id, location, grader_registry)] = \
+                                (image, 'wait')
+                            continue
+                        image_results[image] = ('ready', None,
+                                                time.time() - start)
+                    for item, item_images in images_of_item.items():
+                        if item in item_futures or item in item_results or \
+                                not item_images.issubset(image_results):
+                            continue
+                        if item_images & failed_images:
+                            logging.error('Not publishing item %s: its '
+                                          'grader was not deployed.', item)
+                            item_results[item] = ('skipped', 1,
+                                                  time.time() - start)
+                        else:
+                            item_futures[item] = items_pool.submit(
+                                publish_item, item)
+            for item, future in item_futures.items():
+                item_results[item] = future.result()
+    finally:
+        session.auth.close()
+        session.close()
+        cache.save()
+        if grader_registry is not None:
+            grader_registry.close()
+
+    publish.record_publishes(
+        args.course, [(item, item_results[item][0]) for item in item_results
+                      if item_results[item][0] != 'skipped'])
+
+    if not args.quiet or args.quiet == 0:
+        publish.print_status_table(
+            [('image ' + image, ) + (image_results[image][0],
+                                     image_results[image][2])
+             for image in images] +
+            [('item ' + item, ) + (item_results[item][0],
+                                   item_results[item][2])
+             for item in images_of_item],
+            sys.stdout, heading='TARGET')
+    errors = [result[1] for result in image_results.values()] + \
+        [result[1] for result in item_results.values()]
+    return publish.combine_errors(errors) or 0
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the deploy command.
+    parser_deploy = subparsers.add_parser(
+        'deploy',
+        help='Upload, register and attach one or more grader images, wait '
+        'for them to be ready, and publish the items they grade. Every '
+        'image and item moves through these steps independently.')
+    parser_deploy.set_defaults(func=command_deploy, wait=True)
+
+    parser_deploy.add_argument(
+        'course',
+        help='The id of the course containing the items.')
+
+    parser_deploy.add_argument(
+        '--target',
+        nargs=3,
+        action='append',
+        required=True,
+        metavar=('IMAGE', 'ITEM', 'PART'),
+        help='A container image, and the item and part it grades. Repeat '
+        'for more parts or images; each image is uploaded once.')
+
+    upload.setup_grader_options_parser(parser_deploy)
+    upload.setup_transfer_parser(parser_deploy)
+    publish.setup_publish_options_parser(parser_deploy)
+
+    parser_deploy.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='How many images to upload, and items to publish, concurrently '
+        '(default: %(default)s). Graders are waited for independently of '
+        'this limit.')
+
+    return parser_deploy
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from courseraprogramming.commands import common
+from courseraprogramming import layers
+from courseraprogramming import utils
+import fnmatch
+import logging
+import posixpath
+import sys
+
+
+TYPES = {
+    'f': layers.FILE,
+    'd': layers.DIRECTORY,
+    'l': layers.SYMLINK,
+}
+
+
+def find_paths(index, root, name=None, path_pattern=None, file_type=None):
+    """
+    Returns the sorted paths at or below root in the merged image file system
+    matching all of the given criteria.
+    """
+    matches = []
+    for path, entry in index.walk(root):
+        if name is not None and \
+                not fnmatch.fnmatchcase(posixpath.basename(path), name):
+            continue
+        if path_pattern is not None and \
+                not fnmatch.fnmatchcase(path, path_pattern):
+            continue
+        if file_type is not None and \
+                entry[layers.TYPE] != TYPES[file_type]:
+            continue
+        matches.append(path)
+    return matches
+
+
+def command_find(args):
+    "Implements the find subcommand"
+    d = utils.docker_client(args)
+    index = layers.image_index(d, args.imageId, rebuild=args.rebuild_index)
+    if index.lookup(args.path) is None:
+        logging.error("find: '%s': No such file or directory", args.path)
+        return 1
+    matches = find_paths(index, args.path, name=args.name,
+                         path_pattern=args.wholename, file_type=args.type)
+    sys.stdout.write(''.join('%s\n' % path for path in matches))
+    return 0
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the find command
+    parser_find = subparsers.add_parser(
+        'find',
+        help='Search for files by name within your container image without '
+             'running it.',
+        parents=[common.container_parser()])
+    parser_find.set_defaults(func=command_find)
+    parser_find.add_argument(
+        'path',
+        nargs='?',
+        default='/',
+        help='The directory to search. (Default: /)')
+    parser_find.add_argument(
+        '--name',
+        help='Shell-style pattern the file name must match. (e.g. "*.py")')
+    parser_find.add_argument(
+        '--wholename',
+        help='Shell-style pattern the full path must match.')
+    parser_find.add_argument(
+        '--type',
+        choices=sorted(TYPES.keys()),
+        help='Only match files (f), directories (d) or symlinks (l).')
+    parser_find.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file system instead of using the cache.')
+
+    return parser_find
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from courseraprogramming.commands import common
+from courseraprogramming import layers
+from courseraprogramming import utils
+import collections
+import fnmatch
+import logging
+import posixpath
+import re
+import sys
+
+
+# Like grep, a file is considered binary if a NUL byte appears early on.
+BINARY_SNIFF_SIZE = 8000
+
+
+def is_binary(contents):
+    return b'\0' in contents[:BINARY_SNIFF_SIZE]
+
+
+def compile_pattern(args):
+    "Compiles the search pattern to a bytes regular expression."
+    pattern = args.pattern.encode('utf-8')
+    if args.fixed_strings:
+        pattern = re.escape(pattern)
+    return re.compile(pattern, re.IGNORECASE if args.ignore_case else 0)
+
+
+def match_contents(regex, path, contents, search_binary):
+    """
+    Searches the contents of a single file. Returns a list of
+    (path, line number, line) tuples, or a single (path, None, None) tuple if
+    a binary file matched.
+    """
+    binary = is_binary(contents)
+    if binary and not search_binary:
+        return []
+    if binary:
+        return [(path, None, None)] if regex.search(contents) else []
+    matches = []
+    for number, line in enumerate(contents.splitlines(), 1):
+        if regex.search(line):
+            matches.append((path, number, line.decode('utf-8', 'replace')))
+    return matches
+
+
+def grep_image(d, index, args, out):
+    """
+    Streams the image, searching every file below args.path in a pool of
+    threads. Returns the number of files that matched.
+    """
+    regex = compile_pattern(args)
+    # Files are read by their resolved paths, but reported below args.path.
+    shown_root = layers.normalize_path(args.path)
+    root = index.resolve(shown_root)
+    prefix = root.rstrip('/') + '/'
+
+    def shown(path):
+        return shown_root + path[len(root):]
+
+    def want(path, entry):
+        if path != root and not path.startswith(prefix):
+            return False
+        if args.include is not None and \
+                not fnmatch.fnmatchcase(posixpath.basename(path),
+                                        args.include):
+            return False
+        return entry[layers.SIZE] <= args.max_file_size
+
+    results = {}
+    pending = collections.deque()
+    # Bound the file contents held in memory while the pool catches up.
+    max_pending = args.parallelism * 4
+
+    def collect(future):
+        for match in future.result():
+            results.setdefault(match[0], []).append(match)
+
+    with ThreadPoolExecutor(max_workers=args.parallelism) as pool:
+        def visit(path, entry, contents):
+            pending.append(pool.submit(match_contents, regex, shown(path),
+                                       contents, args.binary))
+            while len(pending) > max_pending:
+                collect(pending.popleft())
+
+        layers.read_merged_files(d, index, want, visit)
+        while len(pending) > 0:
+            collect(pending.popleft())
+
+    for path in sorted(results):
+        if args.files_with_matches:
+            out.write('%s\n' % path)
+            continue
+        for _, number, line in results[path]:
+            if number is None:
+                out.write('Binary file %s matches\n' % path)
+            else:
+                out.write('%s:%d:%s\n' % (path, number, line))
+    return len(results)
+
+
+def command_grep(args):
+    "Implements the grep subcommand"
+    d = utils.docker_client(args)
+    index = layers.image_index(d, args.imageId, rebuild=args.rebuild_index)
+    if index.lookup(args.path) is None:
+        logging.error("grep: %s: No such file or directory", args.path)
+        return 2
+    matched = grep_image(d, index, args, sys.stdout)
+    # Mirror grep's exit codes: 0 when something matched, 1 otherwise.
+    return 0 if matched > 0 else 1
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the grep command
+    parser_grep = subparsers.add_parser(
+        'grep',
+        help='Search the contents of the files within your container image '
+             'without running it.',
+        parents=[common.container_parser()])
+    parser_grep.set_defaults(func=command_grep)
+    parser_grep.add_argument(
+        'pattern',
+        help='The regular expression to search for.')
+    parser_grep.add_argument(
+        'path',
+        nargs='?',
+        default='/',
+        help='The file or directory to search. (Default: /)')
+    parser_grep.add_argument(
+        '-i',
+        '--ignore-case',
+        action='store_true',
+        help='Ignore case distinctions.')
+    parser_grep.add_argument(
+        '-F',
+        '--fixed-strings',
+        action='store_true',
+        help='Interpret the pattern as a fixed string.')
+    parser_grep.add_argument(
+        '-l',
+        '--files-with-matches',
+        action='store_true',
+        help='Only print the names of files with matches.')
+    parser_grep.add_argument(
+        '-a',
+        '--binary',
+        action='store_true',
+        help='Also search binary files. (Default: skip them.)')
+    parser_grep.add_argument(
+        '--include',
+        help='Only search files whose name matches this shell-style pattern.')
+    parser_grep.add_argument(
+        '--max-file-size',
+        type=lambda v: utils.check_int_range(v, lower=0),
+        default=16 * 1024 * 1024,
+        help='Skip files larger than this many bytes.')
+    parser_grep.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='Number of threads matching file contents.')
+    parser_grep.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file system instead of using the cache.')
+
+    return parser_grep
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from courseraprogramming import layers
+from courseraprogramming import utils
+import sys
+
+
+ADDED = 'A'
+REMOVED = 'D'
+MODIFIED = 'M'
+
+
+def shared_layer_count(old, new):
+    """
+    Counts the layers at the base of both images with identical digests. The
+    file systems of both images are identical up to the last of them.
+    """
+    count = 0
+    for old_layer, new_layer in zip(old.layers, new.layers):
+        if old_layer['diff_id'] is None or \
+                old_layer['diff_id'] != new_layer['diff_id']:
+            break
+        count += 1
+    return count
+
+
+def _is_directory(entry):
+    return entry is not None and entry[layers.TYPE] == layers.DIRECTORY
+
+
+def _content_key(entry):
+    return (entry[layers.TYPE], entry[layers.SIZE], entry[layers.HASH],
+            entry[layers.LINKNAME], entry[layers.MODE])
+
+
+def diff_indexes(old, new, prefix='/'):
+    """
+    Compares the merged file systems of two images. Returns a sorted list of
+    (change, path, old size, new size) tuples for every added, removed or
+    modified non-directory entry at or below prefix.
+    """
+    shared = shared_layer_count(old, new)
+    root = layers.normalize_path(prefix)
+    below = root.rstrip('/') + '/'
+    old_files = old.files
+    new_files = new.files
+    changes = []
+    for path in set(old_files) | set(new_files):
+        if path != root and not path.startswith(below):
+            continue
+        old_entry = old_files.get(path)
+        new_entry = new_files.get(path)
+        if old_entry is not None and new_entry is not None and \
+                old_entry[-1] == new_entry[-1] and old_entry[-1] < shared:
+            # Provided by the same shared layer in both images.
+            continue
+        # Directories themselves are not reported, only their contents.
+        if _is_directory(old_entry):
+            old_entry = None
+        if _is_directory(new_entry):
+            new_entry = None
+        if old_entry is None and new_entry is None:
+            continue
+        if old_entry is None:
+            changes.append((ADDED, path, 0, new_entry[layers.SIZE]))
+        elif new_entry is None:
+            changes.append((REMOVED, path, old_entry[layers.SIZE], 0))
+        elif _content_key(old_entry) != _content_key(new_entry):
+            changes.append((MODIFIED, path, old_entry[layers.SIZE],
+                            new_entry[layers.SIZE]))
+    return sorted(changes, key=lambda c: c[1])
+
+
+def format_delta(delta):
+    "Formats a signed size delta."
+    sign = '-' if delta < 0 else '+'
+    return '%s%s' % (sign, utils.human_size(abs(delta)))
+
+
+def command_image_diff(args):
+    "Implements the image-diff subcommand"
+    d = utils.docker_client(args)
+    old = layers.image_index(d, args.old, rebuild=args.rebuild_index)
+    new = layers.image_index(d, args.new, rebuild=args.rebuild_index)
+
+    shared = shared_layer_count(old, new)
+    changes = diff_indexes(old, new, args.path)
+    out = sys.stdout
+    for change, path, old_size, new_size in changes:
+        out.write('%s %s (%s)\n' % (change, path,
+                                    format_delta(new_size - old_size)))
+    if not args.quiet or args.quiet == 0:
+        counts = dict((c, 0) for c in (ADDED, REMOVED, MODIFIED))
+        for change in changes:
+            counts[change[0]] += 1
+        out.write(
+            '%d shared layers, %d/%d layers differ. %d added, %d removed, '
+            '%d modified, %s total.\n' % (
+                shared,
+                len(old.layers) - shared,
+                len(new.layers) - shared,
+                counts[ADDED],
+                counts[REMOVED],
+                counts[MODIFIED],
+                format_delta(sum(c[3] - c[2] for c in changes))))
+    return 0
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the image-diff command
+    parser_diff = subparsers.add_parser(
+        'image-diff',
+        help='List the files added, removed or modified between two versions '
+             'of your container image.')
+    parser_diff.set_defaults(func=command_image_diff)
+    parser_diff.add_argument(
+        'old',
+        help='The image id or tag of the previous version. (e.g. the last '
+             'uploaded image)')
+    parser_diff.add_argument(
+        'new',
+        help='The image id or tag of the new version.')
+    parser_diff.add_argument(
+        '--path',
+        default='/',
+        help='Only compare files at or below this path.')
+    parser_diff.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file systems instead of using the cache.')
+
+    return parser_diff
@@ -21,47 +21,93 @@ You may install it from source, or via pip.
 """
 
 from courseraprogramming.commands import common
+from courseraprogramming import layers
 from courseraprogramming import utils
 import logging
+import posixpath
 import sys
+import time
+
+
+def format_entry(args, name, entry):
+    "Formats a single entry of the listing."
+    if not args.l:
+        return name
+    size = entry[layers.SIZE]
+    mtime = time.strftime('%Y-%m-%d %H:%M',
+                          time.gmtime(entry[layers.MTIME]))
+    line = '%s %5s %5s %8s %s %s' % (
+        layers.mode_string(entry),
+        entry[layers.UID],
+        entry[layers.GID],
+        utils.human_size(size) if args.human else size,
+        mtime,
+        name)
+    if entry[layers.TYPE] == layers.SYMLINK:
+        line += ' -> %s' % entry[layers.LINKNAME]
+    return line
+
+
+def list_directory(args, index, path, out):
+    "Writes the listing of the directory at path, returning subdirectories."
+    subdirectories = []
+    for name in index.listdir(path):
+        if name.startswith('.') and not args.a:
+            continue
+        child = posixpath.join(path, name)
+        entry = index.lookup(child, follow=False)
+        out.append(format_entry(args, name, entry))
+        if entry[layers.TYPE] == layers.DIRECTORY:
+            subdirectories.append(child)
+    return subdirectories
+
+
+def list_paths(args, index, paths):
+    "Lists the paths in the style of `ls`. Returns the output lines."
+    out = []
+    files = [p for p in paths
+             if index.lookup(p)[layers.TYPE] != layers.DIRECTORY]
+    directories = [p for p in paths
+                   if index.lookup(p)[layers.TYPE] == layers.DIRECTORY]
+    for path in files:
+        out.append(format_entry(args, path,
+                                index.lookup(path, follow=False)))
+
+    show_headers = args.recursive or len(paths) > 1
+    pending = list(directories)
+    while len(pending) > 0:
+        path = pending.pop(0)
+        if show_headers:
+            if len(out) > 0:
+                out.append('')
+            out.append('%s:' % path)
+        subdirectories = list_directory(args, index, path, out)
+        if args.recursive:
+            pending = subdirectories + pending
+    return out
 
 
 def command_ls(args):
     "Implements the ls subcommand"
     d = utils.docker_client(args)
-    command = []
-    if args.l:
-        command.append('-l')
-    if args.human:
-        command.append('-h')
-    if args.a:
-        command.append('-a')
-    command.append(args.dir)
-    logging.debug("Commands: %s", command)
-    try:
-        container = d.create_container(
-            image=args.imageId,
-            entrypoint="/bin/ls",
-            command=command)
-    except:
-        logging.error(
-            "Could not set up the container to run the ls command in. Most "
-            "likely, this means that you specified an inappropriate container "
-            "id.")
-        raise
-    d.start(container)
-    exit_code = d.wait(container, timeout=2)
-    if exit_code != 0:
-        logging.warn("The ls command did not exit cleanly within the "
-                     "container. Exit code: %s", exit_code)
-
-    command_output = d.logs(container)
-    if type(command_output) is bytes:
-        command_output = command_output.decode("utf-8")
+    index = layers.image_index(d, args.imageId, rebuild=args.rebuild_index)
+
+    if layers.has_magic(args.dir):
+        paths = index.glob(args.dir)
+    elif index.lookup(args.dir) is not None:
+        paths = [layers.normalize_path(args.dir)]
+    else:
+        paths = []
+    logging.debug("Paths to list: %s", paths)
+    if len(paths) == 0:
+        logging.error("ls: cannot access %s: No such file or directory",
+                      args.dir)
+        return 1
+
+    output = list_paths(args, index, paths)
     # Use sys.stdout to avoid extra trailing newline. (Py3.x compatible)
-    sys.stdout.write(command_output)
-    if not args.no_rm:
-        d.remove_container(container)
+    sys.stdout.write(''.join('%s\n' % line for line in output))
+    return 0
 
 
 def parser(subparsers):
@@ -70,8 +116,9 @@ def parser(subparsers):
     # create the parser for the ls command
     parser_ls = subparsers.add_parser(
         'ls',
-        help='Runs the ls command inside your container to check the location \
-            of files within the container.',
+        help='Lists files within your container image to check the location \
+            of files within the container. The image file system is indexed \
+            once per image and cached, so repeated listings are fast.',
         parents=[common.container_parser()])
     parser_ls.set_defaults(func=command_ls)
     parser_ls.add_argument(
@@ -87,12 +134,22 @@ def parser(subparsers):
         '-a',
         action='store_true',
         help='Include "hidden" files in the listing.')
+    parser_ls.add_argument(
+        '-R',
+        '--recursive',
+        action='store_true',
+        help='List subdirectories recursively.')
     parser_ls.add_argument(
         'dir',
-        help='The directory to list. (e.g. /grader)')
+        help='The directory to list. (e.g. /grader) Shell-style wildcards \
+            are supported. (e.g. "/grader/*.py")')
+    parser_ls.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file system instead of using the cache.')
     parser_ls.add_argument(
         '--no-rm',
         action='store_true',
-        help="Don't remove the container after running the ls command.")
+        help="Ignored. ls no longer runs a container.")
 
     return parser_ls
@@ -20,18 +20,31 @@ Helpers for working with OAuth2 / etc.
 
 import http.server
 import configparser
+import contextlib
 import pickle
+import json
 import logging
 import requests
 import io
 import os
 import os.path
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import urllib.parse
 import uuid
 from sys import platform as _platform
+from courseraprogramming import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the token cache is still written atomically, but concurrent
+    # processes may refresh the token more than once.
+    fcntl = None
 
 
 class ExpiredToken(Exception):
@@ -78,6 +91,94 @@ class CourseraOAuth2Auth(requests.auth.AuthBase):
             raise ExpiredToken(self)
 
 
+class RefreshingOAuth2Auth(requests.auth.AuthBase):
+    '''
+    Attaches OAuth2 access tokens to requests, and keeps them fresh for long
+    running or concurrent commands.
+
+    A background timer refreshes the access token refresh_margin seconds
+    before it expires. Concurrent refresh attempts (from the timer, expired
+    tokens, or 401 responses) are coalesced into one token endpoint call. A
+    request rejected with a 401 is retried once with a refreshed token.
+    '''
+
+    def __init__(self, oauth2_instance, refresh_margin=5 * 60):
+        self.oauth2_instance = oauth2_instance
+        self.refresh_margin = refresh_margin
+        self.token = oauth2_instance.token_cache['token']
+        self.expires = oauth2_instance.token_cache['expires']
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._closed:
+            return
+        delay = max(self.expires - self.refresh_margin - time.time(), 0)
+        self._timer = threading.Timer(delay, self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except:
+            logging.warn('Could not refresh the OAuth2 access token in the '
+                         'background.', exc_info=True)
+        else:
+            self._schedule_refresh()
+
+    def close(self):
+        'Stops refreshing the token in the background.'
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def refresh(self, stale_token=None):
+        '''
+        Refreshes the access token. If stale_token is given and another
+        caller already replaced it, its result is used instead.
+        '''
+        with self._refresh_lock:
+            if stale_token is not None and stale_token != self.token:
+                return
+            logging.debug('Refreshing OAuth2 access token.')
+            tokens = self.oauth2_instance.refresh_tokens(self.token)
+            self.token = tokens['token']
+            self.expires = tokens['expires']
+
+    def _authorize(self, request):
+        request.headers['Authorization'] = 'Bearer %(token)s' % {
+            'token': self.token
+        }
+        return request
+
+    def _retry_unauthorized(self, response, **kwargs):
+        'Refreshes the token and retries once when a request gets a 401.'
+        if response.status_code != 401 or \
+                getattr(response.request, '_oauth2_retried', False):
+            return response
+        logging.debug('Got a 401; refreshing the token and retrying.')
+        used = response.request.headers.get('Authorization', '')
+        self.refresh(stale_token=used[len('Bearer '):])
+        # Consume the content so the connection can be reused.
+        response.content
+        response.close()
+        retry = self._authorize(response.request.copy())
+        retry._oauth2_retried = True
+        retried = response.connection.send(retry, **kwargs)
+        retried.history.append(response)
+        retried.request = retry
+        return retried
+
+    def __call__(self, request):
+        if time.time() >= self.expires:
+            self.refresh(stale_token=self.token)
+        request.register_hook('response', self._retry_unauthorized)
+        return self._authorize(request)
+
+
 class CodeHolder:
     'A helper class to hold a token.'
 
@@ -141,6 +242,33 @@ def _make_handler(state_token, done_function):
 
 OAUTH2_URL_BASE = 'https://accounts.coursera.org/oauth2/v1/'
 
+DEFAULT_TOKEN_CACHE = '~/.coursera/oauth2_cache.json'
+DEFAULT_AGENT_SOCKET = '~/.coursera/agent.sock'
+# Seconds to wait for the token agent; it may call the token endpoint.
+AGENT_TIMEOUT = 30
+# Where versions before the JSON token cache kept their tokens.
+LEGACY_TOKEN_CACHE = '~/.coursera/oauth2_cache.pickle'
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    '''
+    Unpickles only builtin containers and values. Token caches never contain
+    anything else, and refusing globals keeps a tampered cache from running
+    code.
+    '''
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(
+            'Refusing to load %s.%s from the token cache.' % (module, name))
+
+
+def _decode_token_cache(data):
+    'Decodes a JSON token cache, or a legacy pickled one.'
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return _RestrictedUnpickler(io.BytesIO(data)).load()
+
 
 class CourseraOAuth2(object):
     '''
@@ -169,7 +297,7 @@ class CourseraOAuth2(object):
                  auth_endpoint=OAUTH2_URL_BASE+'auth',
                  token_endpoint=OAUTH2_URL_BASE+'token',
                  verify_tls=True,
-                 token_cache_file='~/.coursera/oauth2_cache.pickle',
+                 token_cache_file=DEFAULT_TOKEN_CACHE,
                  local_webserver_port=9876):
 
         self.client_id = client_id
@@ -216,13 +344,59 @@ class CourseraOAuth2(object):
         self._token_cache = value
         self._save_token_cache(value)
 
+    @property
+    def _lock_file(self):
+        return self.token_cache_file + '.lock'
+
+    @contextlib.contextmanager
+    def _locked_token_cache(self):
+        '''
+        Holds an exclusive lock on the token cache across processes, so only
+        one of them talks to the token endpoint at a time.
+        '''
+        if fcntl is None:
+            yield
+            return
+        try:
+            lock = open(self._lock_file, 'a')
+        except:
+            logging.debug('Could not open lock file %s. Continuing unlocked.',
+                          self._lock_file, exc_info=True)
+            yield
+            return
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            yield
+        finally:
+            lock.close()
+
+    def _migrate_legacy_token_cache(self):
+        'Converts the pickled token cache of older versions to JSON.'
+        legacy_file = os.path.expanduser(LEGACY_TOKEN_CACHE)
+        if legacy_file == self.token_cache_file or \
+                os.path.exists(self.token_cache_file) or \
+                not os.path.isfile(legacy_file):
+            return
+        logging.debug('Migrating token cache %s to %s', legacy_file,
+                      self.token_cache_file)
+        with open(legacy_file, 'rb') as f:
+            legacy = _decode_token_cache(f.read())
+        if self._check_token_cache_type(legacy):
+            self._save_token_cache(legacy)
+        os.remove(legacy_file)
+
     def _load_token_cache(self):
         'Reads the local fs cache for pre-authorized access tokens'
+        try:
+            self._migrate_legacy_token_cache()
+        except:
+            logging.debug('Could not migrate the legacy token cache.',
+                          exc_info=True)
         try:
             logging.debug('About to read from local file cache file %s',
                           self.token_cache_file)
             with open(self.token_cache_file, 'rb') as f:
-                fs_cached = pickle.load(f)
+                fs_cached = _decode_token_cache(f.read())
                 if self._check_token_cache_type(fs_cached):
                     logging.debug('Loaded from file system: %s', fs_cached)
                     return fs_cached
@@ -242,7 +416,11 @@ class CourseraOAuth2(object):
             return None
 
     def _save_token_cache(self, new_cache):
-        'Write out to the filesystem a cache of the OAuth2 information.'
+        '''
+        Write out to the filesystem a cache of the OAuth2 information. The
+        file is replaced atomically, so concurrent readers never see a
+        partially written cache.
+        '''
         logging.debug('Looking to write to local authentication cache...')
         if not self._check_token_cache_type(new_cache):
             logging.error('Attempt to save a bad value: %s', new_cache)
@@ -250,9 +428,19 @@ class CourseraOAuth2(object):
         try:
             logging.debug('About to write to fs cache file: %s',
                           self.token_cache_file)
-            with open(self.token_cache_file, 'wb') as f:
-                pickle.dump(new_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
-                logging.debug('Finished dumping cache_value to fs cache file.')
+            fd, tmp_name = tempfile.mkstemp(
+                dir=os.path.dirname(self.token_cache_file),
+                prefix='.oauth2_cache.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(new_cache, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, self.token_cache_file)
+            except:
+                os.remove(tmp_name)
+                raise
+            logging.debug('Finished dumping cache_value to fs cache file.')
         except:
             logging.exception(
                 'Could not successfully cache OAuth2 secrets on the file '
@@ -428,23 +616,140 @@ class CourseraOAuth2(object):
 
     def build_authorizer(self):
         if not self._cache_has_good_token():
+            with self._locked_token_cache():
+                # Another process may have refreshed the tokens while we
+                # waited for the lock.
+                self._token_cache = self._load_token_cache()
+                if self._cache_has_good_token():
+                    logging.debug('Another process refreshed the tokens.')
+                else:
+                    self._refresh_token_cache()
+        else:
+            logging.debug('Local cache is good.')
+        return CourseraOAuth2Auth(self.token_cache['token'],
+                                  self.token_cache['expires'])
+
+    def build_refreshing_authorizer(self):
+        '''
+        Builds an authorizer that refreshes its token as needed. Use it for
+        long running or concurrent commands.
+        '''
+        self.build_authorizer()
+        return RefreshingOAuth2Auth(self)
+
+    def refresh_tokens(self, stale_token):
+        '''
+        Replaces the stale access token, unless another process already did,
+        and returns the new token cache.
+        '''
+        with self._locked_token_cache():
+            self._token_cache = self._load_token_cache()
+            if self._cache_has_good_token() and \
+                    self.token_cache['token'] != stale_token:
+                logging.debug('Another process refreshed the tokens.')
+            else:
+                self._refresh_token_cache()
+        return self.token_cache
+
+    def _refresh_token_cache(self):
+        'Obtains new tokens. Must be called with the token cache locked.'
+        with tracing.span(tracing.OAUTH2, 'refresh') as span:
             logging.debug('Attempting to use a refresh token.')
             new_tokens = self._exchange_refresh_tokens()
+            span['status'] = 'refreshed'
             if new_tokens is None:
                 logging.info(
-                    'Attempting to retrieve new tokens from the endpoint. You '
-                    'will be prompted to authorize the courseraprogramming '
-                    'app in your web browser.')
+                    'Attempting to retrieve new tokens from the endpoint. '
+                    'You will be prompted to authorize the '
+                    'courseraprogramming app in your web browser.')
                 new_tokens = self._authorize_new_tokens()
+                span['status'] = 'authorized'
             logging.debug('New tokens: %s', new_tokens)
             self.token_cache = new_tokens
-        else:
-            logging.debug('Local cache is good.')
-        return CourseraOAuth2Auth(self.token_cache['token'],
-                                  self.token_cache['expires'])
 
 
-def build_oauth2(args, cfg=None):
+def agent_request(socket_path, request, timeout=AGENT_TIMEOUT):
+    '''
+    Sends a request to the token agent listening on socket_path, and returns
+    its response. Both are single lines of JSON.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    return json.loads(line.decode('utf-8'))
+
+
+class AgentOAuth2(object):
+    '''
+    Retrieves OAuth2 access tokens from a running `courseraprogramming agent`
+    instead of the token cache. Falls back to the given CourseraOAuth2
+    instance when the agent cannot be reached or refuses the request.
+    '''
+
+    def __init__(self, socket_path, fallback):
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.client_id = fallback.client_id
+        self.scopes = fallback.scopes
+        self.token_cache_file = fallback.token_cache_file
+        self._token_cache = None
+
+    def _request_tokens(self, stale_token=None):
+        request = {
+            'client_id': self.client_id,
+            'scopes': self.scopes,
+            'stale_token': stale_token,
+        }
+        try:
+            with tracing.span(tracing.OAUTH2, 'agent') as span:
+                response = agent_request(self.socket_path, request)
+                span['status'] = 'refused' if 'error' in response else 'ok'
+        except:
+            logging.info('Could not reach the token agent at %s. Using the '
+                         'token cache instead.', self.socket_path)
+            logging.debug('Agent failure.', exc_info=True)
+            return None
+        if 'error' in response:
+            logging.info('The token agent refused the request: %s',
+                         response['error'])
+            return None
+        self._token_cache = {
+            'token': response['token'],
+            'expires': float(response['expires']),
+        }
+        return self._token_cache
+
+    @property
+    def token_cache(self):
+        if self._token_cache is None and self._request_tokens() is None:
+            return self.fallback.token_cache
+        return self._token_cache
+
+    def build_authorizer(self):
+        tokens = self._request_tokens()
+        if tokens is None:
+            return self.fallback.build_authorizer()
+        return CourseraOAuth2Auth(tokens['token'], tokens['expires'])
+
+    def build_refreshing_authorizer(self):
+        if self._request_tokens() is None:
+            return self.fallback.build_refreshing_authorizer()
+        return RefreshingOAuth2Auth(self)
+
+    def refresh_tokens(self, stale_token):
+        tokens = self._request_tokens(stale_token)
+        if tokens is None:
+            return self.fallback.refresh_tokens(stale_token)
+        return tokens
+
+
+def build_oauth2(args, cfg=None, use_agent=True):
     if cfg is None:
         cfg = configuration()
 
@@ -468,16 +773,63 @@ def build_oauth2(args, cfg=None):
     except:
         cache_filename = cfg.get('oauth2', 'token_cache')
 
-    return CourseraOAuth2(
+    oauth2_instance = CourseraOAuth2(
         client_id=client_id,
         client_secret=client_secret,
         scopes=scopes,
         token_cache_file=cache_filename
     )
 
+    try:
+        agent_socket = os.path.expanduser(cfg.get('oauth2', 'agent_socket'))
+    except:
+        agent_socket = None
+    if use_agent and agent_socket is not None and \
+            hasattr(socket, 'AF_UNIX') and os.path.exists(agent_socket):
+        logging.debug('Using the token agent at %s', agent_socket)
+        return AgentOAuth2(agent_socket, oauth2_instance)
+    return oauth2_instance
+
+
+CONFIGURATION_FILES = [
+    '/etc/coursera/courseraprogramming.cfg',
+    '~/.coursera/courseraprogramming.cfg',
+    'courseraprogramming.cfg',
+]
+
+# The parsed configuration, and the state of the files it was parsed from.
+_configuration = (None, None)
+_configuration_lock = threading.Lock()
+
+
+def _configuration_key():
+    key = []
+    for file_name in CONFIGURATION_FILES:
+        file_name = os.path.abspath(os.path.expanduser(file_name))
+        try:
+            st = os.stat(file_name)
+            key.append((file_name, st.st_mtime, st.st_size))
+        except OSError:
+            key.append((file_name, None, None))
+    return tuple(key)
+
 
 def configuration():
-    'Loads configuration from the file system.'
+    '''
+    Loads configuration from the file system. The parsed configuration is
+    kept for as long as the files it was read from do not change, so that
+    commands run by `serve` reuse what the server parsed. It must not be
+    modified.
+    '''
+    global _configuration
+    key = _configuration_key()
+    with _configuration_lock:
+        if _configuration[0] != key:
+            _configuration = (key, _parse_configuration())
+        return _configuration[1]
+
+
+def _parse_configuration():
     defaults = '''
 [oauth2]
 client_id = NS8qaSX18X_Eu0pyNbLsnA
@@ -489,16 +841,17 @@ auth_endpoint = https://accounts.coursera.org/oauth2/v1/auth
 token_endpoint = https://accounts.coursera.org/oauth2/v1/token
 scopes = view_profile manage_graders
 verify_tls = True
-token_cache = ~/.coursera/oauth2_cache.pickle
+token_cache = ~/.coursera/oauth2_cache.json
+agent_socket = ~/.coursera/agent.sock
+
+[registry]
+path = ~/.coursera/registry.sqlite3
 
 [upload]
 transloadit_bored_api = https://api2.transloadit.com/instances/bored
 '''
     cfg = configparser.SafeConfigParser()
     cfg.read_file(io.StringIO(defaults))
-    cfg.read([
-        '/etc/coursera/courseraprogramming.cfg',
-        os.path.expanduser('~/.coursera/courseraprogramming.cfg'),
-        'courseraprogramming.cfg',
-    ])
+    cfg.read([os.path.expanduser(file_name)
+              for file_name in CONFIGURATION_FILES])
     return cfg
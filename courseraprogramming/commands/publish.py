@@ -20,12 +20,21 @@ Coursera's asynchronous grader command line SDK.
 You may install it from source, or via pip.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
+import os.path
 import requests
 import sys
+import tempfile
+import threading
+import time
 
 from courseraprogramming.commands import common
 from courseraprogramming.commands import oauth2
+from courseraprogramming import registry
+from courseraprogramming import utils
 
 
 # Program exit codes to indicate what to do next
@@ -39,12 +48,15 @@ class GraderExecutorStatus:
     PENDING = "PENDING"
     FAILED = "FAILED"
     MISSING = "MISSING"
+    # Any other status means the grader is still being processed.
+    FINISHED = (COMPLETED, FAILED, MISSING)
 
 
 class GraderExecutorError(Exception):
 
-    def __init__(self, status):
+    def __init__(self, status, executor_id=None):
         self.status = status
+        self.executor_id = executor_id
 
 
 class ItemNotFoundError(Exception):
@@ -65,90 +77,363 @@ class ProgrammingAssignmentDraftNotReadyError(Exception):
     pass
 
 
-def command_publish(args):
-    oauth2_instance = oauth2.build_oauth2(args)
-    course_id = args.course
-    item_ids = [args.item] + (getattr(args, 'additional_items') or [])
-    error = None
-    for item_id in item_ids:
-        logging.info("Starting publish for item {} in course {}".format(
-            item_id, course_id))
+AUTHORING_ITEM_CONTENT_RELATIONS_API = \
+    'https://api.coursera.org/api/authoringItemContentRelations.v1'
+
+DEFAULT_PA_ID_CACHE = '~/.coursera/pa_id_cache.json'
+# Item to assignment mappings almost never change; 404s invalidate them early.
+DEFAULT_PA_ID_TTL = 7 * 24 * 60 * 60
+
+
+class AuthoringPaIdCache(object):
+    """
+    Remembers the authoring programming assignment id of (course, item) pairs
+    for ttl seconds, on disk if file_name is given.
+    """
+
+    def __init__(self, file_name=None, ttl=DEFAULT_PA_ID_TTL):
+        self.file_name = file_name
+        self.ttl = ttl
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if file_name is not None and os.path.isfile(file_name):
+            try:
+                with open(file_name) as f:
+                    self.entries = json.load(f)['entries']
+            except:
+                logging.debug('Ignoring unreadable PA id cache %s', file_name)
+
+    def get(self, course_id, item_id):
+        with self.lock:
+            entry = self.entries.get('{}~{}'.format(course_id, item_id))
+        if entry is None or time.time() - entry['resolved'] >= self.ttl:
+            return None
+        return entry['id']
+
+    def put(self, course_id, item_id, authoring_pa_id):
+        with self.lock:
+            self.entries['{}~{}'.format(course_id, item_id)] = {
+                'id': authoring_pa_id,
+                'resolved': time.time(),
+            }
+            self.dirty = True
+
+    def invalidate(self, course_id, item_id):
+        with self.lock:
+            if self.entries.pop('{}~{}'.format(course_id, item_id), None):
+                self.dirty = True
+
+    def save(self):
+        if self.file_name is None or not self.dirty:
+            return
+        now = time.time()
+        with self.lock:
+            entries = dict((key, entry) for key, entry in self.entries.items()
+                           if now - entry['resolved'] < self.ttl)
+        directory = os.path.dirname(self.file_name)
         try:
-            logging.info("Fetching required write access token...")
-            authoring_pa_id = get_authoring_pa_id(
-                oauth2_instance, course_id, item_id)
-            write_access_token = get_write_access_token(
-                oauth2_instance, args.get_endpoint, authoring_pa_id)
-            logging.info("Publishing...")
-            publish_item(
-                oauth2_instance,
+            if not os.path.isdir(directory):
+                os.makedirs(directory, mode=0o700)
+            fd, tmp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'entries': entries}, f)
+            os.replace(tmp_name, self.file_name)
+        except:
+            logging.debug('Could not write PA id cache %s', self.file_name,
+                          exc_info=True)
+
+
+def prefetch_authoring_pa_ids(session, cache, course_id, item_ids):
+    "Resolves all uncached items with one multi-get, if there are several."
+    missing = [item_id for item_id in item_ids
+               if cache.get(course_id, item_id) is None]
+    if len(missing) < 2:
+        return
+    try:
+        resolved = get_authoring_pa_ids(session, course_id, missing)
+    except InternalError:
+        logging.debug('Bulk PA id resolution failed; resolving one by one.')
+        return
+    for item_id, authoring_pa_id in resolved.items():
+        cache.put(course_id, item_id, authoring_pa_id)
+
+
+# Short per-item outcomes for the status table.
+PUBLISHED = 'published'
+
+# Seconds between polls of a pending grader; doubled after every poll.
+INITIAL_POLL_DELAY = 5
+MAX_POLL_DELAY = 60
+
+
+def wait_for_executor(session, executor_endpoint, executor_id, deadline):
+    """
+    Polls the status of a grader executor with exponential backoff until it
+    is no longer PENDING, or until the deadline (a time.time() value) passes.
+    Returns the last status seen.
+    """
+    return wait_for_location(
+        session, '{}/{}'.format(executor_endpoint, executor_id), deadline)
+
+
+def wait_for_location(session, location, deadline, on_status=None):
+    """
+    Like wait_for_executor, for the status API location returned when the
+    grader was registered. on_status, if given, is called with every status
+    that differs from the previous one.
+    """
+    delay = INITIAL_POLL_DELAY
+    last_status = None
+    while True:
+        resp = session.get(location)
+        status = None
+        if resp.status_code == 404:
+            status = GraderExecutorStatus.MISSING
+        elif resp.status_code == 200:
+            status = resp.json()['elements'][0].get('status')
+        else:
+            logging.debug('Unexpected status code %s polling %s',
+                          resp.status_code, location)
+        if status is not None and status != last_status:
+            if on_status is not None:
+                on_status(status)
+            if last_status is not None:
+                # The grader is making progress; look again soon.
+                delay = INITIAL_POLL_DELAY
+            last_status = status
+        if status in GraderExecutorStatus.FINISHED:
+            return status
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return GraderExecutorStatus.PENDING
+        logging.debug('%s is still processing; polling again in %s seconds.',
+                      location, min(delay, remaining))
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_POLL_DELAY)
+
+
+def publish_when_ready(session, args, authoring_pa_id, write_access_token):
+    """
+    Publishes the item, waiting for a pending grader to finish processing
+    until args.wait_timeout seconds have passed.
+    """
+    deadline = time.time() + args.wait_timeout
+    delay = INITIAL_POLL_DELAY
+    while True:
+        try:
+            return publish_item(
+                session,
                 args.publish_endpoint,
                 args.publish_action,
                 authoring_pa_id,
                 write_access_token)
-            logging.info("Publish complete for item {} in course {}".format(
-                item_id, course_id))
-        except ItemNotFoundError as e:
-            logging.error(
-                "Unable to find a publishable assignment with item "
-                "id {}. Maybe there are no changes to publish?".format(
-                    id))
-            error = ErrorCodes.FATAL_ERROR
-        except ValidationError as e:
-            logging.error(
-                "We found some validation errors in your assignment with item "
-                "id {}. Please verify that your assignment is formatted "
-                "correctly and try again.".format(
-                    item_id))
-            error = ErrorCodes.FATAL_ERROR
         except GraderExecutorError as e:
-            if e.status == GraderExecutorStatus.PENDING:
-                logging.warn(
-                    "We are still processing your grader for your assignment "
-                    "with item id {}.  Please try again soon.".format(
-                        item_id))
-                if error != ErrorCodes.FATAL_ERROR:
-                    error = ErrorCodes.RETRYABLE_ERROR
-            elif e.status == GraderExecutorStatus.FAILED:
-                logging.error(
-                    "We were unable to process your grader for your "
-                    "assignment with item id {}.  Please try to upload your "
-                    "grader again. If the problem persists, please let us "
-                    "know.".format(
-                        item_id))
-                error = ErrorCodes.FATAL_ERROR
-            elif e.status == GraderExecutorStatus.MISSING:
-                logging.error(
-                    "We were unable to find your grader for your assignment "
-                    "with item id {}.  Please try to upload your grader "
-                    "again. If the problem persists, please let us "
-                    "know.".format(
-                        item_id))
-                error = ErrorCodes.FATAL_ERROR
-        except InternalError as e:
+            remaining = deadline - time.time()
+            if e.status != GraderExecutorStatus.PENDING or remaining <= 0:
+                raise
+            logging.info("Waiting for the grader of {} to be "
+                         "processed...".format(authoring_pa_id))
+            if e.executor_id is None:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, MAX_POLL_DELAY)
+                continue
+            status = wait_for_executor(
+                session, args.executor_endpoint, e.executor_id, deadline)
+            if status == GraderExecutorStatus.PENDING:
+                raise
+            if status != GraderExecutorStatus.COMPLETED:
+                raise GraderExecutorError(status, e.executor_id)
+
+
+def publish_authoring_pa(session, args, authoring_pa_id):
+    "Fetches the write access token of the assignment and publishes it."
+    logging.info("Fetching required write access token...")
+    write_access_token = get_write_access_token(
+        session, args.get_endpoint, authoring_pa_id)
+    logging.info("Publishing...")
+    if getattr(args, 'wait', False):
+        publish_when_ready(
+            session, args, authoring_pa_id, write_access_token)
+    else:
+        publish_item(
+            session,
+            args.publish_endpoint,
+            args.publish_action,
+            authoring_pa_id,
+            write_access_token)
+
+
+def publish_one(session, args, course_id, item_id, cache=None):
+    """
+    Publishes a single item. Returns a tuple of the outcome (for the status
+    table) and the error code, which is None on success.
+    """
+    if cache is None:
+        cache = AuthoringPaIdCache()
+    logging.info("Starting publish for item {} in course {}".format(
+        item_id, course_id))
+
+    def publish_resolved(authoring_pa_id):
+        try:
+            publish_authoring_pa(session, args, authoring_pa_id)
+        except ItemNotFoundError:
+            # Do not keep an id Coursera does not know for later runs.
+            cache.invalidate(course_id, item_id)
+            raise
+
+    try:
+        authoring_pa_id = cache.get(course_id, item_id)
+        if authoring_pa_id is None:
+            authoring_pa_id = get_authoring_pa_id(
+                session, course_id, item_id)
+            cache.put(course_id, item_id, authoring_pa_id)
+            publish_resolved(authoring_pa_id)
+        else:
+            try:
+                publish_resolved(authoring_pa_id)
+            except ItemNotFoundError:
+                # The cached id may be stale; resolve it again.
+                fresh_pa_id = get_authoring_pa_id(
+                    session, course_id, item_id)
+                if fresh_pa_id == authoring_pa_id:
+                    raise
+                cache.put(course_id, item_id, fresh_pa_id)
+                publish_resolved(fresh_pa_id)
+        logging.info("Publish complete for item {} in course {}".format(
+            item_id, course_id))
+        return PUBLISHED, None
+    except ItemNotFoundError as e:
+        logging.error(
+            "Unable to find a publishable assignment with item "
+            "id {}. Maybe there are no changes to publish?".format(
+                item_id))
+        return 'not found', ErrorCodes.FATAL_ERROR
+    except ValidationError as e:
+        logging.error(
+            "We found some validation errors in your assignment with item "
+            "id {}. Please verify that your assignment is formatted "
+            "correctly and try again.".format(
+                item_id))
+        return 'invalid', ErrorCodes.FATAL_ERROR
+    except GraderExecutorError as e:
+        if e.status == GraderExecutorStatus.PENDING:
+            logging.warn(
+                "We are still processing your grader for your assignment "
+                "with item id {}.  Please try again soon.".format(
+                    item_id))
+            return 'grader pending', ErrorCodes.RETRYABLE_ERROR
+        elif e.status == GraderExecutorStatus.FAILED:
             logging.error(
-                "Something unexpected happened while trying to publish your "
-                "assignment with item id {}. Please verify your course and "
-                "item ids are correct.  If the problem persists, please let "
-                "us know.".format(
+                "We were unable to process your grader for your "
+                "assignment with item id {}.  Please try to upload your "
+                "grader again. If the problem persists, please let us "
+                "know.".format(
                     item_id))
-            error = ErrorCodes.FATAL_ERROR
-        except ProgrammingAssignmentDraftNotReadyError as e:
+            return 'grader failed', ErrorCodes.FATAL_ERROR
+        elif e.status == GraderExecutorStatus.MISSING:
             logging.error(
-                "Your assignment with item id {} is not ready for publish. "
-                "Please verify your assignment draft is ready and try "
-                "again.".format(item_id))
-            error = ErrorCodes.FATAL_ERROR
+                "We were unable to find your grader for your assignment "
+                "with item id {}.  Please try to upload your grader "
+                "again. If the problem persists, please let us "
+                "know.".format(
+                    item_id))
+            return 'grader missing', ErrorCodes.FATAL_ERROR
+        return 'grader %s' % e.status, None
+    except InternalError as e:
+        logging.error(
+            "Something unexpected happened while trying to publish your "
+            "assignment with item id {}. Please verify your course and "
+            "item ids are correct.  If the problem persists, please let "
+            "us know.".format(
+                item_id))
+        return 'internal error', ErrorCodes.FATAL_ERROR
+    except ProgrammingAssignmentDraftNotReadyError as e:
+        logging.error(
+            "Your assignment with item id {} is not ready for publish. "
+            "Please verify your assignment draft is ready and try "
+            "again.".format(item_id))
+        return 'draft not ready', ErrorCodes.FATAL_ERROR
+
+
+def combine_errors(errors):
+    "A fatal error for any item takes precedence over retryable errors."
+    if ErrorCodes.FATAL_ERROR in errors:
+        return ErrorCodes.FATAL_ERROR
+    if ErrorCodes.RETRYABLE_ERROR in errors:
+        return ErrorCodes.RETRYABLE_ERROR
+    return None
+
+
+def print_status_table(results, out, heading='ITEM'):
+    "Writes the outcome and latency of every item."
+    width = max([len(heading)] + [len(item_id) for item_id, _, _ in results])
+    out.write('%-*s  %-16s  %8s\n' % (width, heading, 'STATUS', 'SECONDS'))
+    for item_id, outcome, elapsed in results:
+        out.write('%-*s  %-16s  %8.2f\n' % (width, item_id, outcome, elapsed))
+
+
+def record_publishes(course_id, outcomes):
+    "Records the outcome of publishing each item in the grader registry."
+    grader_registry = registry.open_registry()
+    if grader_registry is None:
+        return
+    for item_id, outcome in outcomes:
+        grader_registry.record_publish(course_id, item_id, outcome)
+    grader_registry.close()
+
+
+def command_publish(args):
+    oauth2_instance = oauth2.build_oauth2(args)
+    course_id = args.course
+    item_ids = [args.item] + (getattr(args, 'additional_items') or [])
+
+    # One session (and its connection pool) and one authorizer, which keeps
+    # its token fresh, are shared by all items.
+    session = requests.Session()
+    session.auth = oauth2_instance.build_refreshing_authorizer()
+
+    cache_file = getattr(args, 'pa_id_cache', None)
+    if cache_file is not None:
+        cache_file = os.path.expanduser(cache_file)
+    cache = AuthoringPaIdCache(
+        cache_file, getattr(args, 'pa_id_cache_ttl', DEFAULT_PA_ID_TTL))
+
+    def timed_publish(item_id):
+        start = time.time()
+        outcome, error = publish_one(
+            session, args, course_id, item_id, cache)
+        return item_id, outcome, error, time.time() - start
+
+    # Waiting items mostly sleep, so poll them all at once: the total time is
+    # bounded by the slowest grader.
+    workers = len(item_ids) if getattr(args, 'wait', False) \
+        else args.parallelism
+    try:
+        prefetch_authoring_pa_ids(session, cache, course_id, item_ids)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(timed_publish, item_ids))
+    finally:
+        session.auth.close()
+        session.close()
+        cache.save()
+
+    record_publishes(course_id, [(item_id, outcome)
+                                 for item_id, outcome, _, _ in results])
+    if not args.quiet or args.quiet == 0:
+        print_status_table(
+            [(item_id, outcome, elapsed)
+             for item_id, outcome, _, elapsed in results],
+            sys.stdout)
+    error = combine_errors([error for _, _, error, _ in results])
     if error is not None:
         sys.exit(error)
 
 
-def get_write_access_token(oauth2_instance, get_endpoint, authoring_pa_id):
-    auth = oauth2_instance.build_authorizer()
-    resp = requests.get(
+def get_write_access_token(session, get_endpoint, authoring_pa_id):
+    resp = session.get(
         '{}/{}?fields=writeAccessToken'.format(
-            get_endpoint, authoring_pa_id),
-        auth=auth)
+            get_endpoint, authoring_pa_id))
     if resp.status_code == 404:
         raise ItemNotFoundError(authoring_pa_id)
     elif resp.status_code == 500:
@@ -159,14 +444,10 @@ def get_write_access_token(oauth2_instance, get_endpoint, authoring_pa_id):
     return pa_authoring['writeAccessToken']
 
 
-def get_authoring_pa_id(oauth2_instance, course_id, item_id):
-    auth = oauth2_instance.build_authorizer()
-    atom_relation_api = 'https://api.coursera.org/api/'
-    'authoringItemContentRelations.v1'
-    resp = requests.get(
+def get_authoring_pa_id(session, course_id, item_id):
+    resp = session.get(
         '{}/{}~{}?fields=atomId'.format(
-            atom_relation_api, course_id, item_id),
-        auth=auth)
+            AUTHORING_ITEM_CONTENT_RELATIONS_API, course_id, item_id))
     if resp.status_code == 404:
         return '{}~{}'.format(course_id, item_id)
     elif resp.status_code == 500:
@@ -174,28 +455,49 @@ def get_authoring_pa_id(oauth2_instance, course_id, item_id):
     return resp.json()['elements'][0]['atomId']
 
 
+def get_authoring_pa_ids(session, course_id, item_ids):
+    '''
+    Resolves the authoring PA ids of several items with one multi-get.
+    Returns a dict keyed by item id; items without a content relation map to
+    course~item, as in get_authoring_pa_id. Returns an empty dict if the
+    multi-get is not answered, so callers resolve items one by one.
+    '''
+    ids = ['{}~{}'.format(course_id, item_id) for item_id in item_ids]
+    resp = session.get(
+        AUTHORING_ITEM_CONTENT_RELATIONS_API,
+        params={'ids': ','.join(ids), 'fields': 'atomId'})
+    if resp.status_code == 500:
+        raise InternalError()
+    elif resp.status_code != 200:
+        return {}
+    found = dict((element['id'], element['atomId'])
+                 for element in resp.json()['elements'])
+    return dict((item_id, found.get(relation_id, relation_id))
+                for item_id, relation_id in zip(item_ids, ids))
+
+
 def publish_item(
-        oauth2_instance,
+        session,
         publish_endpoint,
         publish_action,
         authoring_pa_id,
         write_access_token):
 
-    auth = oauth2_instance.build_authorizer()
     params = {
         "action": publish_action,
         "id": authoring_pa_id
     }
-    resp = requests.post(
-        publish_endpoint, params=params, json=write_access_token, auth=auth)
+    resp = session.post(
+        publish_endpoint, params=params, json=write_access_token)
     if resp.status_code == 400:
         status = get_executor_status(resp.json())
         if status is None:
             raise ValidationError()
         else:
-            raise GraderExecutorError(status)
+            raise GraderExecutorError(
+                status, get_executor_id(resp.json()))
     elif resp.status_code == 404:
-        raise ItemNotFoundError(course_id, item_id)
+        raise ItemNotFoundError(authoring_pa_id)
     elif resp.status_code in (409, 500):
         raise InternalError()
 
@@ -207,6 +509,13 @@ def get_executor_status(resp_body):
         return None
 
 
+def get_executor_id(resp_body):
+    try:
+        return resp_body['details'][0]['id'] or None
+    except (KeyError, IndexError):
+        return None
+
+
 def parser(subparsers):
     "Build an argparse argument parser to parse the command line."
     # create the parser for the publish command.
@@ -231,20 +540,63 @@ def parser(subparsers):
              'published.')
 
     parser_publish.add_argument(
+        '--wait',
+        action='store_true',
+        help='If a grader is still being processed, wait for it and publish '
+        'as soon as it is ready, instead of exiting with a retryable error.')
+
+    setup_publish_options_parser(parser_publish)
+
+    parser_publish.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='How many items to publish concurrently (default: %(default)s).')
+
+    return parser_publish
+
+
+def setup_publish_options_parser(parser):
+    'Adds the publish endpoint, waiting and caching options.'
+
+    parser.add_argument(
         '--get-endpoint',
         default='https://api.coursera.org/api/'
                 'authoringProgrammingAssignments.v2',
         help='Override the endpoint used to get the assignment (draft)')
 
-    parser_publish.add_argument(
+    parser.add_argument(
         '--publish-endpoint',
         default='https://api.coursera.org/api/'
                 'authoringProgrammingAssignments.v2',
         help='Override the endpoint used to publish the assignment (draft)')
 
-    parser_publish.add_argument(
+    parser.add_argument(
         '--publish-action',
         default='publish',
         help='The name of the Naptime action used to publish the assignment')
 
-    return parser_publish
+    parser.add_argument(
+        '--wait-timeout',
+        type=int,
+        default=30 * 60,
+        help='How many seconds to wait for graders with --wait (default: '
+        '%(default)s).')
+
+    parser.add_argument(
+        '--executor-endpoint',
+        default='https://api.coursera.org/api/gridExecutorCreationAttempts.v1',
+        help='Override the endpoint used to poll the status of graders')
+
+    parser.add_argument(
+        '--pa-id-cache',
+        default=DEFAULT_PA_ID_CACHE,
+        help='Where to cache the assignment ids of items (default: '
+        '%(default)s).')
+
+    parser.add_argument(
+        '--pa-id-cache-ttl',
+        type=int,
+        default=DEFAULT_PA_ID_TTL,
+        help='How many seconds cached assignment ids stay valid (default: '
+        '%(default)s). Use 0 to always resolve them again.')
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from courseraprogramming.commands import common
+from courseraprogramming import layers
+from courseraprogramming import utils
+import logging
+import os
+import os.path
+import posixpath
+import shutil
+import stat
+import sys
+import tarfile
+
+
+def local_hash(file_name):
+    "Computes the sha256 of a local file."
+    with open(file_name, 'rb') as f:
+        return layers.hash_contents(f)
+
+
+def is_unchanged(local_path, entry):
+    "Determines if the local copy of a file matches the image's entry."
+    try:
+        st = os.lstat(local_path)
+    except OSError:
+        return False
+    return (stat.S_ISREG(st.st_mode) and
+            st.st_size == entry[layers.SIZE] and
+            int(st.st_mtime) == entry[layers.MTIME] and
+            local_hash(local_path) == entry[layers.HASH])
+
+
+def plan_pull(index, prefix, dest):
+    """
+    Works out what needs to be transferred to mirror prefix into dest.
+    Returns (directories, symlinks, files to fetch, unchanged file count),
+    where the lists hold (image path, local path, entry) tuples.
+    """
+    root = index.resolve(prefix)
+    directories = []
+    symlinks = []
+    fetch = []
+    unchanged = 0
+    for path, entry in index.walk(root):
+        relative = posixpath.relpath(path, posixpath.dirname(root))
+        local_path = os.path.join(dest, *relative.split('/'))
+        if entry[layers.TYPE] == layers.DIRECTORY:
+            directories.append((path, local_path, entry))
+        elif entry[layers.TYPE] == layers.SYMLINK:
+            symlinks.append((path, local_path, entry))
+        elif entry[layers.TYPE] not in (layers.FILE, layers.HARDLINK):
+            logging.debug('Skipping special file %s', path)
+        elif is_unchanged(local_path, entry):
+            unchanged += 1
+        else:
+            fetch.append((path, local_path, entry))
+    return (directories, symlinks, fetch, unchanged)
+
+
+def remove_local(local_path):
+    "Removes whatever is at local_path, if anything, to replace it."
+    if os.path.isdir(local_path) and not os.path.islink(local_path):
+        shutil.rmtree(local_path)
+    elif os.path.lexists(local_path):
+        os.remove(local_path)
+
+
+def finish_file(temp_name, local_path, entry):
+    "Moves a downloaded file into place with the image's mode and mtime."
+    os.chmod(temp_name, stat.S_IMODE(entry[layers.MODE]))
+    os.utime(temp_name, (entry[layers.MTIME], entry[layers.MTIME]))
+    if os.path.isdir(local_path) and not os.path.islink(local_path):
+        shutil.rmtree(local_path)
+    os.rename(temp_name, local_path)
+
+
+def fetch_file(d, container, path, local_path, entry):
+    "Copies a single file out of the container. Returns the bytes copied."
+    temp_name = '%s.pull-%s' % (local_path, os.getpid())
+    try:
+        with open(temp_name, 'wb') as f:
+            size = common.copy_file_from_container(d, container, path, f)
+        finish_file(temp_name, local_path, entry)
+    except:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    return size
+
+
+def fetch_tree(d, container, root, fetch):
+    """
+    Copies the files to fetch out of a single archive of root. Returns the
+    bytes copied.
+    """
+    wanted = dict((path, (local_path, entry))
+                  for path, local_path, entry in fetch)
+    # Where the files read from the archive so far were written to.
+    written = {}
+    links = []
+    transferred = 0
+    stream, _ = d.get_archive(container, root)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|') as archive:
+            for member in archive:
+                path = posixpath.join(posixpath.dirname(root), member.name)
+                if path not in wanted:
+                    continue
+                local_path, entry = wanted[path]
+                if member.islnk():
+                    # The archive only holds the data of the first of the
+                    # hard linked files; copy it once that one is written.
+                    links.append((path, local_path, entry, posixpath.join(
+                        posixpath.dirname(root), member.linkname)))
+                    continue
+                if not member.isfile():
+                    continue
+                temp_name = '%s.pull-%s' % (local_path, os.getpid())
+                with open(temp_name, 'wb') as f:
+                    shutil.copyfileobj(archive.extractfile(member), f,
+                                       common.ARCHIVE_CHUNK_SIZE)
+                finish_file(temp_name, local_path, entry)
+                written[path] = local_path
+                transferred += member.size
+    finally:
+        stream.close()
+    for path, local_path, entry, target in links:
+        if target in written:
+            temp_name = '%s.pull-%s' % (local_path, os.getpid())
+            shutil.copyfile(written[target], temp_name)
+            finish_file(temp_name, local_path, entry)
+        else:
+            transferred += fetch_file(d, container, path, local_path, entry)
+    return transferred
+
+
+def pull(d, index, image, prefix, dest, parallelism):
+    """
+    Mirrors prefix from the image into dest, skipping unchanged files.
+    Returns (files fetched, unchanged files, bytes transferred).
+    """
+    directories, symlinks, fetch, unchanged = plan_pull(index, prefix, dest)
+    for _, local_path, _ in directories:
+        if os.path.islink(local_path) or os.path.isfile(local_path):
+            os.remove(local_path)
+        if not os.path.isdir(local_path):
+            os.makedirs(local_path)
+    for _, local_path, entry in symlinks:
+        target = entry[layers.LINKNAME]
+        if os.path.islink(local_path) and os.readlink(local_path) == target:
+            continue
+        remove_local(local_path)
+        os.symlink(target, local_path)
+    if len(fetch) == 0:
+        return (0, unchanged, 0)
+
+    root = index.resolve(prefix)
+    with common.stopped_container(d, image) as container:
+        if unchanged == 0 and \
+                index.lookup(root)[layers.TYPE] == layers.DIRECTORY:
+            # Nothing to skip: a single archive of the whole tree is cheaper
+            # than one request per file.
+            transferred = fetch_tree(d, container, root, fetch)
+        else:
+            with ThreadPoolExecutor(max_workers=parallelism) as pool:
+                futures = [pool.submit(fetch_file, d, container, *item)
+                           for item in fetch]
+                transferred = sum(future.result() for future in futures)
+    return (len(fetch), unchanged, transferred)
+
+
+def command_pull(args):
+    "Implements the pull subcommand"
+    d = utils.docker_client(args)
+    index = layers.image_index(d, args.imageId, rebuild=args.rebuild_index)
+    if index.lookup(args.path) is None:
+        logging.error('pull: %s: No such file or directory', args.path)
+        return 1
+    dest = os.path.abspath(os.path.expanduser(args.dest))
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    fetched, unchanged, transferred = pull(
+        d, index, index.image_id, args.path, dest, args.parallelism)
+    if not args.quiet or args.quiet == 0:
+        sys.stdout.write(
+            'Pulled %d files (%s transferred), %d unchanged files '
+            'skipped.\n' % (fetched, utils.human_size(transferred),
+                            unchanged))
+    return 0
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the pull command
+    parser_pull = subparsers.add_parser(
+        'pull',
+        help='Copy a file or directory out of your container image into a '
+             'local directory. Running it again only transfers changed '
+             'files.',
+        parents=[common.container_parser()])
+    parser_pull.set_defaults(func=command_pull)
+    parser_pull.add_argument(
+        'path',
+        help='The file or directory within the image to copy. (e.g. /grader)')
+    parser_pull.add_argument(
+        'dest',
+        help='The local directory to copy into. The last component of path '
+             'is created within it.')
+    parser_pull.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='Maximum number of files to fetch from the image concurrently.')
+    parser_pull.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Re-index the image file system instead of using the cache.')
+
+    return parser_pull
@@ -14,47 +14,321 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
 from courseraprogramming.commands.upload import register_grader
 from courseraprogramming.commands.upload import setup_registration_parser
+from courseraprogramming.commands.upload import update_assignment
 from courseraprogramming.commands.upload import update_assignments
 from courseraprogramming.commands import common
 from courseraprogramming.commands import oauth2
+from courseraprogramming import registry
 from courseraprogramming import utils
 
 import json
 import logging
+import os
 import requests
+import sys
+import tempfile
+import threading
+import time
 
+DEFAULT_CHECKPOINT_FILE = '~/.coursera/reregister_%s.json'
+LIST_PAGE_SIZE = 100
 
-def command_reregister(args):
-    "Implements the reregister command."
 
-    oauth2_instance = oauth2.build_oauth2(args)
-    auth = oauth2_instance.build_authorizer()
+class ReregisterError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+    Spaces out requests so that no more than `rate` start every second,
+    however many threads make them.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint(object):
+    """
+    Records which graders of a course were already reregistered, and the ids
+    of their replacements, so an interrupted run can pick up where it
+    stopped. It is saved after every grader.
+    """
+
+    def __init__(self, file_name, course_id):
+        self.file_name = file_name
+        self.course_id = course_id
+        self.lock = threading.Lock()
+        self.reregistered = {}
+        try:
+            with open(file_name) as f:
+                data = json.load(f)
+        except:
+            return
+        if data.get('courseId') != course_id:
+            logging.warn('Ignoring checkpoint %s: it is for course %s.',
+                         file_name, data.get('courseId'))
+            return
+        self.reregistered = data.get('reregistered', {})
+        logging.info('Resuming from %s: %s graders already reregistered.',
+                     file_name, len(self.reregistered))
+
+    def is_done(self, grader_id):
+        """
+        True for graders already reregistered, and for the graders that
+        replaced them, which the listing now includes too.
+        """
+        with self.lock:
+            return grader_id in self.reregistered or \
+                grader_id in self.reregistered.values()
+
+    def put(self, grader_id, new_grader_id):
+        with self.lock:
+            self.reregistered[grader_id] = new_grader_id
+            self.save()
 
-    # retrieve the currentGraderId
-    url = args.register_endpoint + '/' + args.currentGraderId
-    result = requests.get(
-        args.register_endpoint + '/' + args.currentGraderId,
-        auth=auth)
+    def save(self):
+        directory = os.path.dirname(self.file_name)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, mode=0o700)
+            fd, tmp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'courseId': self.course_id,
+                    'reregistered': self.reregistered,
+                }, f, indent=2, sort_keys=True)
+            os.replace(tmp_name, self.file_name)
+        except:
+            logging.warn('Could not write checkpoint %s', self.file_name,
+                         exc_info=True)
 
+
+def list_course_graders(session, register_endpoint, course_id, limiter):
+    "Pages through the executor listing API for all graders of the course."
+    return [element['id'] for element in list_course_executors(
+        session, register_endpoint, course_id, limiter)]
+
+
+def list_course_executors(session, register_endpoint, course_id, limiter):
+    "Like list_course_graders, returning the listed elements."
+    elements = []
+    start = None
+    while True:
+        params = {
+            'q': 'listByCourse',
+            'courseId': course_id,
+            'limit': LIST_PAGE_SIZE,
+        }
+        if start is not None:
+            params['start'] = start
+        limiter.wait()
+        result = session.get(register_endpoint, params=params)
+        if result.status_code != 200:
+            raise ReregisterError(
+                'Unable to list the graders of course %s! Code: %s' %
+                (course_id, result.status_code))
+        body = result.json()
+        elements.extend(body['elements'])
+        start = body.get('paging', {}).get('next')
+        if start is None:
+            return elements
+
+
+def get_grader_location(session, register_endpoint, grader_id,
+                        grader_registry=None):
+    """
+    Returns the S3 bucket and key of an uploaded grader, from the registry if
+    it knows them.
+    """
+    if grader_registry is not None:
+        grader = grader_registry.grader(grader_id)
+        if grader is not None and grader['bucket'] and grader['key']:
+            logging.debug('Found grader %s in the registry.', grader_id)
+            return grader['bucket'], grader['key']
+    result = session.get(register_endpoint + '/' + grader_id)
     if result.status_code != 200:
-        logging.error(
-            'Unable to retrieve grader details with id! Code: %s',
+        raise ReregisterError(
+            'Unable to retrieve grader details with id! Code: %s' %
             result.status_code)
+    try:
+        element = result.json()['elements'][0]
+        return element['bucket'], element['key']
+    except:
+        raise ReregisterError(
+            'Cannot parse the response from the grader details endpoint: %s'
+            % result.text)
+
+
+def record_replacement(grader_registry, args, grader_id, new_grader_id):
+    if grader_registry is not None:
+        grader_registry.record_grader(args.course, new_grader_id,
+                                      replaces=grader_id)
+
+
+def parts_by_grader(grader_registry, course_id, grader_ids):
+    """
+    Maps every listed grader that assignment parts of the course use, as the
+    registry knows them, to a list of its (item, part) tuples.
+    """
+    parts = {}
+    for _, item_id, part_id, executor_id in grader_registry.parts(course_id):
+        if executor_id in grader_ids:
+            parts.setdefault(executor_id, []).append((item_id, part_id))
+        else:
+            logging.warn('Part %s of item %s uses grader %s, which is not '
+                         'listed for the course.', part_id, item_id,
+                         executor_id)
+    return parts
+
+
+def reregister_course(args):
+    """
+    Reregisters every grader that assignment parts of a course use with the
+    current resource options, and updates the parts to the new graders.
+    Which parts use which graders comes from the grader registry (see
+    `sync`).
+    """
+    course_id = args.course_all
+    args.course = course_id
+    checkpoint_file = os.path.expanduser(
+        args.checkpoint_file or DEFAULT_CHECKPOINT_FILE % course_id)
+    checkpoint = Checkpoint(checkpoint_file, course_id)
+    limiter = RateLimiter(args.rate)
+
+    grader_registry = registry.open_registry()
+    if grader_registry is None:
+        logging.error('--course-all needs the grader registry to know which '
+                      'parts use which graders.')
         return 1
+    oauth2_instance = oauth2.build_oauth2(args)
+    session = requests.Session()
+    session.auth = oauth2_instance.build_refreshing_authorizer()
+    progress = {'done': 0}
+    progress_lock = threading.Lock()
+
+    def reregister_one(grader_id):
+        new_grader_id = None
+        try:
+            limiter.wait()
+            bucket, key = get_grader_location(
+                session, args.register_endpoint, grader_id, grader_registry)
+            limiter.wait()
+            new_grader_id = register_grader(
+                session.auth, args, bucket, key, registry_db=grader_registry)
+            record_replacement(grader_registry, args, grader_id,
+                               new_grader_id)
+            failed_parts = 0
+            for item_id, part_id in parts[grader_id]:
+                limiter.wait()
+                if update_assignment(session.auth, new_grader_id, args,
+                                     item_id, part_id,
+                                     registry_db=grader_registry) != 0:
+                    failed_parts += 1
+            if failed_parts:
+                # Not checkpointed, so the next run retries the grader.
+                result = (grader_id, new_grader_id,
+                          '%s parts not updated' % failed_parts)
+            else:
+                checkpoint.put(grader_id, new_grader_id)
+                result = (grader_id, new_grader_id, None)
+        except ReregisterError as e:
+            logging.error('%s: %s', grader_id, e)
+            result = (grader_id, new_grader_id, 'failed')
+        except:
+            logging.exception('%s: reregistering failed.', grader_id)
+            result = (grader_id, new_grader_id, 'failed')
+        with progress_lock:
+            progress['done'] += 1
+            logging.info('[%s/%s] %s: %s', progress['done'], len(pending),
+                         grader_id, result[2] or result[1])
+        return result
 
     try:
-        s3bucket = result.json()['elements'][0]['bucket']
-        s3key = result.json()['elements'][0]['key']
-    except:
-        logging.error(
-            'Cannot parse the response from the grader details'
-            'endpoint: %s', result.text)
+        grader_ids = list_course_graders(
+            session, args.register_endpoint, course_id, limiter)
+        parts = parts_by_grader(grader_registry, course_id, set(grader_ids))
+        if not parts:
+            logging.error(
+                'The grader registry knows no part of course %s that uses '
+                'one of its %s graders, so there is nothing to reregister. '
+                'Parts are recorded by upload, deploy and reregister run '
+                'with this registry.', course_id, len(grader_ids))
+            return 1
+        pending = [grader_id for grader_id in grader_ids
+                   if grader_id in parts and not checkpoint.is_done(grader_id)]
+        logging.info('Reregistering %s of the %s graders of course %s; '
+                     '%s graders are not used by any known part.',
+                     len(pending), len(grader_ids), course_id,
+                     len(grader_ids) - len(parts))
+        with ThreadPoolExecutor(max_workers=args.parallelism) as executor:
+            results = list(executor.map(reregister_one, pending))
+    except ReregisterError as e:
+        logging.error('%s', e)
+        return 1
+    finally:
+        session.auth.close()
+        session.close()
+        grader_registry.close()
+
+    if not args.quiet or args.quiet == 0:
+        width = max([len('GRADER')] + [len(r[0]) for r in results])
+        sys.stdout.write('%-*s  %s\n' % (width, 'GRADER', 'NEW GRADER'))
+        for grader_id, new_grader_id, error in results:
+            sys.stdout.write('%-*s  %s\n' % (
+                width, grader_id,
+                ' '.join(v for v in (new_grader_id, error) if v)))
+    return 1 if any(error for _, _, error in results) else 0
+
+
+def command_reregister(args):
+    "Implements the reregister command."
+
+    if args.course_all is not None:
+        if args.currentGraderId is not None:
+            logging.error('Give either a grader id or --course-all.')
+            return 1
+        return reregister_course(args)
+    if None in (args.currentGraderId, args.course, args.item, args.part):
+        logging.error('A grader id, course, item and part are required.')
         return 1
 
-    grader_id = register_grader(auth, args, s3bucket, s3key)
-    return update_assignments(auth, grader_id, args)
+    oauth2_instance = oauth2.build_oauth2(args)
+    session = requests.Session()
+    session.auth = oauth2_instance.build_authorizer()
+    grader_registry = registry.open_registry()
+
+    try:
+        # retrieve the currentGraderId
+        s3bucket, s3key = get_grader_location(
+            session, args.register_endpoint, args.currentGraderId,
+            grader_registry)
+        grader_id = register_grader(session.auth, args, s3bucket, s3key,
+                                    registry_db=grader_registry)
+        record_replacement(grader_registry, args, args.currentGraderId,
+                           grader_id)
+        return update_assignments(session.auth, grader_id, args,
+                                  registry_db=grader_registry)
+    except ReregisterError as e:
+        logging.error('%s', e)
+        return 1
+    finally:
+        session.close()
+        if grader_registry is not None:
+            grader_registry.close()
 
 
 def parser(subparsers):
@@ -68,6 +342,7 @@ def parser(subparsers):
 
     parser_reregister.add_argument(
         'currentGraderId',
+        nargs='?',
         help='The id of the grader already in the system which you want to '
         'reregister. The executorId is an double-length UUID in the form of '
         'Kvns6O3tQHuk5tBZc0DJOE~z8VsfYIYEeWxFFoymFg8zQ. '
@@ -76,6 +351,34 @@ def parser(subparsers):
         'https://api.coursera.org/api/gridExecutorCreationAttempts.v1?'
         'q=listByCourse&courseId=<<COURSEID>>')
 
-    setup_registration_parser(parser_reregister)
+    setup_registration_parser(parser_reregister, nargs='?')
+
+    parser_reregister.add_argument(
+        '--course-all',
+        metavar='COURSE_ID',
+        help='Reregister every grader that assignment parts of the course '
+        'use, and update the parts to the new graders, instead of a single '
+        'grader. No grader id, course, item or part is given. Which parts use '
+        'which graders is read from the grader registry (see sync).')
+
+    parser_reregister.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='How many graders to reregister concurrently with --course-all '
+        '(default: %(default)s).')
+
+    parser_reregister.add_argument(
+        '--rate',
+        type=float,
+        default=5.0,
+        help='The most requests per second to send with --course-all, or 0 '
+        'for no limit (default: %(default)s).')
+
+    parser_reregister.add_argument(
+        '--checkpoint-file',
+        help='Where --course-all records its progress, so that an '
+        'interrupted run can be resumed by running it again (default: '
+        '~/.coursera/reregister_COURSE_ID.json).')
 
     return parser_reregister
@@ -20,89 +20,972 @@ Coursera's asynchronous grader command line SDK.
 You may install it from source, or via pip.
 """
 
-from dockerfile_parse import DockerfileParser
+
+from concurrent.futures import ThreadPoolExecutor
+from courseraprogramming import layers
 from courseraprogramming import utils
+from courseraprogramming.commands import analyze
+from courseraprogramming.commands import common
+from courseraprogramming.commands import grade
+from dockerfile_parse import DockerfileParser
+import hashlib
+import io
+import json
 import logging
-import semver
+import os
+import os.path
+import posixpath
+import re
+from requests.exceptions import ReadTimeout
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
 
 
-def command_sanity(args):
-    "Implements the sanity subcommand"
-    # Sanity check should:
-    #   - Check docker versions
-    #   - Check for existance of entrypoint (that isn't /bin/bash)
-    #   - Check over copy commands // make sure they look reasonable.
-    #   - Check the entrypoint if it's a shell script for keywords like "sudo"
-    #     or chroot.
-    if not args.skip_environment:
-        logging.info("Checking local docker demon...")
-        conn = utils.docker_client(args)
-        docker_version = conn.version()
-        logging.info("Docker version: %s", docker_version["Version"])
-
-    if "docker_file" in args and args.docker_file is not None:
+# RUN instructions matching this install packages or other dependencies.
+DEPENDENCY_INSTALL = re.compile(
+    r'\b(apt-get|apt|apk|yum|dnf|pip[0-9.]*|conda|npm|yarn|gem|bundle)'
+    r'\s+(-\S+\s+)*(install|add|ci)\b')
+APT_GET = re.compile(r'\bapt(-get)?\s+(-\S+\s+)*(update|install)\b')
+PIP_INSTALL = re.compile(r'\bpip[0-9.]*\s+(-\S+\s+)*install\b')
+
+# Rough sizes used to estimate the impact of the performance checks.
+APT_LISTS_SIZE_MB = 20
+PIP_CACHE_SIZE_MB = 30
+MAX_CONSECUTIVE_RUNS = 3
+# Instructions that create a filesystem layer.
+LAYER_INSTRUCTIONS = ('run', 'copy', 'add')
+WASTED_SIZE_LIMIT = 10 * 1024 * 1024
+
+# Programs that run the script given as their argument.
+INTERPRETER = re.compile(
+    r'^(.*/)?(sh|bash|dash|ash|zsh|env|python[0-9.]*|perl|ruby|node)$')
+# Paths of scripts referenced from an ENTRYPOINT or from another script.
+SCRIPT_PATH = re.compile(
+    r'(?:^|(?<=[\s"\'=(]))((?:\.{0,2}/)?[\w./-]*\w\.(?:sh|bash|py|pl|rb))\b')
+# A command at the start of a line, after a shell operator or keyword, or as
+# the first item of an argument list. Quotes alone do not start a command, so
+# that `echo "make sure..."` is not mistaken for a call to make.
+_COMMAND_START = (r'(?:^|[;&|(`]|\b(?:then|do|else|exec|sudo)\s+|'
+                  r'\[\s*["\']|\bpython[0-9.]*\s+-m\s+)\s*')
+# Work that does not belong in a grader run, and whether it needs network.
+RUNTIME_SLOW_PATHS = [
+    (re.compile(_COMMAND_START + r'(pip[0-9.]*|conda|npm|yarn|gem)'
+                r'\s+(-\S+\s+)*install\b'),
+     'installs packages', True),
+    (re.compile(_COMMAND_START + r'(apt(-get)?\s+(-\S+\s+)*'
+                r'(update|install)|(yum|dnf|apk)\s+(-\S+\s+)*(install|add))'
+                r'\b'),
+     'installs system packages', True),
+    (re.compile(_COMMAND_START + r'(curl|wget)\b'),
+     'downloads files', True),
+    (re.compile(_COMMAND_START + r'(gcc|g\+\+|cc|clang|make|cmake|javac|'
+                r'rustc|cargo\s+build|go\s+build|mvn|gradle)\b'),
+     'compiles code', False),
+]
+MAX_SCRIPTS = 16
+MAX_SCRIPT_SIZE = 1024 * 1024
+
+DEFAULT_CACHE_FILE = '~/.coursera/sanity_cache.json'
+
+# Bump when rules change in a way that invalidates cached findings.
+CACHE_VERSION = 2
+MAX_CACHE_ENTRIES = 256
+
+# The inputs a rule may declare.
+DOCKERFILE = 'dockerfile'
+IMAGE_CONFIG = 'image_config'
+LAYER_INDEX = 'layer_index'
+DAEMON_INFO = 'daemon_info'
+STARTUP_TIMINGS = 'startup_timings'
+ENTRYPOINT_SCRIPTS = 'entrypoint_scripts'
+
+# Inputs used after all others are done, so that their work does not skew
+# timings.
+EXCLUSIVE_INPUTS = (STARTUP_TIMINGS,)
+
+LEVEL_NAMES = {
+    logging.ERROR: 'error',
+    logging.WARNING: 'warning',
+    logging.INFO: 'info',
+}
+
+
+class Finding(object):
+    """
+    A single result of a sanity rule. impact estimates its cost: bytes for
+    findings about image size, layers for findings about layers, and seconds
+    for findings about latency.
+    """
+
+    def __init__(self, level, message, line=None, end_line=None,
+                 impact=None, rule=None):
+        self.level = level
+        self.message = message
+        self.line = line
+        self.end_line = end_line
+        self.impact = impact
+        self.rule = rule
+
+    def text(self):
+        "Renders the finding the way it is logged."
+        if self.line is None:
+            return self.message
+        if self.end_line is not None:
+            return 'Lines %s-%s: %s' % (self.line, self.end_line, self.message)
+        return 'Line %s: %s' % (self.line, self.message)
+
+    def to_dict(self):
+        return {
+            'rule': self.rule,
+            'level': LEVEL_NAMES.get(self.level, 'info'),
+            'line': self.line,
+            'end_line': self.end_line,
+            'message': self.message,
+            'impact': self.impact,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        levels = dict((name, level) for level, name in LEVEL_NAMES.items())
+        return cls(levels[data['level']], data['message'], data['line'],
+                   data['end_line'], data['impact'], data['rule'])
+
+
+class Rule(object):
+    "A registered sanity check and the inputs it needs."
+
+    def __init__(self, name, inputs, check, cache=True):
+        self.name = name
+        self.inputs = inputs
+        self.check = check
+        self.cache = cache
+
+
+RULES = []
+
+
+def rule(name, *inputs, cache=True):
+    """
+    Registers a sanity rule. The decorated function is called with the
+    declared inputs in order, and returns a list of findings. Rules whose
+    results depend on more than their inputs must pass cache=False.
+    """
+    def register(check):
+        RULES.append(Rule(name, inputs, check, cache))
+        return check
+    return register
+
+
+def warning(message, line=None, end_line=None, impact=None):
+    return Finding(logging.WARNING, message, line, end_line, impact)
+
+
+def info(message, line=None, impact=None):
+    return Finding(logging.INFO, message, line, impact=impact)
+
+
+class Dockerfile(object):
+    "The parsed Dockerfile input."
+
+    def __init__(self, path, structure, content, has_dockerignore,
+                 context_size=None):
+        self.path = path
+        self.structure = structure
+        self.content = content
+        self.has_dockerignore = has_dockerignore
+        # The bytes in the build context, if known.
+        self.context_size = context_size
+
+    def instructions(self, *names):
+        return [cmd for cmd in self.structure
+                if cmd['instruction'].lower() in names]
+
+
+def copy_arguments(value):
+    "Splits the arguments of a COPY or ADD instruction, dropping flags."
+    if value.startswith('['):
         try:
-            docker_file = DockerfileParser(args.docker_file)
-        except:
-            logging.error("Could not parse Dockerfile at: %s",
-                          args.docker_file)
-        else:
-            structure = docker_file.structure
-            seen_entrypoint = False
-            for cmd in structure:
-                if cmd['instruction'].lower() == 'copy':
-                    if not cmd['value'].startswith('/'):
-                        logging.warn(
-                            'Line %(lineno)s: Copy destination should always '
-                            'start with a /.', {
-                                "lineno": cmd['startline'],
-                            })
-                if cmd['instruction'].lower() == 'from':
-                    if "ubuntu" in cmd['value']:
-                        logging.info(
-                            'Line %(lineno)s: We recommend using '
-                            'debian, or other smaller base images.', {
-                                "lineno": cmd['startline'],
-                            })
-                if cmd['instruction'].lower() == 'entrypoint':
-                    if seen_entrypoint:
-                        logging.warn(
-                            'Line %(lineno)s: Re-defining entrypoint '
-                            'of container.', {
-                                "lineno": cmd['startline'],
-                            })
-                    seen_entrypoint = True
-                    if 'bash' in cmd['value']:
-                        logging.warn(
-                            'Line %(lineno)s: Please mark your grading script '
-                            'or binary as the ENTRYPOINT, and not bash', {
-                                'lineno': cmd['startline'],
-                            })
-                if cmd['instruction'].lower() == 'expose':
-                    logging.warn(
-                        'Line %(lineno)s: EXPOSE commands do not work for '
-                        'graders', {
-                            'lineno': cmd['startline'],
-                        })
-                if cmd['instruction'].lower() == 'env':
-                    logging.warn(
-                        'Line %(lineno)s: ENV-based environment variables are '
-                        'stripped in the production environment for security '
-                        'reasons. Please set any environment variables you '
-                        'need in your grading script.', {
-                            'lineno': cmd['startline'],
-                        })
-                if cmd['instruction'].lower() == 'volume':
-                    logging.warn(
-                        'Line %(lineno)s: VOLUME commands are stripped in '
-                        'the production environment, and will likely not work '
-                        'as expected.', {
-                            'lineno': cmd['startline'],
-                        })
-            if not seen_entrypoint:
-                logging.warn('Your Dockerfile must define an ENTRYPOINT.')
+            args = json.loads(value)
+        except ValueError:
+            return []
     else:
+        args = value.split()
+    return [a for a in args if not a.startswith('--')]
+
+
+def copy_sources(value):
+    "Extracts the source paths of a COPY or ADD instruction."
+    return copy_arguments(value)[:-1]
+
+
+def copy_destination(value):
+    "Extracts the destination path of a COPY or ADD instruction."
+    args = copy_arguments(value)
+    return args[-1] if args else ''
+
+
+def copies_whole_context(cmd):
+    "Determines if a COPY or ADD instruction copies the whole build context."
+    if '--from=' in cmd['value']:
+        return False
+    return any(src in ('.', './', '*') for src in copy_sources(cmd['value']))
+
+
+def context_copy(dockerfile):
+    "Returns the first instruction copying the whole build context, if any."
+    for cmd in dockerfile.instructions('copy', 'add'):
+        if copies_whole_context(cmd):
+            return cmd
+    return None
+
+
+@rule('docker-version', DAEMON_INFO)
+def check_docker_version(version):
+    return [info('Docker version: %s' % version['Version'])]
+
+
+@rule('base-image', DOCKERFILE)
+def check_base_image(dockerfile):
+    return [info('We recommend using debian, or other smaller base images.',
+                 cmd['startline'])
+            for cmd in dockerfile.instructions('from')
+            if 'ubuntu' in cmd['value']]
+
+
+@rule('apt-lists', DOCKERFILE)
+def check_apt_lists(dockerfile):
+    return [warning('apt-get without `rm -rf /var/lib/apt/lists/*` in the '
+                    'same RUN leaves about %s MB of package lists in the '
+                    'layer.' % APT_LISTS_SIZE_MB, cmd['startline'],
+                    impact=APT_LISTS_SIZE_MB * 1024 * 1024)
+            for cmd in dockerfile.instructions('run')
+            if APT_GET.search(cmd['value']) and
+            '/var/lib/apt/lists' not in cmd['value']]
+
+
+@rule('pip-cache', DOCKERFILE)
+def check_pip_cache(dockerfile):
+    findings = []
+    for cmd in dockerfile.instructions('run', 'env'):
+        if cmd['instruction'].lower() == 'env':
+            if 'PIP_NO_CACHE_DIR' in cmd['value']:
+                break
+        elif PIP_INSTALL.search(cmd['value']) and \
+                '--no-cache-dir' not in cmd['value']:
+            findings.append(warning(
+                'pip install without --no-cache-dir keeps a second copy of '
+                'every downloaded package in the layer, often tens of MB.',
+                cmd['startline'], impact=PIP_CACHE_SIZE_MB * 1024 * 1024))
+    return findings
+
+
+@rule('dependency-order', DOCKERFILE)
+def check_dependency_order(dockerfile):
+    copy = context_copy(dockerfile)
+    if copy is None:
+        return []
+    structure = dockerfile.structure
+    findings = []
+    for position, cmd in enumerate(structure):
+        if position > structure.index(copy) and \
+                cmd['instruction'].lower() == 'run' and \
+                DEPENDENCY_INSTALL.search(cmd['value']):
+            # The layers a source change invalidates, from this one up.
+            invalidated = len([c for c in structure[position:]
+                               if c['instruction'].lower() in
+                               LAYER_INSTRUCTIONS])
+            findings.append(warning(
+                'Dependencies are installed after the whole build context is '
+                'copied on line %(copy_lineno)s, so any source change '
+                'rebuilds and re-uploads this layer and the %(later)s '
+                'instructions after it. Copy only the dependency manifests '
+                'before installing.' % {
+                    'copy_lineno': copy['startline'],
+                    'later': len(structure) - 1 - position,
+                }, cmd['startline'], impact=invalidated))
+    return findings
+
+
+@rule('consecutive-runs', DOCKERFILE)
+def check_consecutive_runs(dockerfile):
+    findings = []
+    runs = []
+    for cmd in dockerfile.structure + [{'instruction': ''}]:
+        if cmd['instruction'].lower() == 'run':
+            runs.append(cmd)
+            continue
+        if len(runs) >= MAX_CONSECUTIVE_RUNS:
+            findings.append(warning(
+                '%(count)s consecutive RUN instructions create %(count)s '
+                'layers. Combining them with && saves %(saved)s layers, and '
+                'keeps files deleted by a later step out of the image.' % {
+                    'count': len(runs),
+                    'saved': len(runs) - 1,
+                }, runs[0]['startline'], runs[-1]['startline'],
+                impact=len(runs) - 1))
+        runs = []
+    return findings
+
+
+@rule('copy-destination', DOCKERFILE)
+def check_copy_destination(dockerfile):
+    return [warning('Copy destination should always start with a /.',
+                    cmd['startline'])
+            for cmd in dockerfile.instructions('copy')
+            if not copy_destination(cmd['value']).startswith('/')]
+
+
+@rule('entrypoint', DOCKERFILE)
+def check_entrypoint(dockerfile):
+    findings = []
+    entrypoints = dockerfile.instructions('entrypoint')
+    for cmd in entrypoints[1:]:
+        findings.append(warning('Re-defining entrypoint of container.',
+                                cmd['startline']))
+    for cmd in entrypoints:
+        if 'bash' in cmd['value']:
+            findings.append(warning(
+                'Please mark your grading script or binary as the '
+                'ENTRYPOINT, and not bash', cmd['startline']))
+    if not entrypoints:
+        findings.append(warning('Your Dockerfile must define an ENTRYPOINT.'))
+    return findings
+
+
+@rule('expose', DOCKERFILE)
+def check_expose(dockerfile):
+    return [warning('EXPOSE commands do not work for graders',
+                    cmd['startline'])
+            for cmd in dockerfile.instructions('expose')]
+
+
+@rule('env', DOCKERFILE)
+def check_env(dockerfile):
+    return [warning('ENV-based environment variables are stripped in the '
+                    'production environment for security reasons. Please '
+                    'set any environment variables you need in your grading '
+                    'script.', cmd['startline'])
+            for cmd in dockerfile.instructions('env')]
+
+
+@rule('volume', DOCKERFILE)
+def check_volume(dockerfile):
+    return [warning('VOLUME commands are stripped in the production '
+                    'environment, and will likely not work as expected.',
+                    cmd['startline'])
+            for cmd in dockerfile.instructions('volume')]
+
+
+@rule('dockerignore', DOCKERFILE)
+def check_dockerignore(dockerfile):
+    copy = context_copy(dockerfile)
+    if copy is None or dockerfile.has_dockerignore:
+        return []
+    size = ''
+    if dockerfile.context_size is not None:
+        size = ' (%s now)' % utils.human_size(dockerfile.context_size)
+    return [warning('The whole build context%s is copied, but there is no '
+                    '.dockerignore file. Version control directories, build '
+                    'outputs and local data all end up in the image.' % size,
+                    copy['startline'], impact=dockerfile.context_size)]
+
+
+@rule('image-entrypoint', IMAGE_CONFIG)
+def check_image_entrypoint(image):
+    config = image.get('Config') or {}
+    if config.get('Entrypoint'):
+        return []
+    return [warning('The image %s does not define an ENTRYPOINT.' %
+                    image['Id'])]
+
+
+@rule('image-wasted-space', LAYER_INDEX)
+def check_image_wasted_space(index):
+    report = analyze.analyze_index(index, top=1)
+    if report['wasted_size'] < WASTED_SIZE_LIMIT:
+        return []
+    largest = report['wasted'][0]
+    return [Finding(
+        logging.WARNING,
+        '%s of the image is taken by files that a later layer deleted or '
+        'overwrote, such as %s (%s). Remove files in the same RUN that '
+        'creates them.' % (utils.human_size(report['wasted_size']),
+                           largest['path'], utils.human_size(largest['size'])),
+        impact=report['wasted_size'])]
+
+
+def startup_latency(run):
+    "The time until the grader first wrote output, or exited without any."
+    if run['first_output'] is not None:
+        return run['first_output']
+    return run['total']
+
+
+@rule('startup-latency', STARTUP_TIMINGS, cache=False)
+def check_startup_latency(startup):
+    runs = startup['runs']
+    latencies = [startup_latency(run) for run in runs]
+    outputs = [run['first_output'] for run in runs
+               if run['first_output'] is not None]
+    findings = [info(
+        'Startup latency over %(runs)s runs on an empty submission: median '
+        '%(median).2fs, worst %(worst).2fs (create %(create).2fs, start '
+        '%(start).2fs, first output %(output)s).' % {
+            'runs': len(runs),
+            'median': statistics.median(latencies),
+            'worst': max(latencies),
+            'create': statistics.median(run['create'] for run in runs),
+            'start': statistics.median(run['start'] for run in runs),
+            'output': '%.2fs' % statistics.median(outputs)
+            if outputs else 'none',
+        })]
+    if max(latencies) > startup['budget']:
+        findings.append(warning(
+            'Worst-case startup latency of %.2fs exceeds the budget of %.2fs. '
+            'Every submission pays this cost; move imports, compilation and '
+            'warm-up work into the image build.' % (
+                max(latencies), startup['budget']),
+            impact=max(latencies) - startup['budget']))
+    timeouts = len([run for run in runs if run['exit_code'] is None])
+    if timeouts:
+        findings.append(warning(
+            '%s of %s runs on an empty submission did not exit within %s '
+            'seconds.' % (timeouts, len(runs), startup['timeout'])))
+    return findings
+
+
+def scan_script(path, text):
+    "Finds grading-time installs, downloads and compilation in a script."
+    findings = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        command = line.strip()
+        if command.startswith('#'):
+            continue
+        for pattern, what, needs_network in RUNTIME_SLOW_PATHS:
+            if not pattern.search(command):
+                continue
+            if needs_network:
+                message = (
+                    '%(path)s:%(lineno)s: `%(command)s` %(what)s on every '
+                    'submission. This slows down grading, and fails in '
+                    'production where graders run without network access. Do '
+                    'it in the Dockerfile instead.')
+            else:
+                message = (
+                    '%(path)s:%(lineno)s: `%(command)s` %(what)s on every '
+                    'submission, which counts against the grading timeout. '
+                    'Unless it builds the submission itself, do it in the '
+                    'Dockerfile instead.')
+            findings.append(warning(message % {
+                'path': path,
+                'lineno': lineno,
+                'command': command if len(command) <= 60
+                else command[:57] + '...',
+                'what': what,
+            }))
+            break
+    return findings
+
+
+@rule('entrypoint-slow-paths', ENTRYPOINT_SCRIPTS)
+def check_entrypoint_slow_paths(scripts):
+    findings = []
+    for path, text in scripts:
+        findings.extend(scan_script(path, text))
+    return findings
+
+
+def fingerprint(*parts):
+    "Hashes the given strings into a cache key component."
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def build_context_size(directory):
+    "Sums the sizes of the files in a build context, or None on errors."
+    total = 0
+    try:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                total += os.lstat(os.path.join(root, name)).st_size
+    except OSError:
+        return None
+    return total
+
+
+def load_dockerfile(inputs):
+    args = inputs.args
+    if getattr(args, 'docker_file', None) is None:
         logging.info("No Dockerfile provided... skipping file checks.")
+        return None
+    try:
+        parser = DockerfileParser(args.docker_file)
+        structure = parser.structure
+        content = parser.content
+    except:
+        logging.error("Could not parse Dockerfile at: %s", args.docker_file)
+        return None
+    context = os.path.dirname(parser.dockerfile_path)
+    has_dockerignore = os.path.isfile(os.path.join(context, '.dockerignore'))
+    # Only needed to estimate what a missing .dockerignore costs.
+    context_size = None if has_dockerignore else build_context_size(context)
+    return Dockerfile(parser.dockerfile_path, structure, content,
+                      has_dockerignore, context_size)
+
+
+def fingerprint_dockerfile(inputs):
+    # Parsing the Dockerfile is cheap, so its fingerprint is its content.
+    dockerfile = inputs.value(DOCKERFILE)
+    if dockerfile is None:
+        return None
+    return fingerprint(dockerfile.content, str(dockerfile.has_dockerignore),
+                       str(dockerfile.context_size))
+
+
+def load_daemon_info(inputs):
+    if inputs.args.skip_environment:
+        return None
+    logging.info("Checking local docker demon...")
+    # Reuses the response cached when the docker client was created.
+    return utils.docker_version(inputs.args)
+
+
+def fingerprint_daemon_info(inputs):
+    version = inputs.value(DAEMON_INFO)
+    if version is None:
+        return None
+    return fingerprint(json.dumps(version, sort_keys=True))
+
+
+def fingerprint_image(inputs):
+    "Fingerprints inputs derived from the image by the image's id."
+    image = inputs.image()
+    return None if image is None else image['Id']
+
+
+def load_image_config(inputs):
+    return inputs.image()
+
+
+def load_layer_index(inputs):
+    if inputs.image() is None:
+        return None
+    args = inputs.args
+    try:
+        return layers.image_index(inputs.docker(), args.image)
+    except:
+        logging.error("Could not index the layers of image: %s", args.image)
+        return None
+
+
+def time_startup(d, image, submission_dir, timeout, memory_limit):
+    """
+    Runs the image's ENTRYPOINT once on the given submission the way the grid
+    does, and times the container create, start, first output and exit, in
+    seconds from the create call. first_output is None if the grader wrote
+    nothing, and exit_code is None if it did not exit within timeout.
+    """
+    host_config = d.create_host_config(
+        binds=[common.mk_submission_volume_str(submission_dir)],
+        network_mode='none',
+        mem_limit=memory_limit,
+        memswap_limit=memory_limit,
+    )
+    begin = time.perf_counter()
+    container = d.create_container(
+        image=image,
+        user='%s' % 1000,
+        host_config=host_config,
+    )
+    created = time.perf_counter()
+    first_output = []
+
+    def follow_logs():
+        try:
+            for chunk in d.logs(container, stdout=True, stderr=True,
+                                stream=True, follow=True):
+                if chunk:
+                    first_output.append(time.perf_counter() - begin)
+                    break
+        except:
+            logging.debug('Could not follow the output of %s', container)
+
+    try:
+        d.start(container)
+        started = time.perf_counter()
+        # The logs are followed on a thread of their own: a grader that hangs
+        # without writing anything must not block past the timeout.
+        reader = threading.Thread(target=follow_logs, name='startup-logs')
+        reader.daemon = True
+        reader.start()
+        try:
+            exit_code = d.wait(container, timeout=timeout)
+        except ReadTimeout:
+            d.kill(container)
+            exit_code = None
+        finished = time.perf_counter()
+        # The stream ends once the container has stopped.
+        reader.join(1)
+    finally:
+        d.remove_container(container, force=True)
+    return {
+        'create': created - begin,
+        'start': started - created,
+        'first_output': first_output[0] if first_output else None,
+        'total': finished - begin,
+        'exit_code': exit_code,
+    }
+
+
+def measure_startup(d, image, runs, timeout, memory_limit):
+    "Times several cold starts of the image on an empty submission."
+    submission_dir = tempfile.mkdtemp()
+    try:
+        timings = []
+        for run in range(runs):
+            logging.info('Measuring startup latency (run %s of %s)...',
+                         run + 1, runs)
+            timings.append(time_startup(
+                d, image, submission_dir, timeout, memory_limit))
+        return timings
+    finally:
+        shutil.rmtree(submission_dir, ignore_errors=True)
+
+
+def load_startup_timings(inputs):
+    args = inputs.args
+    if not getattr(args, 'measure_startup', False):
+        return None
+    if getattr(args, 'image', None) is None:
+        logging.error('--measure-startup requires --image.')
+        return None
+    try:
+        timings = measure_startup(
+            inputs.docker(), args.image, args.startup_runs,
+            args.startup_timeout, grade.compute_memory_limit(args))
+    except:
+        logging.error('Could not run the image %s to measure its startup.',
+                      args.image)
+        return None
+    return {
+        'runs': timings,
+        'budget': args.startup_budget,
+        'timeout': args.startup_timeout,
+    }
+
+
+def no_fingerprint(inputs):
+    "For inputs that change on every run, and so are never cached."
+    return None
+
+
+class _ScriptTooLarge(Exception):
+    pass
+
+
+class _LimitedBuffer(io.BytesIO):
+    "Collects a file's contents, giving up past MAX_SCRIPT_SIZE bytes."
+
+    def write(self, data):
+        if self.tell() + len(data) > MAX_SCRIPT_SIZE:
+            raise _ScriptTooLarge()
+        return super(_LimitedBuffer, self).write(data)
+
+
+def referenced_scripts(text):
+    "Extracts the paths of scripts mentioned in a command line or script."
+    return [match.group(1) for match in SCRIPT_PATH.finditer(text)]
+
+
+def entrypoint_programs(config):
+    """
+    Determines the programs the image runs: the program of the ENTRYPOINT
+    (or CMD) unless it is an interpreter, and any script it mentions.
+    """
+    command = config.get('Entrypoint') or config.get('Cmd') or []
+    if not isinstance(command, list):
+        command = ['/bin/sh', '-c', command]
+    programs = []
+    for arg in command:
+        if arg.startswith('-') or INTERPRETER.match(arg):
+            continue
+        if ' ' not in arg:
+            programs.append(arg)
+        break
+    for path in referenced_scripts(' '.join(command)):
+        if path not in programs:
+            programs.append(path)
+    return programs
+
+
+def read_script(d, container, path):
+    """
+    Reads a text file out of the stopped container. Returns None if it does
+    not exist, or is a binary or large file.
+    """
+    contents = _LimitedBuffer()
+    try:
+        common.copy_file_from_container(d, container, path, contents)
+    except (_ScriptTooLarge, IsADirectoryError):
+        return None
+    except:
+        logging.debug('Could not read %s from the image.', path)
+        return None
+    data = contents.getvalue()
+    if b'\0' in data:
+        return None
+    return data.decode('utf-8', 'replace')
+
+
+def read_entrypoint_scripts(d, image):
+    """
+    Reads the ENTRYPOINT script of the inspected image, and the scripts it
+    calls, through the archive API. Returns a list of (path, text) tuples.
+    """
+    config = image['Config'] or {}
+    working_dir = config.get('WorkingDir') or '/'
+    pending = [(working_dir, path) for path in entrypoint_programs(config)]
+    seen = set()
+    scripts = []
+    with common.stopped_container(d, image['Id']) as container:
+        while pending and len(seen) < MAX_SCRIPTS:
+            directory, path = pending.pop(0)
+            path = posixpath.normpath(posixpath.join(directory, path))
+            if path in seen:
+                continue
+            seen.add(path)
+            text = read_script(d, container, path)
+            if text is None:
+                continue
+            scripts.append((path, text))
+            for called in referenced_scripts(text):
+                # Relative paths are resolved by the working directory at
+                # runtime, but scripts usually refer to their siblings.
+                pending.append((working_dir, called))
+                pending.append((posixpath.dirname(path), called))
+    return scripts
+
+
+def load_entrypoint_scripts(inputs):
+    image = inputs.image()
+    if image is None:
+        return None
+    try:
+        return read_entrypoint_scripts(inputs.docker(), image)
+    except:
+        logging.error('Could not read the ENTRYPOINT of image: %s',
+                      inputs.args.image)
+        return None
+
+
+# Maps every input to the functions computing its fingerprint and its value.
+# Fingerprints come from cheap metadata where possible, so that the expensive
+# inputs are only loaded for rules that miss the cache.
+INPUTS = {
+    DOCKERFILE: (fingerprint_dockerfile, load_dockerfile),
+    DAEMON_INFO: (fingerprint_daemon_info, load_daemon_info),
+    IMAGE_CONFIG: (fingerprint_image, load_image_config),
+    LAYER_INDEX: (fingerprint_image, load_layer_index),
+    STARTUP_TIMINGS: (no_fingerprint, load_startup_timings),
+    ENTRYPOINT_SCRIPTS: (fingerprint_image, load_entrypoint_scripts),
+}
+
+
+class ResultCache(object):
+    """
+    Findings of previous runs, keyed by the rule and the content hash of its
+    inputs. Rules whose inputs did not change are not run again.
+    """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if file_name is not None and os.path.isfile(file_name):
+            try:
+                with open(file_name) as f:
+                    data = json.load(f)
+                if data.get('version') == CACHE_VERSION:
+                    self.entries = data['entries']
+            except:
+                logging.debug('Ignoring unreadable sanity cache %s',
+                              file_name)
+
+    def key(self, rule, fingerprints):
+        return fingerprint(rule.name, *fingerprints)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return [Finding.from_dict(data) for data in entry['findings']]
+
+    def put(self, key, findings):
+        with self.lock:
+            self.entries[key] = {
+                'findings': [f.to_dict() for f in findings],
+                'order': len(self.entries),
+            }
+            self.dirty = True
+
+    def save(self):
+        if self.file_name is None or not self.dirty:
+            return
+        # Keep only the most recently added entries.
+        keep = sorted(self.entries.items(),
+                      key=lambda item: item[1]['order'])[-MAX_CACHE_ENTRIES:]
+        entries = dict((key, dict(entry, order=position))
+                       for position, (key, entry) in enumerate(keep))
+        directory = os.path.dirname(self.file_name) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'entries': entries}, f)
+            os.rename(tmp, self.file_name)
+        except:
+            logging.debug('Could not write sanity cache %s', self.file_name)
+
+
+class Inputs(object):
+    """
+    The inputs of the rules of one run, each computed on first use and at
+    most once, even when rules running concurrently need it. An input whose
+    fingerprint or value is None is not available.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Builds inputs that are already loaded from a dict mapping names to
+        (value, fingerprint) tuples. Other inputs are not available.
+        """
+        inputs = cls(None)
+        for name in INPUTS:
+            inputs.results[('value', name)], \
+                inputs.results[('fingerprint', name)] = \
+                values.get(name, (None, None))
+        return inputs
+
+    def _once(self, key, compute):
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.results:
+                self.results[key] = compute()
+            return self.results[key]
+
+    def docker(self):
+        # Connects lazily; utils reuses one client per process.
+        return utils.docker_client(self.args)
+
+    def image(self):
+        "Returns the inspected --image, or None."
+        def inspect():
+            if getattr(self.args, 'image', None) is None:
+                return None
+            try:
+                return self.docker().inspect_image(self.args.image)
+            except:
+                logging.error("Could not inspect image: %s", self.args.image)
+                return None
+        return self._once(('image', None), inspect)
+
+    def fingerprint(self, name):
+        return self._once(('fingerprint', name),
+                          lambda: INPUTS[name][0](self))
+
+    def value(self, name):
+        return self._once(('value', name), lambda: INPUTS[name][1](self))
+
+
+def run_rules(rules, inputs, cache, parallelism=4):
+    """
+    Runs every rule whose inputs are available, concurrently, reusing cached
+    findings for inputs whose fingerprints did not change. Inputs are only
+    loaded for rules that miss the cache. Rules using EXCLUSIVE_INPUTS run
+    last, one at a time. Returns the findings sorted by line, and by rule
+    registration order within a line.
+    """
+    def run(rule):
+        if rule.cache:
+            fingerprints = [inputs.fingerprint(name) for name in rule.inputs]
+            if None in fingerprints:
+                return []
+            key = cache.key(rule, fingerprints)
+            findings = cache.get(key)
+            if findings is not None:
+                return findings
+        values = [inputs.value(name) for name in rule.inputs]
+        if any(value is None for value in values):
+            return []
+        findings = rule.check(*values)
+        for finding in findings:
+            finding.rule = rule.name
+        if rule.cache:
+            cache.put(key, findings)
+        return findings
+
+    def exclusive(rule):
+        return any(name in EXCLUSIVE_INPUTS for name in rule.inputs)
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [None if exclusive(r) else executor.submit(run, r)
+                   for r in rules]
+        results = [None if future is None else future.result()
+                   for future in futures]
+    results = [run(r) if found is None else found
+               for r, found in zip(rules, results)]
+    findings = [(position, finding)
+                for position, found in enumerate(results)
+                for finding in found]
+    findings.sort(key=lambda item: (item[1].line is None, item[1].line or 0,
+                                    item[0]))
+    return [finding for _, finding in findings]
+
+
+def report_json(findings, out):
+    counts = dict((name, 0) for name in LEVEL_NAMES.values())
+    for finding in findings:
+        counts[LEVEL_NAMES.get(finding.level, 'info')] += 1
+    json.dump({
+        'findings': [finding.to_dict() for finding in findings],
+        'counts': counts,
+    }, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+
+def command_sanity(args):
+    "Implements the sanity subcommand"
+    inputs = Inputs(args)
+    cache_file = getattr(args, 'cache_file', None)
+    if cache_file is not None:
+        cache_file = os.path.expanduser(cache_file)
+    cache = ResultCache(cache_file)
+    findings = run_rules(RULES, inputs, cache)
+    cache.save()
+    if getattr(args, 'format', 'text') == 'json':
+        report_json(findings, sys.stdout)
+    else:
+        for finding in findings:
+            logging.log(finding.level, '%s', finding.text())
+    return 0
 
 
 def parser(subparsers):
@@ -121,5 +1004,52 @@ def parser(subparsers):
         '-f',
         '--docker-file',
         help='The docker file to check.')
+    parser_sanity.add_argument(
+        '--image',
+        help='A built image to check (configuration and layers).')
+    parser_sanity.add_argument(
+        '--format',
+        choices=['text', 'json'],
+        default='text',
+        help='Log the findings (text), or print a JSON report for CI.')
+    parser_sanity.add_argument(
+        '--cache-file',
+        default=DEFAULT_CACHE_FILE,
+        help='Where to cache findings of unchanged inputs (default: '
+        '%(default)s).')
+    parser_sanity.add_argument(
+        '--no-cache',
+        dest='cache_file',
+        action='store_const',
+        const=None,
+        help='Run every rule, ignoring and not updating the cache.')
+    parser_sanity.add_argument(
+        '--measure-startup',
+        action='store_true',
+        help='Run the ENTRYPOINT of --image on an empty submission several '
+        'times, and report its startup latency.')
+    parser_sanity.add_argument(
+        '--startup-runs',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=5,
+        help='How many times to run the image (default: %(default)s).')
+    parser_sanity.add_argument(
+        '--startup-budget',
+        type=float,
+        default=5.0,
+        help='Warn when the worst-case startup latency exceeds this many '
+        'seconds (default: %(default)s).')
+    parser_sanity.add_argument(
+        '--startup-timeout',
+        type=int,
+        default=60,
+        help='Give up on a run after this many seconds (default: '
+        '%(default)s).')
+    parser_sanity.add_argument(
+        '--mem-limit',
+        type=int,
+        default=1024,
+        help='The amount of memory allocated to the grader, in MB '
+        '(default: %(default)s).')
 
     return parser_sanity
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+import io
+import json
+import logging
+import os
+import os.path
+import select
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import traceback
+
+
+DEFAULT_SERVER_SOCKET = '~/.coursera/server.sock'
+
+# Every message from the server is a frame: a channel byte, the length of the
+# payload, and the payload.
+FRAME_HEADER = struct.Struct('!cI')
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+EXIT_CODE = struct.Struct('!i')
+
+READ_SIZE = 64 * 1024
+
+
+def write_frame(out, channel, payload):
+    out.write(FRAME_HEADER.pack(channel, len(payload)) + payload)
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError('The server closed the connection.')
+    return data
+
+
+def exit_code(e):
+    "Converts a SystemExit into a process exit code, like the interpreter."
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    sys.stderr.write('%s\n' % e.code)
+    return 1
+
+
+def forward_output(out, pipes):
+    "Sends what is written to the (channel, fd) pipes as frames until EOF."
+    channels = dict((fd, channel) for channel, fd in pipes)
+    while channels:
+        readable, _, _ = select.select(list(channels), [], [])
+        for fd in readable:
+            data = os.read(fd, READ_SIZE)
+            if data:
+                write_frame(out, channels[fd], data)
+            else:
+                os.close(fd)
+                del channels[fd]
+
+
+def run_request(request, out):
+    """
+    Runs the command line of the request in this (forked) process, sending
+    its output and exit code as frames. Returns the exit code.
+    """
+    from courseraprogramming import main
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pipes = []
+    for channel, fd in [(STDOUT, 1), (STDERR, 2)]:
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+        pipes.append((channel, read_fd))
+    # The server's streams may have been replaced; write to the pipes.
+    sys.stdout = io.open(1, 'w', closefd=False)
+    sys.stderr = io.open(2, 'w', closefd=False)
+    forwarder = threading.Thread(target=forward_output, args=(out, pipes))
+    forwarder.start()
+
+    os.environ.clear()
+    os.environ.update(request.get('env', {}))
+    try:
+        os.chdir(request.get('cwd', '/'))
+        result = main.run(request['argv'])
+        code = result if isinstance(result, int) else 0
+    except SystemExit as e:
+        code = exit_code(e)
+    except:
+        traceback.print_exc()
+        code = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Closing the write ends lets the forwarder reach the end of the pipes.
+    os.close(1)
+    os.close(2)
+    forwarder.join()
+    write_frame(out, EXIT, EXIT_CODE.pack(code))
+    return code
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # A liveness check; see server_is_running.
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except:
+            logging.exception('Could not parse the command request.')
+            write_frame(self.wfile, EXIT, EXIT_CODE.pack(2))
+            return
+        run_request(request, self.wfile)
+
+
+class CommandServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Runs every command in a process forked from this one, so it starts with
+    all modules imported and the configuration parsed, yet cannot disturb
+    other commands' output, working directory or logging.
+
+    Connections are not shared: each command opens its own HTTP and docker
+    connections, and reads the OAuth2 tokens from the token cache or agent,
+    as sharing sockets or token refreshes across forked processes is unsafe.
+    The docker API version is negotiated once and cached on disk.
+    """
+
+
+def server_is_running(socket_path):
+    'Determines if a server is listening on socket_path.'
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        sock.connect(socket_path)
+    except:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def make_server(socket_path):
+    '''
+    Binds a command server to a Unix socket only the current user may connect
+    to. Returns None if another server is already listening there.
+    '''
+    directory = os.path.dirname(socket_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    if os.path.exists(socket_path):
+        if server_is_running(socket_path):
+            logging.error('A server is already listening on %s', socket_path)
+            return None
+        os.remove(socket_path)
+    # Never let the socket be connectable by other users, not even briefly.
+    old_umask = os.umask(0o177)
+    try:
+        server = CommandServer(socket_path, _CommandHandler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, 0o600)
+    return server
+
+
+def warm_up(args):
+    """
+    Does the work every command would otherwise repeat at startup. What it
+    loads stays in this process for the forked commands to reuse.
+    """
+    from courseraprogramming import main
+    from courseraprogramming import utils
+    from courseraprogramming.commands import oauth2
+    # Builds every subcommand's parser, importing all command modules.
+    main.build_parser()
+    # The dependencies the command modules only import when they run.
+    import docker  # noqa
+    import dockerfile_parse  # noqa
+    import requests_toolbelt  # noqa
+    # Kept until the configuration files change.
+    oauth2.configuration()
+    # Negotiates the docker API version, which is cached on disk. The client
+    # itself is not reused by the forked commands.
+    try:
+        utils.docker_client(args)
+    except:
+        logging.info('Could not reach the docker daemon; commands will '
+                     'negotiate the docker API version themselves.')
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def serve(socket_path, args):
+    "Runs commands sent to socket_path until interrupted."
+    server = make_server(socket_path)
+    if server is None:
+        return 1
+    warm_up(args)
+    logging.info('Running commands sent to %s', socket_path)
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+    return 0
+
+
+def forward(socket_path, argv, stdout=None, stderr=None):
+    '''
+    Runs the command line argv on the server listening on socket_path,
+    streaming its output to the binary files stdout and stderr (by default,
+    this process' stdout and stderr). Returns the exit code of the command,
+    or None if the server cannot be reached.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        logging.debug('Could not reach the server at %s; running locally.',
+                      socket_path, exc_info=True)
+        sock.close()
+        return None
+    outputs = {
+        STDOUT: stdout or getattr(sys.stdout, 'buffer', sys.stdout),
+        STDERR: stderr or getattr(sys.stderr, 'buffer', sys.stderr),
+    }
+    try:
+        sock.sendall(json.dumps({
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        }).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            while True:
+                channel, size = FRAME_HEADER.unpack(
+                    read_exactly(f, FRAME_HEADER.size))
+                payload = read_exactly(f, size)
+                if channel == EXIT:
+                    return EXIT_CODE.unpack(payload)[0]
+                outputs[channel].write(payload)
+                outputs[channel].flush()
+    except (EOFError, IOError, OSError):
+        logging.error('Lost the connection to the server at %s.',
+                      socket_path)
+        return 1
+    finally:
+        sock.close()
+
+
+def command_serve(args):
+    "Implements the serve subcommand"
+    return serve(os.path.expanduser(args.socket), args)
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the serve command
+    parser_serve = subparsers.add_parser(
+        'serve',
+        help='Run commands sent by other courseraprogramming invocations '
+        'over a Unix socket, sparing each of them the interpreter startup, '
+        'imports and configuration loading. Invocations use the server when '
+        'the COURSERAPROGRAMMING_SERVER environment variable names its '
+        'socket. Runs until interrupted.')
+    parser_serve.set_defaults(func=command_serve)
+    parser_serve.add_argument(
+        '--socket',
+        default=DEFAULT_SERVER_SOCKET,
+        help='The socket to listen on. (Default: %(default)s)')
+    return parser_serve
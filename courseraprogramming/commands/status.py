@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from courseraprogramming.commands import oauth2
+from courseraprogramming.commands import publish
+from courseraprogramming import registry
+import logging
+import requests
+import sys
+import threading
+import time
+
+
+class TransitionPrinter(object):
+    "Writes one line per grader status change, as it happens."
+
+    def __init__(self, out):
+        self.out = out
+        self.lock = threading.Lock()
+
+    def __call__(self, grader, status, registered_at):
+        now = time.time()
+        line = '%s  %s: %s' % (
+            time.strftime('%H:%M:%S', time.localtime(now)), grader, status)
+        if registered_at is not None:
+            line += ' (%.0f seconds after registration)' % (
+                now - registered_at)
+        with self.lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+
+def watch_grader(session, grader, location, deadline, registered_at=None,
+                 on_transition=None):
+    """
+    Polls the grader's status API until it has been processed or the
+    deadline passes. Returns the last status and, if the grader completed
+    and its registration time is known, the seconds from registration to
+    completion.
+    """
+    def on_status(status):
+        if on_transition is not None:
+            on_transition(grader, status, registered_at)
+
+    status = publish.wait_for_location(
+        session, location, deadline, on_status)
+    ready_after = None
+    if status == publish.GraderExecutorStatus.COMPLETED and \
+            registered_at is not None:
+        ready_after = time.time() - registered_at
+    return status, ready_after
+
+
+def resolve_graders(args, grader_registry):
+    """
+    Returns (grader, location, registration time) for every grader to watch:
+    the given executor ids or status API locations, and the unfinished
+    graders the registry knows for --course.
+    """
+    targets = []
+    for grader in args.grader:
+        if grader.startswith('http://') or grader.startswith('https://'):
+            targets.append((grader, grader, None))
+            continue
+        known = grader_registry.grader(grader) if grader_registry else None
+        location = '%s/%s' % (args.executor_endpoint, grader)
+        registered_at = None
+        if known is not None:
+            location = known['location'] or location
+            registered_at = known['registered_at']
+        targets.append((grader, location, registered_at))
+    if args.course is not None and grader_registry is not None:
+        for known in grader_registry.graders(args.course):
+            if known['status'] in publish.GraderExecutorStatus.FINISHED or \
+                    known['executor_id'] in args.grader:
+                continue
+            targets.append((
+                known['executor_id'],
+                known['location'] or '%s/%s' % (
+                    args.executor_endpoint, known['executor_id']),
+                known['registered_at']))
+    return targets
+
+
+def command_status(args):
+    "Implements the status subcommand"
+    grader_registry = registry.open_registry()
+    targets = resolve_graders(args, grader_registry)
+    if not targets:
+        logging.error('No graders to watch.')
+        return 1
+
+    oauth2_instance = oauth2.build_oauth2(args)
+    session = requests.Session()
+    session.auth = oauth2_instance.build_refreshing_authorizer()
+    # Without --wait, each grader is polled exactly once.
+    deadline = time.time() + (args.wait_timeout if args.wait else 0)
+    on_transition = TransitionPrinter(sys.stdout) \
+        if not args.quiet or args.quiet == 0 else None
+
+    def watch(target):
+        grader, location, registered_at = target
+        try:
+            return watch_grader(session, grader, location, deadline,
+                                registered_at, on_transition)
+        except:
+            logging.exception('Could not poll the status of %s.', grader)
+            return 'ERROR', None
+
+    # Watching mostly sleeps, so every grader gets its own thread.
+    try:
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            results = list(executor.map(watch, targets))
+    finally:
+        session.auth.close()
+        session.close()
+
+    if grader_registry is not None:
+        for (grader, _, _), (status, _) in zip(targets, results):
+            known = grader_registry.grader(grader)
+            if known is not None and status != 'ERROR':
+                grader_registry.record_grader(
+                    known['course_id'], grader, status=status)
+        grader_registry.close()
+
+    if not args.quiet or args.quiet == 0:
+        width = max([len('GRADER')] + [len(t[0]) for t in targets])
+        sys.stdout.write('%-*s  %-10s  %s\n' % (
+            width, 'GRADER', 'STATUS', 'READY AFTER'))
+        for (grader, _, _), (status, ready_after) in zip(targets, results):
+            sys.stdout.write('%-*s  %-10s  %s\n' % (
+                width, grader, status,
+                '%.0fs' % ready_after if ready_after is not None else '-'))
+
+    statuses = [status for status, _ in results]
+    if all(s == publish.GraderExecutorStatus.COMPLETED for s in statuses):
+        return 0
+    if all(s in (publish.GraderExecutorStatus.COMPLETED,
+                 publish.GraderExecutorStatus.PENDING) for s in statuses):
+        return publish.ErrorCodes.RETRYABLE_ERROR
+    return publish.ErrorCodes.FATAL_ERROR
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the status command.
+    parser_status = subparsers.add_parser(
+        'status',
+        help='Show whether uploaded graders have been processed and are '
+        'ready to grade, optionally waiting until they are.')
+    parser_status.set_defaults(func=command_status)
+
+    parser_status.add_argument(
+        'grader',
+        nargs='*',
+        help='Executor ids, or grader status API locations as logged by '
+        'upload.')
+
+    parser_status.add_argument(
+        '--course',
+        help='Also watch every grader of this course that the registry '
+        'does not know to be processed.')
+
+    parser_status.add_argument(
+        '--wait',
+        action='store_true',
+        help='Poll until every grader has been processed, printing each '
+        'status change as it happens.')
+
+    parser_status.add_argument(
+        '--wait-timeout',
+        type=int,
+        default=1800,
+        help='How many seconds to wait for with --wait (default: '
+        '%(default)s).')
+
+    parser_status.add_argument(
+        '--executor-endpoint',
+        default='https://api.coursera.org/api/gridExecutorCreationAttempts.v1',
+        help='Override the endpoint used to check the status of graders')
+
+    return parser_status
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coursera's asynchronous grader command line SDK.
+
+You may install it from source, or via pip.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from courseraprogramming.commands import oauth2
+from courseraprogramming.commands import reregister
+from courseraprogramming import registry
+from courseraprogramming import utils
+import logging
+import requests
+import sys
+
+
+def sync_course(session, args, grader_registry, course_id, limiter):
+    """
+    Refreshes the registry's graders of the course from the executor listing
+    API, then fetches the S3 objects of graders whose listing lacked them.
+    Returns the number of graders listed.
+    """
+    elements = reregister.list_course_executors(
+        session, args.register_endpoint, course_id, limiter)
+    for element in elements:
+        grader_registry.record_grader(
+            course_id, element['id'],
+            bucket=element.get('bucket'),
+            key=element.get('key'),
+            status=element.get('status'))
+
+    def fetch_location(grader_id):
+        limiter.wait()
+        try:
+            bucket, key = reregister.get_grader_location(
+                session, args.register_endpoint, grader_id)
+        except reregister.ReregisterError as e:
+            logging.warn('%s: %s', grader_id, e)
+            return
+        grader_registry.record_grader(course_id, grader_id, bucket=bucket,
+                                      key=key)
+
+    missing = [element['id'] for element in elements
+               if not (grader_registry.grader(element['id']) or {}).get('key')]
+    with ThreadPoolExecutor(max_workers=args.parallelism) as executor:
+        list(executor.map(fetch_location, missing))
+    logging.info('Course %s: %s graders, %s fetched individually.',
+                 course_id, len(elements), len(missing))
+    return len(elements)
+
+
+def print_registry(grader_registry, course_id, out):
+    "Writes the registry's graders of the course and the parts they grade."
+    out.write('Course %s:\n' % course_id)
+    graders = grader_registry.graders(course_id)
+    if not graders:
+        out.write('  No known graders.\n')
+    parts = {}
+    for _, item_id, part_id, executor_id in grader_registry.parts(course_id):
+        parts.setdefault(executor_id, []).append('%s/%s' % (item_id, part_id))
+    for grader in graders:
+        out.write('  %s  %s  %s\n' % (
+            grader['executor_id'],
+            grader['status'] or 'UNKNOWN',
+            's3://%s/%s' % (grader['bucket'], grader['key'])
+            if grader['key'] else '-'))
+        if grader['replaces']:
+            out.write('    replaces %s\n' % grader['replaces'])
+        for part in parts.get(grader['executor_id'], []):
+            out.write('    grades %s\n' % part)
+
+
+def command_sync(args):
+    "Implements the sync subcommand"
+    grader_registry = registry.open_registry(args.registry)
+    if grader_registry is None:
+        logging.error('The grader registry is disabled or cannot be opened.')
+        return 1
+
+    try:
+        if not args.offline:
+            oauth2_instance = oauth2.build_oauth2(args)
+            session = requests.Session()
+            session.auth = oauth2_instance.build_refreshing_authorizer()
+            limiter = reregister.RateLimiter(args.rate)
+            try:
+                for course_id in args.course:
+                    sync_course(
+                        session, args, grader_registry, course_id, limiter)
+            except reregister.ReregisterError as e:
+                logging.error('%s', e)
+                return 1
+            finally:
+                session.auth.close()
+                session.close()
+
+        if not args.quiet or args.quiet == 0:
+            for course_id in args.course:
+                print_registry(grader_registry, course_id, sys.stdout)
+    finally:
+        grader_registry.close()
+    return 0
+
+
+def parser(subparsers):
+    "Build an argparse argument parser to parse the command line."
+
+    # create the parser for the sync command.
+    parser_sync = subparsers.add_parser(
+        'sync',
+        help='Refresh the local registry of graders from Coursera, and show '
+        'the graders of the courses and the parts they grade. Which parts use '
+        'which graders is not refreshed: Coursera does not list it, so it is '
+        'only known from the uploads, deploys and reregisters recorded in the '
+        'registry.')
+    parser_sync.set_defaults(func=command_sync)
+
+    parser_sync.add_argument(
+        'course',
+        nargs='+',
+        help='The ids of the courses to refresh.')
+
+    parser_sync.add_argument(
+        '--offline',
+        action='store_true',
+        help='Only show what the registry already knows.')
+
+    parser_sync.add_argument(
+        '--registry',
+        help='The registry database to use (default: the registry path of '
+        'the configuration, %s).' % registry.DEFAULT_REGISTRY)
+
+    parser_sync.add_argument(
+        '--register-endpoint',
+        default='https://api.coursera.org/api/gridExecutorCreationAttempts.v1',
+        help='Override the endpoint used to list the graders of a course')
+
+    parser_sync.add_argument(
+        '--parallelism',
+        type=lambda v: utils.check_int_range(v, lower=1),
+        default=4,
+        help='How many grader details to fetch concurrently (default: '
+        '%(default)s).')
+
+    parser_sync.add_argument(
+        '--rate',
+        type=float,
+        default=5.0,
+        help='The most requests per second to send, or 0 for no limit '
+        '(default: %(default)s).')
+
+    return parser_sync
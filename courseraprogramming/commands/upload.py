@@ -22,15 +22,18 @@ You may install it from source, or via pip.
 
 from courseraprogramming.commands import common
 from courseraprogramming.commands import oauth2
+from courseraprogramming.commands import publish
+from courseraprogramming.commands import status
+from courseraprogramming import registry
+from courseraprogramming import tracing
 from courseraprogramming import utils
 import json
 import logging
-import multiprocessing
 import os.path
 import re
 import requests
-import requests_toolbelt
 import sys
+import threading
 import time
 import uuid
 
@@ -66,8 +69,10 @@ def get_container_image(args, d):
         sys.stdout.write(
             'Saving image %s to %s...' % (args.imageId, image_file_path))
         sys.stdout.flush()
-    with open(image_file_path, 'wb') as image_tar:
+    with tracing.span(tracing.EXPORT, 'save %s' % args.imageId) as span, \
+            open(image_file_path, 'wb') as image_tar:
         image_tar.write(image.data)
+        span['bytes'] = len(image.data)
     if not args.quiet or args.quiet == 0:
         sys.stdout.write(' done.\n')
         sys.stdout.flush()
@@ -94,6 +99,9 @@ def upload(args, upload_url, file_info):
     The long-running upload request. This runs in a separate process for
     concurrency reasons.
     '''
+    # Imported here to keep commands reusing upload's helpers fast to start.
+    import requests_toolbelt
+
     with open(file_info[0], 'rb') as image_file:
         files = [
             ('file', (file_info[1], image_file, 'application/x-tar')),
@@ -181,13 +189,13 @@ def poll_transloadit(args, upload_url):
                 return (match.group(1), match.group(2))
 
 
-def command_upload(args):
-    "Implements the upload subcommand"
-    d = utils.docker_client(args)
+def upload_grader_image(args, d):
+    """
+    Exports the args.imageId image and uploads it through transloadit.
+    Returns the (bucket, key) tuple of the uploaded image, or None if the
+    upload did not complete in time.
+    """
     image = get_container_image(args, d)
-
-    oauth2_instance = oauth2.build_oauth2(args)
-    auth = oauth2_instance.build_authorizer()
     # TODO: use transloadit's signatures for upload signing.
     # authorization = authorize_upload(args, auth)
 
@@ -211,10 +219,12 @@ def command_upload(args):
                 'upload_url': upload_url,
             })
         sys.stdout.flush()
-    p = multiprocessing.Process(target=upload, args=(args, upload_url, image))
-    p.daemon = True  # Auto-kill when the main process exits.
+    # A thread rather than a forked process: forking while other threads run
+    # (as in `deploy`) can deadlock the child on locks they hold.
+    p = threading.Thread(target=upload, args=(args, upload_url, image))
+    p.daemon = True  # Do not keep the process alive once it is done.
     p.start()
-    time.sleep(20)  # Yield control to the child process to kick off upload.
+    time.sleep(20)  # Give the upload some time to start.
 
     upload_information = None
 
@@ -241,21 +251,80 @@ def command_upload(args):
             'Upload did not complete within expected time limits. Upload '
             'URL: %s',
             upload_url)
+    return upload_information
+
+
+def command_upload(args):
+    "Implements the upload subcommand"
+    d = utils.docker_client(args)
+    oauth2_instance = oauth2.build_oauth2(args)
+    auth = oauth2_instance.build_refreshing_authorizer()
+    grader_registry = registry.open_registry()
+
+    upload_information = upload_grader_image(args, d)
+    if upload_information is None:
         return 1
     # Register the grader with Coursera to initiate the image cleaning process
     logging.debug('Grader upload info is: %s', upload_information)
 
-    # Rebuild an authorizer to ensure it's fresh and not expired
-    auth = oauth2_instance.build_authorizer()
-    grader_id = register_grader(auth,
-                                args,
-                                bucket=upload_information[0],
-                                key=upload_information[1])
+    grader_id, location = register_grader_with_location(
+        auth,
+        args,
+        bucket=upload_information[0],
+        key=upload_information[1],
+        registry_db=grader_registry)
+    registered_at = time.time()
 
-    return update_assignments(auth, grader_id, args)
+    result = update_assignments(auth, grader_id, args,
+                                registry_db=grader_registry)
+    if result != 0 or not getattr(args, 'wait_ready', False):
+        return result
+    return wait_until_ready(auth, args, grader_id, location, registered_at,
+                            grader_registry)
 
 
-def register_grader(auth, args, bucket, key):
+def wait_until_ready(auth, args, grader_id, location, registered_at,
+                     grader_registry=None):
+    """
+    Waits for Coursera to finish processing the newly registered grader.
+    Returns 0 once it is ready to grade, and an exit code otherwise.
+    """
+    session = requests.Session()
+    session.auth = auth
+    on_transition = status.TransitionPrinter(sys.stdout) \
+        if not args.quiet or args.quiet == 0 else None
+    try:
+        final_status, ready_after = status.watch_grader(
+            session, grader_id, location, time.time() + args.wait_timeout,
+            registered_at, on_transition)
+    finally:
+        session.close()
+    if grader_registry is not None:
+        grader_registry.record_grader(args.course, grader_id,
+                                      status=final_status)
+    if final_status == publish.GraderExecutorStatus.COMPLETED:
+        logging.info('Grader %s was ready %.0f seconds after registration.',
+                     grader_id, ready_after)
+        return 0
+    if final_status == publish.GraderExecutorStatus.PENDING:
+        logging.error('Grader %s is still being processed after %s seconds.',
+                      grader_id, args.wait_timeout)
+        return publish.ErrorCodes.RETRYABLE_ERROR
+    logging.error('Processing grader %s failed: %s', grader_id, final_status)
+    return publish.ErrorCodes.FATAL_ERROR
+
+
+def register_grader(auth, args, bucket, key, registry_db=None):
+    return register_grader_with_location(
+        auth, args, bucket, key, registry_db=registry_db)[0]
+
+
+def register_grader_with_location(auth, args, bucket, key, registry_db=None):
+    """
+    Registers the uploaded image as a grader. Returns the executor id of the
+    new grader and the location of its status API. The grader is recorded in
+    registry_db, if one is given.
+    """
     grader_cpu = None
 
     if hasattr(args, 'grader_cpu') and args.grader_cpu is not None:
@@ -277,7 +346,7 @@ def register_grader(auth, args, bucket, key):
     if register_result.status_code != 201:  # Created
         logging.error(
             'Failed to register grader (%s) with Coursera: %s',
-            upload_information[1],
+            key,
             register_result.text)
         raise Exception('Failed to register grader')
 
@@ -292,11 +361,15 @@ def register_grader(auth, args, bucket, key):
         raise Exception('Cannot parse response')
 
     logging.info('The grader status API is at: %s', location)
+    if registry_db is not None:
+        registry_db.record_grader(args.course, grader_id, bucket=bucket,
+                                  key=key, location=location,
+                                  registered=True)
 
-    return grader_id
+    return grader_id, location
 
 
-def update_assignment(auth, grader_id, args, item, part):
+def update_assignment(auth, grader_id, args, item, part, registry_db=None):
     update_assignment_params = {
         'action': args.update_part_action,
         'id': '%s~%s' % (args.course, item),
@@ -319,10 +392,12 @@ def update_assignment(auth, grader_id, args, item, part):
     logging.info('Successfully updated assignment part %s to new executor %s',
                  part,
                  grader_id)
+    if registry_db is not None:
+        registry_db.record_part(args.course, item, part, grader_id)
     return 0
 
 
-def update_assignments(auth, grader_id, args):
+def update_assignments(auth, grader_id, args, registry_db=None):
     item_and_parts = [[args.item, args.part]]
     if args.additional_item_and_part is not None:
         item_and_parts.extend(args.additional_item_and_part)
@@ -334,7 +409,8 @@ def update_assignments(auth, grader_id, args):
                                    grader_id,
                                    args,
                                    item,
-                                   part)
+                                   part,
+                                   registry_db=registry_db)
         if result != 0:
             logging.error(
                 'Failed to update assignment part %s to new executor %s',
@@ -345,16 +421,13 @@ def update_assignments(auth, grader_id, args):
     return return_result
 
 
-def setup_registration_parser(parser):
+def setup_registration_parser(parser, nargs=None):
     'This is a helper function to coalesce all the common registration'
     'parameters for code reuse.'
 
-    # constants for timeout ranges
-    TIMEOUT_LOWER = 300
-    TIMEOUT_UPPER = 1800
-
     parser.add_argument(
         'course',
+        nargs=nargs,
         help='The course id to associate the grader. The course id is a '
         'gibberish string UUID. Given a course slug such as `developer-iot`, '
         'you can retrieve the course id by querying the catalog API. e.g.: '
@@ -363,12 +436,14 @@ def setup_registration_parser(parser):
 
     parser.add_argument(
         'item',
+        nargs=nargs,
         help='The id of the item to associate the grader. The easiest way '
         'to find the item id is by looking at the URL in the authoring web '
         'interface. It is the last part of the URL, and is a short UUID.')
 
     parser.add_argument(
         'part',
+        nargs=nargs,
         help='The id of the part to associate the grader.')
 
     parser.add_argument(
@@ -378,6 +453,16 @@ def setup_registration_parser(parser):
         help='The next two args specify an item ID and part ID which will '
              'also be associated with the grader.')
 
+    setup_grader_options_parser(parser)
+
+
+def setup_grader_options_parser(parser):
+    'Adds the grader resource and registration endpoint options.'
+
+    # constants for timeout ranges
+    TIMEOUT_LOWER = 300
+    TIMEOUT_UPPER = 1800
+
     parser.add_argument(
         '--grader-cpu',
         type=int,
@@ -430,28 +515,48 @@ def parser(subparsers):
 
     setup_registration_parser(parser_upload)
 
-    parser_upload.add_argument(
-        '--temp-dir',
-        default='/tmp',
-        help='Temporary directory to use when exporting the container.')
-
     parser_upload.add_argument(
         '--file-name',
         help='File name to use when saving the docker container image. '
              'Defaults to the name of the container image.')
 
     parser_upload.add_argument(
+        '--wait-ready',
+        action='store_true',
+        help='After registering the grader, wait until Coursera has '
+             'processed it and it is ready to grade, printing each status '
+             'change.')
+
+    parser_upload.add_argument(
+        '--wait-timeout',
+        type=int,
+        default=1800,
+        help='How many seconds to wait for with --wait-ready (default: '
+             '%(default)s).')
+
+    setup_transfer_parser(parser_upload)
+
+    return parser_upload
+
+
+def setup_transfer_parser(parser):
+    'Adds the options controlling how images are exported and uploaded.'
+
+    parser.add_argument(
+        '--temp-dir',
+        default='/tmp',
+        help='Temporary directory to use when exporting the container.')
+
+    parser.add_argument(
         '--upload-to-requestbin',
         help='Pass the ID of a request bin to debug uploads!')
 
-    parser_upload.add_argument(
+    parser.add_argument(
         '--transloadit-template',
         default='7531c0b023f611e5aa2ecf267b4b90ee',
         help='The transloadit template to upload to.')
 
-    parser_upload.add_argument(
+    parser.add_argument(
         '--transloadit-account-id',
         default='05912e90e83346abb96c261bf458b615',
         help='The Coursera transloadit account id.')
-
-    return parser_upload
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers to read the file systems of docker images without running them.
+
+`docker save` produces a tar archive containing a manifest, the image
+configuration and one tar archive per layer. This module streams through that
+archive once, records every layer's entries, and merges the layers (applying
+whiteouts) into the file system a container started from the image would see.
+The result is cached on disk per image digest.
+"""
+
+from courseraprogramming import tracing
+import fnmatch
+import gzip
+import hashlib
+import json
+import logging
+import os
+import os.path
+import posixpath
+import stat
+import tarfile
+
+
+DEFAULT_CACHE_DIR = '~/.coursera/image_index'
+
+# Bump whenever the on-disk index format changes.
+INDEX_VERSION = 3
+
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+# Entry types, stored as single characters to keep the index compact.
+FILE = 'f'
+DIRECTORY = 'd'
+SYMLINK = 'l'
+HARDLINK = 'h'
+OTHER = 'o'
+WHITEOUT = 'w'
+OPAQUE = 'q'
+
+_TAR_TYPES = {
+    tarfile.REGTYPE: FILE,
+    tarfile.AREGTYPE: FILE,
+    tarfile.CONTTYPE: FILE,
+    tarfile.DIRTYPE: DIRECTORY,
+    tarfile.SYMTYPE: SYMLINK,
+    tarfile.LNKTYPE: HARDLINK,
+}
+
+_MODE_TYPE_BITS = {
+    FILE: stat.S_IFREG,
+    DIRECTORY: stat.S_IFDIR,
+    SYMLINK: stat.S_IFLNK,
+    HARDLINK: stat.S_IFREG,
+}
+
+# Field positions within an index entry. HASH is the hex sha256 digest of the
+# contents of regular files, and empty otherwise.
+PATH, TYPE, MODE, SIZE, MTIME, UID, GID, LINKNAME, HASH = range(9)
+
+# Like the kernel, give up on paths that need more symlinks than this.
+MAX_SYMLINK_HOPS = 8
+
+_TAR_BLOCK_SIZE = 512
+_HASH_CHUNK_SIZE = 64 * 1024
+
+
+def normalize_path(name):
+    "Converts a path within a tar archive or image into an absolute path."
+    return posixpath.normpath('/' + name.lstrip('/'))
+
+
+class _PrefixedReader(object):
+    "A read-only file object replaying some already consumed bytes first."
+
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.fileobj.read()
+            self.prefix = b''
+            return data
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        if len(data) < size:
+            data += self.fileobj.read(size - len(data))
+        return data
+
+
+def _is_tar_header(block):
+    return len(block) == _TAR_BLOCK_SIZE and block[257:262] == b'ustar'
+
+
+def _is_empty_tar(block):
+    # An archive without members is nothing but zero-filled end blocks, as in
+    # the layers docker creates for WORKDIR or ENV instructions.
+    return len(block) == _TAR_BLOCK_SIZE and not block.strip(b'\0')
+
+
+def layer_entry(member, digest=''):
+    """
+    Converts a tar member of a layer archive into an index entry. digest is
+    the hash of the member's contents, if it is a regular file.
+    """
+    path = normalize_path(member.name)
+    basename = posixpath.basename(path)
+    if basename == OPAQUE_WHITEOUT:
+        return [posixpath.dirname(path), OPAQUE, 0, 0, 0, 0, 0, '', '']
+    if basename.startswith(WHITEOUT_PREFIX):
+        target = posixpath.join(posixpath.dirname(path),
+                                basename[len(WHITEOUT_PREFIX):])
+        return [target, WHITEOUT, 0, 0, 0, 0, 0, '', '']
+    linkname = member.linkname
+    if member.islnk():
+        linkname = normalize_path(linkname)
+    return [
+        path,
+        _TAR_TYPES.get(member.type, OTHER),
+        member.mode,
+        member.size if member.isfile() else 0,
+        int(member.mtime),
+        member.uid,
+        member.gid,
+        linkname,
+        digest,
+    ]
+
+
+def hash_contents(contents):
+    "Computes the hex sha256 digest of a file object, reading it in chunks."
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: contents.read(_HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_saved_image(stream, visit_layer):
+    """
+    Streams through the output of `docker save`, calling
+    visit_layer(layer_path, layer_tar) for every layer archive. layer_tar is a
+    tarfile opened in streaming mode; it must be consumed before returning.
+    Empty layers, and members that are not tar archives, are not visited.
+
+    Both the legacy (`<id>/layer.tar`) and OCI (`blobs/sha256/<hex>`) layouts
+    are supported. Layers are visited in archive order, which is not
+    necessarily the order in which they are stacked.
+
+    Returns a tuple of (config, layer paths in stacking order, aliases), where
+    aliases maps layer paths stored as symlinks onto the archived layer.
+    """
+    documents = {}
+    aliases = {}
+    with tarfile.open(fileobj=stream, mode='r|') as archive:
+        for member in archive:
+            if member.issym():
+                aliases[member.name] = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(member.name), member.linkname))
+                continue
+            if not member.isfile():
+                continue
+            contents = archive.extractfile(member)
+            header = contents.read(_TAR_BLOCK_SIZE)
+            if _is_empty_tar(header):
+                logging.debug('Skipping empty layer %s', member.name)
+            elif _is_tar_header(header):
+                logging.debug('Reading layer %s (%s bytes)',
+                              member.name, member.size)
+                reader = _PrefixedReader(header, contents)
+                with tarfile.open(fileobj=reader, mode='r|') as layer_tar:
+                    visit_layer(member.name, layer_tar)
+            elif member.name.endswith('json') or \
+                    member.name.startswith('blobs/'):
+                documents[member.name] = header + contents.read()
+
+    try:
+        manifest = json.loads(documents['manifest.json'].decode('utf-8'))[0]
+        config = json.loads(documents[manifest['Config']].decode('utf-8'))
+    except (KeyError, IndexError, ValueError):
+        raise ValueError('The image archive has no readable manifest.')
+    return (config, manifest['Layers'], aliases)
+
+
+class ImageIndex(object):
+    """
+    An index of the entries of every layer of an image, along with a merged
+    view of the file system the image presents to a container.
+    """
+
+    def __init__(self, image_id, config, layers):
+        self.image_id = image_id
+        self.config = config
+        # A list of dicts with the 'path', 'source', 'diff_id' and 'entries'
+        # of every layer, from the base of the image up.
+        self.layers = layers
+        self._files = None
+        self._children = None
+
+    @classmethod
+    def from_saved_image(cls, image_id, stream):
+        "Builds an index from a stream of `docker save` output."
+        entries_by_path = {}
+
+        def visit_layer(path, layer_tar):
+            entries = []
+            for member in layer_tar:
+                digest = ''
+                if member.isfile():
+                    digest = hash_contents(layer_tar.extractfile(member))
+                entries.append(layer_entry(member, digest))
+            entries_by_path[path] = entries
+
+        config, layer_paths, aliases = read_saved_image(stream, visit_layer)
+        diff_ids = config.get('rootfs', {}).get('diff_ids', [])
+        layers = []
+        for position, path in enumerate(layer_paths):
+            layers.append({
+                'path': path,
+                # The archive member holding the layer, which differs from
+                # path when docker stored a duplicate layer as a symlink.
+                'source': aliases.get(path, path),
+                'diff_id': diff_ids[position]
+                if position < len(diff_ids) else None,
+                # Empty layers are never visited.
+                'entries': entries_by_path.get(aliases.get(path, path), []),
+            })
+        return cls(image_id, config, layers)
+
+    def _merge(self):
+        files = {'/': ['/', DIRECTORY, 0o755, 0, 0, 0, 0, '', '', -1]}
+        children = {'/': set()}
+
+        def remove(path, keep_root=False):
+            for name in children.pop(path, set()):
+                remove(posixpath.join(path, name))
+            if keep_root:
+                children[path] = set()
+                return
+            files.pop(path, None)
+            parent = posixpath.dirname(path)
+            if parent in children:
+                children[parent].discard(posixpath.basename(path))
+
+        def add(entry):
+            path = entry[PATH]
+            parent = posixpath.dirname(path)
+            if parent not in files:
+                # Tar archives are not required to list parent directories.
+                add([parent, DIRECTORY, 0o755, 0, 0, 0, 0, '', '',
+                     entry[-1]])
+            elif files[parent][TYPE] != DIRECTORY:
+                remove(parent)
+                add([parent, DIRECTORY, 0o755, 0, 0, 0, 0, '', '',
+                     entry[-1]])
+            if path in files and files[path][TYPE] == DIRECTORY and \
+                    entry[TYPE] != DIRECTORY:
+                remove(path)
+            files[path] = entry
+            children[parent].add(posixpath.basename(path))
+            if entry[TYPE] == DIRECTORY:
+                children.setdefault(path, set())
+
+        for position, layer in enumerate(self.layers):
+            # Whiteouts only ever hide entries from lower layers.
+            for entry in layer['entries']:
+                if entry[TYPE] == WHITEOUT:
+                    remove(entry[PATH])
+                elif entry[TYPE] == OPAQUE:
+                    remove(entry[PATH], keep_root=True)
+            # A hard link shares the contents of a file earlier in the same
+            # layer archive, even if a later layer hides that file.
+            layer_files = {}
+            for entry in layer['entries']:
+                if entry[TYPE] in (WHITEOUT, OPAQUE) or entry[PATH] == '/':
+                    continue
+                entry = list(entry) + [position]
+                if entry[TYPE] == FILE:
+                    layer_files[entry[PATH]] = entry
+                elif entry[TYPE] == HARDLINK:
+                    target = layer_files.get(entry[LINKNAME])
+                    if target is not None:
+                        entry[SIZE] = target[SIZE]
+                        entry[HASH] = target[HASH]
+                add(entry)
+        self._files = files
+        self._children = children
+
+    @property
+    def files(self):
+        """
+        The merged file system as a dict from path to entry. The last field
+        of every entry is the position of the layer providing it.
+        """
+        if self._files is None:
+            self._merge()
+        return self._files
+
+    def resolve(self, path, follow=True):
+        """
+        Returns the path of the entry at path once the symlinks among its
+        directories, and the path itself if follow is true, are resolved the
+        way a container would. Returns None if the entry does not exist or
+        resolving it takes more than MAX_SYMLINK_HOPS symlinks.
+        """
+        files = self.files
+        pending = [p for p in normalize_path(path).split('/') if p]
+        pending.reverse()
+        current = '/'
+        hops = 0
+        while len(pending) > 0:
+            name = pending.pop()
+            if name == '.':
+                continue
+            if name == '..':
+                current = posixpath.dirname(current)
+                continue
+            candidate = posixpath.join(current, name)
+            entry = files.get(candidate)
+            if entry is None:
+                return None
+            if entry[TYPE] != SYMLINK or (len(pending) == 0 and not follow):
+                current = candidate
+                continue
+            hops += 1
+            if hops > MAX_SYMLINK_HOPS:
+                return None
+            target = entry[LINKNAME]
+            if target.startswith('/'):
+                current = '/'
+            pending.extend(reversed([p for p in target.split('/') if p]))
+        return current
+
+    def lookup(self, path, follow=True):
+        """
+        Returns the entry at path, or None if it does not exist. Symlinks are
+        resolved as by resolve().
+        """
+        resolved = self.resolve(path, follow)
+        return None if resolved is None else self.files[resolved]
+
+    def listdir(self, path):
+        "Returns the sorted names within the directory at path."
+        resolved = self.resolve(path)
+        if resolved is None or resolved not in self._children:
+            raise NotADirectoryError(path)
+        return sorted(self._children[resolved])
+
+    def walk(self, path='/'):
+        """
+        Yields every (path, entry) at or below path, in sorted order. Symlinks
+        leading to path are resolved, those below it are not followed.
+        """
+        path = normalize_path(path)
+        resolved = self.resolve(path)
+        if resolved is None:
+            return
+        for result in self._walk(resolved, path):
+            yield result
+
+    def _walk(self, resolved, path):
+        entry = self.files[resolved]
+        yield (path, entry)
+        if entry[TYPE] == DIRECTORY:
+            for name in sorted(self._children[resolved]):
+                for result in self._walk(posixpath.join(resolved, name),
+                                         posixpath.join(path, name)):
+                    yield result
+
+    def glob(self, pattern):
+        """
+        Returns the sorted paths matching the shell-style pattern. As in the
+        shell, wildcards never match across a '/'.
+        """
+        parts = [p for p in normalize_path(pattern).split('/') if p]
+        matches = ['/']
+        for part in parts:
+            expanded = []
+            for base in matches:
+                entry = self.lookup(base)
+                if entry is None or entry[TYPE] != DIRECTORY:
+                    continue
+                if not has_magic(part):
+                    if self.lookup(posixpath.join(base, part),
+                                   follow=False) is not None:
+                        expanded.append(posixpath.join(base, part))
+                    continue
+                for name in self.listdir(base):
+                    if name.startswith('.') and not part.startswith('.'):
+                        continue
+                    if fnmatch.fnmatchcase(name, part):
+                        expanded.append(posixpath.join(base, name))
+            matches = expanded
+        return sorted(matches)
+
+    def to_dict(self):
+        return {
+            'version': INDEX_VERSION,
+            'image_id': self.image_id,
+            'config': self.config,
+            'layers': self.layers,
+        }
+
+    def save(self, file_name):
+        "Atomically writes the index to file_name."
+        temp_name = '%s.%s.tmp' % (file_name, os.getpid())
+        with gzip.open(temp_name, 'wt', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.rename(temp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        "Reads an index previously written by save()."
+        with gzip.open(file_name, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported index version: %s' %
+                             data.get('version'))
+        return cls(data['image_id'], data['config'], data['layers'])
+
+
+def read_merged_files(d, index, want, visit):
+    """
+    Streams the image again, calling visit(path, entry, contents) for every
+    regular file or hard link of the merged file system for which
+    want(path, entry) is true. Files hidden or replaced by later layers are
+    skipped without being read.
+    """
+    files = index.files
+    positions = {}
+    for position, layer in enumerate(index.layers):
+        source = layer['source']
+        positions.setdefault(source, set()).add(position)
+    # The hard links to read along with the (layer position, path) of the
+    # file whose contents they share.
+    links = {}
+    for path, entry in files.items():
+        if entry[TYPE] == HARDLINK and want(path, entry):
+            links.setdefault((entry[-1], entry[LINKNAME]), []).append(
+                (path, entry))
+
+    def visit_layer(source, layer_tar):
+        layer_positions = positions.get(source, set())
+        for member in layer_tar:
+            if not member.isfile():
+                continue
+            path = normalize_path(member.name)
+            wanted = []
+            entry = files.get(path)
+            if entry is not None and entry[TYPE] == FILE and \
+                    entry[-1] in layer_positions and want(path, entry):
+                wanted.append((path, entry))
+            for position in layer_positions:
+                wanted.extend(links.get((position, path), []))
+            if len(wanted) == 0:
+                continue
+            contents = layer_tar.extractfile(member).read()
+            for link_path, link_entry in wanted:
+                visit(link_path, link_entry, contents)
+
+    read_saved_image(d.get_image(index.image_id), visit_layer)
+
+
+def has_magic(pattern):
+    "Determines if the pattern contains shell-style wildcards."
+    return any(c in pattern for c in '*?[')
+
+
+def mode_string(entry):
+    "Formats the entry's permissions like `ls -l`."
+    return stat.filemode(_MODE_TYPE_BITS.get(entry[TYPE], 0) |
+                         stat.S_IMODE(entry[MODE]))
+
+
+def index_file_name(cache_dir, image_id):
+    "Computes the cache file name for the image with the given digest."
+    return os.path.join(os.path.expanduser(cache_dir),
+                        '%s.json.gz' % image_id.replace(':', '_'))
+
+
+def image_index(d, image, cache_dir=DEFAULT_CACHE_DIR, rebuild=False):
+    """
+    Returns the ImageIndex for the image (an id or tag), building and caching
+    it on first use.
+    """
+    image_id = d.inspect_image(image)['Id']
+    file_name = index_file_name(cache_dir, image_id)
+    if not rebuild and os.path.isfile(file_name):
+        try:
+            return ImageIndex.load(file_name)
+        except:
+            logging.info('Could not load the cached index %s. Rebuilding...',
+                         file_name, exc_info=True)
+
+    logging.info('Indexing the layers of image %s...', image_id)
+    with tracing.span(tracing.EXPORT, 'index %s' % image_id):
+        index = ImageIndex.from_saved_image(image_id, d.get_image(image_id))
+    try:
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name), mode=0o700)
+        index.save(file_name)
+    except:
+        logging.warn('Could not cache the index of image %s.', image_id,
+                     exc_info=True)
+    return index
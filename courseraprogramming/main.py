@@ -21,15 +21,63 @@ You may install it from source, or via pip.
 """
 
 import argparse
-from courseraprogramming import commands
+from courseraprogramming import tracing
 from courseraprogramming import utils
+import importlib
 import logging
+import os
 import sys
 
 
-def build_parser():
-    "Build an argparse argument parser to parse the command line."
-
+# The subcommands, in the order they are listed in the help, and the modules
+# of courseraprogramming.commands implementing them.
+COMMANDS = [
+    ('agent', 'agent'),
+    ('analyze', 'analyze'),
+    ('cat', 'cat'),
+    ('configure', 'config'),
+    ('grade', 'grade'),
+    ('find', 'find'),
+    ('grep', 'grep'),
+    ('image-diff', 'image_diff'),
+    ('inspect', 'inspect'),
+    ('ls', 'ls'),
+    ('pull', 'pull'),
+    ('sanity', 'sanity'),
+    ('version', 'version'),
+    ('upload', 'upload'),
+    ('publish', 'publish'),
+    ('deploy', 'deploy'),
+    ('reregister', 'reregister'),
+    ('serve', 'serve'),
+    ('status', 'status'),
+    ('sync', 'sync'),
+]
+
+# Commands that keep running, which are never forwarded to a server.
+LOCAL_COMMANDS = ['agent', 'serve']
+
+
+def find_command(parser, argv):
+    """
+    Returns the subcommand argv runs, or None if it does not name one (e.g.
+    for --help). The subcommand is the first argument that is neither a
+    global option nor the value of one.
+    """
+    options = parser._option_string_actions
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument.startswith('-'):
+            action = options.get(argument)
+            if action is not None and action.nargs != 0:
+                next(arguments, None)
+            continue
+        return argument if argument in dict(COMMANDS) else None
+    return None
+
+
+def base_parser():
+    "Builds the argument parser for the global options."
     parser = argparse.ArgumentParser(
         description="""Coursera asynchronous grader command-line tool. This tool
         helps instructional teams as they develop sophisticated assignments.
@@ -42,8 +90,31 @@ def build_parser():
         https://github.com/coursera/courseraprogramming""",
         parents=[utils.docker_client_arg_parser()])
     parser.add_argument('-c', '--config', help='the configuration file to use')
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Profile the command: write a pstats profile to FILE, collapsed '
+        'stacks for flame graphs to FILE.folded, and the time spent in '
+        'docker API calls, HTTP calls and local work to the console.')
+    parser.add_argument(
+        '--trace-file',
+        metavar='FILE',
+        default=os.environ.get('COURSERAPROGRAMMING_TRACE_FILE'),
+        help='Append a JSON line to FILE for every docker API call, HTTP '
+        'request, OAuth2 token refresh and image export, with its duration, '
+        'size and status. Defaults to $COURSERAPROGRAMMING_TRACE_FILE.')
 
     utils.add_logging_parser(parser)
+    return parser
+
+
+def build_parser(argv=None):
+    """
+    Build an argparse argument parser to parse the command line. Given the
+    command line arguments, only the parser of the subcommand they run is
+    built.
+    """
+    parser = base_parser()
 
     # We have a number of subcommands. These subcommands have their own
     # subparsers. Each subcommand should set a default value for the 'func'
@@ -52,39 +123,14 @@ def build_parser():
     subparsers = parser.add_subparsers(dest="-h")
     subparsers.required = True
 
-    # create the parser for the cat command
-    commands.cat.parser(subparsers)
-
-    # create the parser for the configure subcommand. (authentication / etc.)
-    commands.config.parser(subparsers)
-
-    # create the parser for the grade subcommand.
-    commands.grade.parser(subparsers)
-
-    # create the parser for the inspect command
-    commands.inspect.parser(subparsers)
-
-    # create the parser for the ls command
-    commands.ls.parser(subparsers)
-
-    # create the parser for the sanity check command
-    commands.sanity.parser(subparsers)
-
-    # create the parser for the version subcommand.
-    commands.version.parser(subparsers)
-
-    # create the parser for the run command?
-
-    # create the parser for the build command?
-
-    # create the parser for the upload command.
-    commands.upload.parser(subparsers)
-
-    # create the parser for the publish command.
-    commands.publish.parser(subparsers)
-
-    # create the parser for the reregister command.
-    commands.reregister.parser(subparsers)
+    # Importing every command module pulls in docker-py, requests_toolbelt
+    # and friends, so when argv names a subcommand only its module is loaded.
+    command = find_command(parser, argv) if argv is not None else None
+    for name, module_name in COMMANDS:
+        if command is None or command == name:
+            module = importlib.import_module(
+                'courseraprogramming.commands.' + module_name)
+            module.parser(subparsers)
 
     return parser
 
@@ -110,20 +156,44 @@ https://docs.google.com/document/d/1pC6nvQbgVGoQ1LUoKKfxc-Hi4NkhhlnKKG_Wnydu5p8
 def main():
     "Boots up the command line tool"
     logging.captureWarnings(True)
-    args = build_parser().parse_args()
+    argv = sys.argv[1:]
+    server = os.environ.get('COURSERAPROGRAMMING_SERVER')
+    if server and find_command(base_parser(), argv) not in LOCAL_COMMANDS:
+        from courseraprogramming.commands import serve
+        result = serve.forward(os.path.expanduser(server), argv)
+        if result is not None:
+            sys.exit(result)
+    return run(argv)
+
+
+def run(argv):
+    "Parses the command line arguments and runs the subcommand."
+    args = build_parser(argv).parse_args(argv)
     # Configure logging
     args.setup_logging(args)
     # Dispatch into the appropriate subcommand function.
 
     printAutograderV2HeadsUp()
 
+    command = getattr(args, '-h')
+    if args.trace_file:
+        tracing.start(args.trace_file, command)
     try:
-        return args.func(args)
+        with tracing.span(tracing.COMMAND, command) as span:
+            if args.profile is not None:
+                from courseraprogramming import profiling
+                result = profiling.run(args.func, args, args.profile)
+            else:
+                result = args.func(args)
+            span['status'] = result
+            return result
     except SystemExit:
         raise
     except:
         logging.exception('Problem when running command. Sorry!')
         sys.exit(1)
+    finally:
+        tracing.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Profiles a subcommand run with the global --profile option.
+
+Two profiles are written: a deterministic cProfile of the main thread, in
+pstats format, and a statistical profile of every thread, sampled at a fixed
+interval and written as collapsed stacks for flame graph tools. The samples
+are also attributed to Docker API calls, HTTP calls, other I/O, local work or
+idle waiting, and the totals are reported when the command finishes.
+"""
+
+import collections
+import cProfile
+import logging
+import os.path
+import sys
+import threading
+import time
+
+
+SAMPLE_INTERVAL = 0.005
+
+DOCKER = 'docker API'
+HTTP = 'HTTP'
+IO = 'I/O'
+LOCAL = 'local'
+IDLE = 'idle'
+CATEGORIES = [DOCKER, HTTP, IO, LOCAL, IDLE]
+
+# Modules whose frames mark a sample as spent in a remote call or other I/O,
+# in the order they are checked. Docker-py talks HTTP through requests, so it
+# comes first. Sockets are attributed to the library calling them, if any;
+# on their own, e.g. the serve socket, they are plain I/O.
+CATEGORY_MODULES = [
+    (DOCKER, ('docker',)),
+    (HTTP, ('requests', 'urllib3', 'http')),
+    (IO, ('socket', 'ssl')),
+]
+
+# Modules whose frame at the top of a stack means the thread is blocked, e.g.
+# a pool worker waiting for work or the main thread waiting for futures.
+WAIT_MODULES = ('threading', 'queue', 'selectors', 'concurrent',
+                'subprocess')
+
+
+def frame_module(frame):
+    return frame.f_globals.get('__name__', '')
+
+
+def categorize(modules, busy=True):
+    """
+    Returns the category of a stack, given the modules of its frames from the
+    outermost to the innermost. busy is false when the thread used no CPU
+    time since it was last sampled.
+    """
+    for category, prefixes in CATEGORY_MODULES:
+        for module in modules:
+            if module.split('.', 1)[0] in prefixes:
+                return category
+    if not busy or \
+            (modules and modules[-1].split('.', 1)[0] in WAIT_MODULES):
+        return IDLE
+    return LOCAL
+
+
+def thread_cpu_time(ident):
+    "Returns the CPU time used by a thread so far, or None if unknown."
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except:
+        return None
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the stacks of all other threads every `interval` seconds until
+    stopped.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super(Sampler, self).__init__(name='profiler')
+        self.daemon = True
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.categories = collections.Counter()
+        self.samples = 0
+        self.cpu_times = {}
+        self.stopped = threading.Event()
+
+    def sample(self):
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            frames.reverse()
+            stack = [names.get(ident, 'thread-%s' % ident)]
+            stack.extend(frame_name(f) for f in frames)
+            self.stacks[';'.join(stack)] += 1
+            # Threads sleeping outside of the WAIT_MODULES, e.g. in
+            # time.sleep, are told apart by their CPU time not advancing.
+            cpu_time = thread_cpu_time(ident)
+            last_cpu_time = self.cpu_times.get(ident)
+            self.cpu_times[ident] = cpu_time
+            busy = cpu_time is None or last_cpu_time is None or \
+                cpu_time > last_cpu_time
+            self.categories[categorize([frame_module(f) for f in frames],
+                                       busy)] += 1
+        self.samples += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write_collapsed(self, out):
+        for stack, count in sorted(self.stacks.items()):
+            out.write('%s %s\n' % (stack, count))
+
+
+def write_summary(sampler, wall_time, out):
+    "Writes how the sampled thread time splits across the categories."
+    total = sum(sampler.categories.values())
+    out.write('Profiled %.2f seconds, %s samples every %.0f ms.\n' % (
+        wall_time, sampler.samples, sampler.interval * 1000))
+    for category in CATEGORIES:
+        count = sampler.categories[category]
+        out.write('  %-12s %8.2f thread-seconds  %3.0f%%\n' % (
+            category, count * sampler.interval,
+            100.0 * count / total if total else 0))
+
+
+def run(func, args, file_name, interval=SAMPLE_INTERVAL):
+    """
+    Runs func(args) under both profilers and returns its result. The pstats
+    profile is written to file_name and the collapsed stacks to
+    file_name + '.folded', even if func raises.
+    """
+    profile = cProfile.Profile()
+    sampler = Sampler(interval)
+    start = time.time()
+    sampler.start()
+    try:
+        return profile.runcall(func, args)
+    finally:
+        sampler.stop()
+        wall_time = time.time() - start
+        profile.dump_stats(file_name)
+        with open(file_name + '.folded', 'w') as f:
+            sampler.write_collapsed(f)
+        write_summary(sampler, wall_time, sys.stderr)
+        logging.info('Wrote the profile to %s and the collapsed stacks to '
+                     '%s.folded', file_name, file_name)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local index of the graders registered with Coursera.
+
+Every upload, reregistration and publish records what it did in a SQLite
+database, and `courseraprogramming sync` refreshes it from the listing APIs,
+so that looking up a grader's S3 object, or which parts use which grader, is
+a local query rather than a round of API calls. The registry is only ever a
+cache: failing to read or write it never fails a command.
+"""
+
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_REGISTRY = '~/.coursera/registry.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS graders (
+    executor_id TEXT PRIMARY KEY,
+    course_id TEXT NOT NULL,
+    bucket TEXT,
+    key TEXT,
+    location TEXT,
+    status TEXT,
+    replaces TEXT,
+    registered_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS graders_by_course ON graders (course_id);
+CREATE TABLE IF NOT EXISTS parts (
+    course_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    part_id TEXT NOT NULL,
+    executor_id TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (course_id, item_id, part_id)
+);
+CREATE INDEX IF NOT EXISTS parts_by_executor ON parts (executor_id);
+CREATE TABLE IF NOT EXISTS items (
+    course_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    published_at REAL NOT NULL,
+    PRIMARY KEY (course_id, item_id)
+);
+'''
+
+GRADER_COLUMNS = ('executor_id', 'course_id', 'bucket', 'key', 'location',
+                  'status', 'replaces', 'registered_at', 'updated_at')
+
+
+class Registry(object):
+    """
+    The registry database. One connection is shared by all threads of the
+    process; SQLite serializes writers across processes.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            file_name, timeout=30, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def _write(self, statement, parameters):
+        self._write_all([(statement, parameters)])
+
+    def _write_all(self, statements):
+        "Runs the (statement, parameters) pairs in one transaction."
+        try:
+            with self.lock, self.connection:
+                for statement, parameters in statements:
+                    self.connection.execute(statement, parameters)
+        except sqlite3.Error:
+            logging.warn('Could not update the grader registry %s',
+                         self.file_name, exc_info=True)
+
+    def _read(self, statement, parameters):
+        "Runs a query, returning no rows if the registry cannot be read."
+        try:
+            with self.lock:
+                return self.connection.execute(
+                    statement, parameters).fetchall()
+        except sqlite3.Error:
+            logging.warn('Could not read the grader registry %s',
+                         self.file_name, exc_info=True)
+            return []
+
+    def record_grader(self, course_id, executor_id, bucket=None, key=None,
+                      location=None, status=None, replaces=None,
+                      registered=False):
+        """
+        Adds or updates a grader. Fields given as None keep their recorded
+        value.
+        """
+        now = time.time()
+        registered_at = now if registered else None
+        # An update followed by an insert of missing rows, rather than an
+        # upsert, which needs SQLite 3.24.
+        update = ('''
+            UPDATE graders SET
+                course_id = ?,
+                bucket = COALESCE(?, bucket),
+                key = COALESCE(?, key),
+                location = COALESCE(?, location),
+                status = COALESCE(?, status),
+                replaces = COALESCE(?, replaces),
+                registered_at = COALESCE(?, registered_at),
+                updated_at = ?
+            WHERE executor_id = ?
+            ''', (course_id, bucket, key, location, status, replaces,
+                  registered_at, now, executor_id))
+        insert = ('''
+            INSERT OR IGNORE INTO graders (executor_id, course_id, bucket, key,
+                                           location, status, replaces,
+                                           registered_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (executor_id, course_id, bucket, key, location, status,
+                  replaces, registered_at, now))
+        self._write_all([update, insert])
+
+    def record_part(self, course_id, item_id, part_id, executor_id):
+        "Records that the part is now graded by the grader."
+        self._write('''
+            INSERT OR REPLACE INTO parts (course_id, item_id, part_id,
+                                          executor_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (course_id, item_id, part_id, executor_id, time.time()))
+
+    def record_publish(self, course_id, item_id, outcome):
+        "Records the outcome of the latest attempt to publish the item."
+        self._write('''
+            INSERT OR REPLACE INTO items (course_id, item_id, outcome,
+                                          published_at)
+            VALUES (?, ?, ?, ?)
+            ''', (course_id, item_id, outcome, time.time()))
+
+    def grader(self, executor_id):
+        "Returns what is known about the grader as a dict, or None."
+        rows = self._read(
+            'SELECT %s FROM graders WHERE executor_id = ?' %
+            ', '.join(GRADER_COLUMNS), (executor_id, ))
+        return dict(zip(GRADER_COLUMNS, rows[0])) if rows else None
+
+    def graders(self, course_id):
+        "Returns the known graders of the course, oldest first."
+        rows = self._read(
+            'SELECT %s FROM graders WHERE course_id = ? '
+            'ORDER BY registered_at, executor_id' %
+            ', '.join(GRADER_COLUMNS), (course_id, ))
+        return [dict(zip(GRADER_COLUMNS, row)) for row in rows]
+
+    def parts(self, course_id=None, executor_id=None):
+        "Returns (course, item, part, executor) rows matching the filters."
+        conditions = []
+        parameters = []
+        if course_id is not None:
+            conditions.append('course_id = ?')
+            parameters.append(course_id)
+        if executor_id is not None:
+            conditions.append('executor_id = ?')
+            parameters.append(executor_id)
+        statement = 'SELECT course_id, item_id, part_id, executor_id ' \
+            'FROM parts'
+        if conditions:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        return self._read(statement + ' ORDER BY item_id, part_id',
+                          tuple(parameters))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_registry(file_name=None):
+    """
+    Opens the registry, by default the one at the `path` of the `registry`
+    section of the configuration. Returns None if it is disabled (an empty
+    path) or cannot be opened.
+    """
+    if file_name is None:
+        # Imported here: the commands package imports this module.
+        from courseraprogramming.commands import oauth2
+        try:
+            file_name = oauth2.configuration().get('registry', 'path')
+        except:
+            file_name = DEFAULT_REGISTRY
+    if not file_name:
+        return None
+    file_name = os.path.expanduser(file_name)
+    try:
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+        return Registry(file_name)
+    except (OSError, sqlite3.Error):
+        logging.warn('Could not open the grader registry %s', file_name,
+                     exc_info=True)
+        return None
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Records what a command spends its time on, for the global --trace-file
+option.
+
+Every docker API call, HTTP request, OAuth2 token refresh and file export
+becomes a span: one JSON object per line, appended to the trace file, with
+its kind, name, start time, duration and, where known, status and size in
+bytes. Spans carry the id of the run and the name of the command, so the
+files of many runs (e.g. from CI) can simply be concatenated and aggregated.
+Tracing is off unless start() is called, and spans then cost next to nothing.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+COMMAND = 'command'
+DOCKER = 'docker'
+HTTP = 'http'
+OAUTH2 = 'oauth2'
+EXPORT = 'export'
+
+_tracer = None
+
+
+class Tracer(object):
+    "Appends spans to the trace file."
+
+    def __init__(self, file_name, command):
+        self.run = uuid.uuid4().hex
+        self.command = command
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.fd = os.open(file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+
+    def write(self, kind, name, start, duration, fields):
+        span = {
+            'run': self.run,
+            'command': self.command,
+            'host': self.host,
+            'pid': self.pid,
+            'thread': threading.current_thread().name,
+            'kind': kind,
+            'name': name,
+            'start': start,
+            'duration': duration,
+        }
+        span.update(fields)
+        line = (json.dumps(span, sort_keys=True) + '\n').encode('utf-8')
+        # A single unbuffered write per line to a file opened for appending,
+        # so that neither threads nor concurrent runs appending to the same
+        # file interleave within a line.
+        with self.lock:
+            if self.fd is not None:
+                os.write(self.fd, line)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+def start(file_name, command):
+    "Starts tracing the command into file_name."
+    global _tracer
+    try:
+        _tracer = Tracer(os.path.expanduser(file_name), command)
+    except (IOError, OSError):
+        logging.warn('Cannot write the trace file %s', file_name,
+                     exc_info=True)
+        return
+    install_http_hooks()
+
+
+def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+def enabled():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def span(kind, name, **fields):
+    """
+    Times the block as a span. Yields a dict the block may add fields to,
+    such as 'status' or 'bytes'. Exceptions are recorded in 'error'.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield {}
+        return
+    record = dict(fields)
+    start_time = time.time()
+    try:
+        yield record
+    except SystemExit as e:
+        record.setdefault('status', e.code)
+        raise
+    except BaseException as e:
+        record.setdefault('error', type(e).__name__)
+        raise
+    finally:
+        tracer.write(kind, name, start_time, time.time() - start_time,
+                     record)
+
+
+_installed = False
+
+
+def install_http_hooks():
+    """
+    Traces every request sent by a requests session. docker-py clients are
+    sessions too; their requests are recorded as docker spans.
+    """
+    global _installed
+    if _installed:
+        return
+    import requests
+    import urllib.parse
+
+    original_send = requests.Session.send
+
+    def send(self, request, **kwargs):
+        if _tracer is None:
+            return original_send(self, request, **kwargs)
+        url = urllib.parse.urlsplit(request.url)
+        if type(self).__module__.split('.', 1)[0] == 'docker':
+            kind, name = DOCKER, '%s %s' % (request.method, url.path)
+        else:
+            kind, name = HTTP, '%s %s%s' % (request.method, url.netloc,
+                                            url.path)
+        with span(kind, name) as record:
+            if isinstance(request.body, (bytes, str)):
+                record['bytes_sent'] = len(request.body)
+            response = original_send(self, request, **kwargs)
+            record['status'] = response.status_code
+            try:
+                record['bytes'] = int(response.headers['Content-Length'])
+            except (KeyError, ValueError):
+                pass
+            return response
+
+    requests.Session.send = send
+    _installed = True
@@ -21,13 +21,27 @@ You may install it from source, or via pip.
 """
 
 import argparse
-from docker import Client
-from docker.utils import kwargs_from_env
-import requests
+import json
 import logging
+import os
 import sys
+import tempfile
+import threading
+import time
 from sys import platform as _platform
 
+DOCKER_VERSION_CACHE = '~/.coursera/docker_versions.json'
+DOCKER_VERSION_TTL = 60 * 60  # seconds
+DEFAULT_DOCKER_URL = 'unix://var/run/docker.sock'
+
+# One docker client per daemon for the whole process. The clients of a parent
+# process are never reused after a fork (e.g. by `serve`), as their connection
+# pools would be shared with the parent.
+_docker_clients = {}
+_docker_versions = {}
+_docker_clients_pid = None
+_docker_clients_lock = threading.Lock()
+
 
 def add_logging_parser(main_parser):
     "Build an argparse argument parser to parse the command line."
@@ -84,6 +98,7 @@ def set_logging_level(args):
         root_logger.setLevel(level)
 
     if args.silence_urllib3:
+        import requests
         # See: https://urllib3.readthedocs.org/en/latest/security.html
         requests.packages.urllib3.disable_warnings()
 
@@ -109,47 +124,135 @@ def docker_client_arg_parser():
     return docker_parser
 
 
-def docker_client(args):
-    """
-    Attempts to create a docker client.
+def docker_client_kwargs(args):
+    "Computes the arguments of the docker-py client for this platform."
+    from docker.utils import kwargs_from_env
 
-     - args: The arguments parsed on the command line.
-     - returns: a docker-py client
-    """
     if _platform == 'linux' or _platform == 'linux2':
         # linux
         if "docker_url" in args:
-            return Client(
-                base_url=args.docker_url,
-                timeout=args.timeout,
-                version='auto')
+            return {'base_url': args.docker_url}
         else:
             # TODO: test to see if this does the right thing by default.
-            return Client(
-                version='auto',
-                timeout=args.timeout,
-                **kwargs_from_env())
+            return kwargs_from_env()
     elif _platform == 'darwin':
         # OS X.
         kwargs = kwargs_from_env()
         if not args.strict_docker_tls and 'tls' in kwargs:
             kwargs['tls'].assert_hostname = False
-
-        try:
-            return Client(version='auto', timeout=args.timeout, **kwargs)
-        except:
-            logging.error(
-                'Could not connect to the docker daemon. ' +
-                'Please make sure docker is running.'
-            )
-            sys.exit(2)
-
+        return kwargs
     elif _platform == 'win32' or _platform == 'cygwin':
         # Windows.
         logging.fatal("Sorry, windows is not currently supported!")
         sys.exit(2)
 
 
+def load_docker_version(docker_url, file_name=DOCKER_VERSION_CACHE,
+                        ttl=DOCKER_VERSION_TTL):
+    """
+    Returns the cached `/version` response of the docker daemon at
+    `docker_url`, or None if it is not cached or older than `ttl` seconds.
+    """
+    try:
+        with open(os.path.expanduser(file_name)) as f:
+            entry = json.load(f)[docker_url]
+    except:
+        return None
+    if not 0 <= time.time() - entry['checked_at'] < ttl:
+        return None
+    return entry['version']
+
+
+def save_docker_version(docker_url, version, file_name=DOCKER_VERSION_CACHE):
+    "Caches the `/version` response of the docker daemon at `docker_url`."
+    file_name = os.path.expanduser(file_name)
+    try:
+        with open(file_name) as f:
+            entries = json.load(f)
+    except:
+        entries = {}
+    entries[docker_url] = {'checked_at': time.time(), 'version': version}
+    directory = os.path.dirname(file_name) or '.'
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp, file_name)
+    except:
+        logging.debug('Could not write docker version cache %s', file_name)
+
+
+def connect_docker(docker_url, timeout, kwargs):
+    """
+    Creates a docker-py client speaking the API version of the daemon.
+
+    Instead of letting docker-py negotiate the version (one `/version` round
+    trip per client), the daemon's `/version` response is cached on disk for
+    DOCKER_VERSION_TTL seconds. Returns the client and the response.
+    """
+    from docker import Client
+
+    version = load_docker_version(docker_url)
+    if version is None:
+        probe = Client(timeout=timeout, **kwargs)
+        try:
+            version = probe.version(api_version=False)
+        finally:
+            probe.close()
+        save_docker_version(docker_url, version)
+    client = Client(version=version['ApiVersion'], timeout=timeout, **kwargs)
+    return client, version
+
+
+def docker_client(args):
+    """
+    Attempts to create a docker client, or returns the one already created by
+    this process for the same daemon.
+
+     - args: The arguments parsed on the command line.
+     - returns: a docker-py client
+    """
+    global _docker_clients_pid
+
+    kwargs = docker_client_kwargs(args)
+    docker_url = kwargs.get('base_url') or DEFAULT_DOCKER_URL
+    key = (docker_url, args.timeout)
+    with _docker_clients_lock:
+        if _docker_clients_pid != os.getpid():
+            _docker_clients.clear()
+            _docker_versions.clear()
+            _docker_clients_pid = os.getpid()
+        if key not in _docker_clients:
+            if _platform == 'darwin':
+                try:
+                    client, version = connect_docker(
+                        docker_url, args.timeout, kwargs)
+                except:
+                    logging.error(
+                        'Could not connect to the docker daemon. ' +
+                        'Please make sure docker is running.'
+                    )
+                    sys.exit(2)
+            else:
+                client, version = connect_docker(
+                    docker_url, args.timeout, kwargs)
+            _docker_clients[key] = client
+            _docker_versions[docker_url] = version
+        return _docker_clients[key]
+
+
+def docker_version(args):
+    """
+    Returns the `/version` response of the docker daemon, as cached when its
+    client was created.
+    """
+    docker_client(args)
+    kwargs = docker_client_kwargs(args)
+    return _docker_versions[kwargs.get('base_url') or DEFAULT_DOCKER_URL]
+
+
 def check_int_range(value, lower=None, upper=None):
     try:
         value = int(value)
@@ -162,3 +265,17 @@ def check_int_range(value, lower=None, upper=None):
         raise argparse.ArgumentTypeError(
             '{} is above the upper bound of {}'.format(value, upper))
     return value
+
+
+def human_size(num_bytes):
+    "Formats a byte count like `ls -h` does. (e.g. 900, 1.5K, 23M)"
+    value = float(num_bytes)
+    for unit in ['', 'K', 'M', 'G', 'T']:
+        if value < 1024 or unit == 'T':
+            break
+        value /= 1024
+    if unit == '':
+        return '%d' % num_bytes
+    if value < 10:
+        return '%.1f%s' % (value, unit)
+    return '%d%s' % (round(value), unit)
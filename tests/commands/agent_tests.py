@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from courseraprogramming import main
+from courseraprogramming.commands import agent
+from courseraprogramming.commands import oauth2
+import argparse
+import configparser
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from mock import MagicMock
+
+
+def make_agent():
+    oauth2_instance = MagicMock()
+    oauth2_instance.client_id = 'client'
+    oauth2_instance.scopes = 'scopes'
+    auth = oauth2_instance.build_refreshing_authorizer.return_value
+    auth.token = 'token'
+    auth.expires = time.time() + 3600
+    auth.refresh_margin = 300
+    return agent.TokenAgent(oauth2_instance), auth
+
+
+def test_agent_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('agent --socket /tmp/agent.sock'.split())
+    assert args.func == agent.command_agent
+    assert args.socket == '/tmp/agent.sock'
+
+
+def test_agent_refuses_other_clients():
+    token_agent, auth = make_agent()
+    response = token_agent.handle({'client_id': 'other', 'scopes': 'scopes'})
+    assert 'error' in response
+
+
+def test_agent_hands_out_tokens():
+    token_agent, auth = make_agent()
+    response = token_agent.handle({'client_id': 'client', 'scopes': 'scopes'})
+    assert response == {'token': 'token', 'expires': auth.expires}
+    assert not auth.refresh.called
+
+    token_agent.handle({'client_id': 'client', 'scopes': 'scopes',
+                        'stale_token': 'token'})
+    auth.refresh.assert_called_with(stale_token='token')
+
+
+def test_agent_refreshes_expiring_tokens():
+    token_agent, auth = make_agent()
+    auth.expires = time.time() + 10
+    token_agent.handle({'client_id': 'client', 'scopes': 'scopes'})
+    auth.refresh.assert_called_with(stale_token='token')
+
+
+def test_agent_over_socket():
+    token_agent, auth = make_agent()
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, 'agent.sock')
+    server = agent.make_server(token_agent, socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert agent.agent_is_running(socket_path)
+        assert agent.make_server(token_agent, socket_path) is None
+
+        fallback = MagicMock()
+        fallback.client_id = 'client'
+        fallback.scopes = 'scopes'
+        client = oauth2.AgentOAuth2(socket_path, fallback)
+        authorizer = client.build_authorizer()
+        assert authorizer.token == 'token'
+        assert client.token_cache['token'] == 'token'
+        assert not fallback.build_authorizer.called
+
+        fallback.scopes = 'other scopes'
+        client = oauth2.AgentOAuth2(socket_path, fallback)
+        assert client.build_authorizer() == \
+            fallback.build_authorizer.return_value
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree(directory)
+
+
+def test_agent_client_falls_back_when_unreachable():
+    fallback = MagicMock()
+    client = oauth2.AgentOAuth2('/nonexistent/agent.sock', fallback)
+    assert client.build_refreshing_authorizer() == \
+        fallback.build_refreshing_authorizer.return_value
+    assert client.token_cache == fallback.token_cache
+
+
+def test_build_oauth2_uses_running_agent():
+    directory = tempfile.mkdtemp()
+    try:
+        socket_path = os.path.join(directory, 'agent.sock')
+        open(socket_path, 'w').close()
+        args = argparse.Namespace()
+        args.client_id = 'client_id'
+        args.client_secret = 'fake-secret'
+        args.scopes = 'fake scopes'
+        args.token_cache_file = os.path.join(directory, 'cache.json')
+        cfg = configparser.ConfigParser()
+        cfg.add_section('oauth2')
+        cfg.set('oauth2', 'agent_socket', socket_path)
+        built = oauth2.build_oauth2(args, cfg)
+        assert isinstance(built, oauth2.AgentOAuth2)
+        assert built.token_cache_file == args.token_cache_file
+        assert isinstance(oauth2.build_oauth2(args, cfg, use_agent=False),
+                          oauth2.CourseraOAuth2)
+        os.remove(socket_path)
+        assert isinstance(oauth2.build_oauth2(args, cfg),
+                          oauth2.CourseraOAuth2)
+    finally:
+        shutil.rmtree(directory)
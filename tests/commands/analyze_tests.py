@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from courseraprogramming import main
+from courseraprogramming.commands import analyze
+from tests import fake_images
+import io
+
+
+def make_index():
+    return layers.ImageIndex.from_saved_image(
+        'sha256:abc',
+        fake_images.make_saved_image([
+            [
+                ('var', None),
+                ('var/lib', None),
+                ('var/lib/apt', None),
+                ('var/lib/apt/lists', b'a' * 1000),
+                ('grader', None),
+                ('grader/grader.py', b'v1' * 50),
+            ],
+            [
+                ('var/lib/.wh.apt', b''),
+                ('grader/grader.py', b'v2' * 60),
+                ('grader/data.bin', b'd' * 500),
+            ],
+        ], history=[
+            {'created_by': '/bin/sh -c apt-get update'},
+            {'created_by': '/bin/sh -c #(nop)  ENV FOO=bar',
+             'empty_layer': True},
+            {'created_by': '/bin/sh -c #(nop) COPY dir:123 in /grader'},
+        ]))
+
+
+def test_analyze_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('analyze --depth 3 myimage'.split())
+    assert args.func == analyze.command_analyze
+    assert args.imageId == 'myimage'
+    assert args.depth == 3
+    assert args.top == 10
+
+
+def test_analyze_layers_and_instructions():
+    report = analyze.analyze_index(make_index())
+    assert [layer['size'] for layer in report['layers']] == [1100, 620]
+    assert report['total_size'] == 1720
+    assert report['layers'][0]['instruction'] == 'RUN apt-get update'
+    assert report['layers'][1]['instruction'] == 'COPY dir:123 in /grader'
+
+
+def test_analyze_wasted_bytes():
+    report = analyze.analyze_index(make_index())
+    assert report['wasted_size'] == 1100
+    assert report['wasted'] == [
+        {'path': '/var/lib/apt/lists', 'size': 1000, 'layer': 0,
+         'reason': 'deleted'},
+        {'path': '/grader/grader.py', 'size': 100, 'layer': 0,
+         'reason': 'overwritten'},
+    ]
+
+
+def test_analyze_directories_and_largest_files():
+    report = analyze.analyze_index(make_index(), depth=1, top=1)
+    assert report['directories'] == [('/grader', 620)]
+    assert report['largest_files'] == [
+        {'path': '/grader/data.bin', 'size': 500, 'layer': 1}]
+
+
+def test_print_report():
+    out = io.StringIO()
+    analyze.print_report(analyze.analyze_index(make_index()), 10, out)
+    assert 'Wasted: 1.1K' in out.getvalue()
+    assert '/var/lib/apt/lists (layer 0, deleted later)' in out.getvalue()
@@ -16,49 +16,115 @@
 
 import argparse
 import docker
+import io
+import tarfile
 from courseraprogramming import main
 from courseraprogramming.commands import cat
 from mock import MagicMock
 from mock import patch
 
 
-def test_cat_parsing():
-    parser = main.build_parser()
-    args = parser.parse_args('cat imageId /root/foo bar /bar/baz'.split())
-    assert args.func == cat.command_cat
-    assert args.imageId == 'imageId'
-    assert args.file == ['/root/foo', 'bar', '/bar/baz']
+def make_archive(name, data=None, linkname=None):
+    "Builds the tar stream the docker archive API returns for a single path."
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as archive:
+        info = tarfile.TarInfo(name)
+        if linkname is not None:
+            info.type = tarfile.SYMTYPE
+            info.linkname = linkname
+            archive.addfile(info)
+        elif data is None:
+            info.type = tarfile.DIRTYPE
+            archive.addfile(info)
+        else:
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    stream.seek(0)
+    return (stream, None)
 
 
-@patch('courseraprogramming.commands.cat.utils')
-def test_ls_run(utils):
-
+def make_docker_mock(files):
     docker_mock = MagicMock(spec=docker.Client)
     docker_mock.create_container.return_value = {
         'Id': 'really-long-container-id-hash',
         'Warnings': None
     }
-    docker_mock.wait.return_value = 0
-    docker_mock.logs.return_value = "1231\n1241\n41211"
-    utils.docker_client.return_value = docker_mock
 
-    # Set up args
+    def get_archive(container, path):
+        if path not in files:
+            raise docker.errors.NotFound('Not found', MagicMock())
+        return files[path]()
+    docker_mock.get_archive.side_effect = get_archive
+    return docker_mock
+
+
+def run_cat(docker_mock, utils, files):
+    utils.docker_client.return_value = docker_mock
     args = argparse.Namespace()
     args.imageId = 'testImageId'
-    args.file = '/grader/testCases.txt'
+    args.file = files
+    args.parallelism = 4
+    stdout = MagicMock()
+    stdout.buffer = io.BytesIO()
+    with patch('courseraprogramming.commands.cat.sys.stdout', stdout):
+        exit_code = cat.command_cat(args)
+    return exit_code, stdout.buffer.getvalue()
+
+
+def test_cat_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('cat imageId /root/foo bar /bar/baz'.split())
+    assert args.func == cat.command_cat
+    assert args.imageId == 'imageId'
+    assert args.file == ['/root/foo', 'bar', '/bar/baz']
+    assert args.parallelism == 4
 
-    with patch('courseraprogramming.commands.cat.sys.stdout') as stdout:
-        # Run the command
-        cat.command_cat(args)
 
-    # Verify correct command output
-    stdout.write.assert_called_with(docker_mock.logs.return_value)
+@patch('courseraprogramming.commands.cat.utils')
+def test_cat_run(utils):
+    docker_mock = make_docker_mock({
+        '/grader/testCases.txt': lambda: make_archive(
+            'testCases.txt', b'1231\n1241\n41211'),
+    })
+
+    exit_code, output = run_cat(docker_mock, utils, ['/grader/testCases.txt'])
 
+    assert exit_code == 0
+    assert output == b'1231\n1241\n41211'
     docker_mock.create_container.assert_called_with(
         image='testImageId',
-        entrypoint='/bin/cat',
-        command='/grader/testCases.txt')
-    docker_mock.start.assert_called_with(
-        docker_mock.create_container.return_value)
-    docker_mock.logs.assert_called_with(
-        docker_mock.create_container.return_value)
+        entrypoint='/bin/true')
+    assert not docker_mock.start.called
+    docker_mock.remove_container.assert_called_with(
+        docker_mock.create_container.return_value, force=True)
+
+
+@patch('courseraprogramming.commands.cat.utils')
+def test_cat_binary_files_in_order(utils):
+    binary = bytes(range(256)) * 1024
+    docker_mock = make_docker_mock({
+        '/a.bin': lambda: make_archive('a.bin', binary),
+        '/b.txt': lambda: make_archive('b.txt', b'hello'),
+        '/c': lambda: make_archive('c', linkname='b.txt'),
+    })
+
+    exit_code, output = run_cat(
+        docker_mock, utils, ['/a.bin', '/b.txt', '/c'])
+
+    assert exit_code == 0
+    assert output == binary + b'hello' + b'hello'
+
+
+@patch('courseraprogramming.commands.cat.utils')
+def test_cat_missing_and_directory(utils):
+    docker_mock = make_docker_mock({
+        '/grader': lambda: make_archive('grader'),
+        '/b.txt': lambda: make_archive('b.txt', b'hello'),
+    })
+
+    exit_code, output = run_cat(
+        docker_mock, utils, ['/missing', '/grader', '/b.txt'])
+
+    assert exit_code == 1
+    assert output == b'hello'
+    assert docker_mock.remove_container.called
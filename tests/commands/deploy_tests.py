@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+from courseraprogramming.commands import deploy
+from courseraprogramming.commands import publish
+
+from mock import MagicMock
+from mock import patch
+from testfixtures import LogCapture
+import threading
+
+# Never write to the grader registry from tests.
+registry_patcher = patch(
+    'courseraprogramming.registry.open_registry', return_value=None)
+
+
+def setup_module():
+    registry_patcher.start()
+
+
+def teardown_module():
+    registry_patcher.stop()
+
+
+def test_deploy_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'deploy course1 --target img1 item1 part1 '
+        '--target img1 item1 part2 --target img2 item2 part1'.split())
+    assert args.func == deploy.command_deploy
+    assert args.course == 'course1'
+    assert args.target == [
+        ['img1', 'item1', 'part1'],
+        ['img1', 'item1', 'part2'],
+        ['img2', 'item2', 'part1'],
+    ]
+    assert args.wait
+    assert args.parallelism == 4
+
+
+def test_group_targets():
+    images = deploy.group_targets([
+        ['img2', 'item1', 'part1'],
+        ['img1', 'item2', 'part1'],
+        ['img2', 'item1', 'part2'],
+    ])
+    assert list(images.items()) == [
+        ('img2', [('item1', 'part1'), ('item1', 'part2')]),
+        ('img1', [('item2', 'part1')]),
+    ]
+
+
+def make_args(*targets):
+    parser = main.build_parser()
+    argv = ['deploy', 'course1', '--pa-id-cache', '']
+    for target in targets:
+        argv += ['--target'] + list(target)
+    args = parser.parse_args(argv)
+    args.pa_id_cache = None
+    return args
+
+
+@patch('courseraprogramming.commands.deploy.upload')
+def test_register_image(upload):
+    args = make_args(('img1', 'item1', 'part1'))
+    upload.upload_grader_image.return_value = ('bucket', 'key')
+    upload.register_grader_with_location.return_value = ('grader1', 'loc')
+    upload.update_assignments.return_value = 0
+    session = MagicMock()
+
+    assert deploy.register_image(
+        args, 'docker', session, 'img1',
+        [('item1', 'part1'), ('item1', 'part2')]) == ('grader1', 'loc')
+
+    image_args = upload.upload_grader_image.call_args[0][0]
+    assert image_args.imageId == 'img1'
+    assert image_args.item == 'item1'
+    assert image_args.part == 'part1'
+    assert image_args.additional_item_and_part == [['item1', 'part2']]
+    assert not hasattr(args, 'imageId')
+    upload.register_grader_with_location.assert_called_with(
+        session.auth, image_args, bucket='bucket', key='key', registry_db=None)
+    upload.update_assignments.assert_called_with(
+        session.auth, 'grader1', image_args, registry_db=None)
+
+
+@patch('courseraprogramming.commands.deploy.publish.wait_for_location')
+def test_wait_for_grader(wait_for_location):
+    args = make_args(('img1', 'item1', 'part1'))
+    wait_for_location.return_value = publish.GraderExecutorStatus.COMPLETED
+    session = MagicMock()
+    assert deploy.wait_for_grader(
+        args, session, 'img1', 'grader1', 'loc') == 'grader1'
+    assert wait_for_location.call_args[0][:2] == (session, 'loc')
+
+
+@patch('courseraprogramming.commands.deploy.publish.wait_for_location')
+def test_wait_for_grader_failed(wait_for_location):
+    args = make_args(('img1', 'item1', 'part1'))
+    wait_for_location.return_value = publish.GraderExecutorStatus.FAILED
+    try:
+        deploy.wait_for_grader(args, MagicMock(), 'img1', 'grader1', 'loc')
+        assert False, 'wait_for_grader should have failed'
+    except deploy.DeployError as e:
+        assert str(e) == 'grader failed'
+
+
+def fake_register_image(args, d, session, image, parts, registry_db=None):
+    if image == 'img2':
+        raise deploy.DeployError('upload timed out')
+    return 'grader-' + image, 'loc-' + image
+
+
+@patch('courseraprogramming.commands.deploy.publish.publish_one')
+@patch('courseraprogramming.commands.deploy.wait_for_grader')
+@patch('courseraprogramming.commands.deploy.register_image')
+@patch('courseraprogramming.commands.deploy.oauth2')
+@patch('courseraprogramming.commands.deploy.utils')
+def test_command_deploy(utils, oauth2, register_image, wait_for_grader,
+                        publish_one):
+    args = make_args(
+        ('img1', 'item1', 'part1'),
+        ('img2', 'item1', 'part2'),
+        ('img3', 'item2', 'part1'))
+    args.quiet = 1
+    register_image.side_effect = lambda *a, **kw: ('grader-' + a[3], 'loc')
+    publish_one.return_value = (publish.PUBLISHED, None)
+
+    assert deploy.command_deploy(args) == 0
+
+    assert register_image.call_count == 3
+    image_args = register_image.call_args[0][0]
+    assert image_args.quiet == 2
+    assert args.quiet == 1
+    assert sorted(c[0][3] for c in wait_for_grader.call_args_list) == \
+        ['grader-img1', 'grader-img2', 'grader-img3']
+    assert sorted(c[0][3] for c in publish_one.call_args_list) == \
+        ['item1', 'item2']
+
+
+@patch('courseraprogramming.commands.deploy.publish.publish_one')
+@patch('courseraprogramming.commands.deploy.wait_for_grader')
+@patch('courseraprogramming.commands.deploy.register_image')
+@patch('courseraprogramming.commands.deploy.oauth2')
+@patch('courseraprogramming.commands.deploy.utils')
+def test_command_deploy_slow_grader(utils, oauth2, register_image,
+                                    wait_for_grader, publish_one):
+    args = make_args(
+        ('img1', 'item1', 'part1'),
+        ('img2', 'item2', 'part1'))
+    args.parallelism = 1
+    args.quiet = 1
+    img2_registered = threading.Event()
+
+    def fake_register(args, d, session, image, parts, registry_db=None):
+        if image == 'img2':
+            img2_registered.set()
+        return 'grader-' + image, 'loc'
+
+    def fake_wait(args, session, image, grader_id, location, registry_db=None):
+        # img1's grader only becomes ready once img2 was uploaded.
+        if image == 'img1':
+            assert img2_registered.wait(5)
+        return grader_id
+    register_image.side_effect = fake_register
+    wait_for_grader.side_effect = fake_wait
+    publish_one.return_value = (publish.PUBLISHED, None)
+
+    assert deploy.command_deploy(args) == 0
+    assert publish_one.call_count == 2
+
+
+@patch('courseraprogramming.commands.deploy.publish.publish_one')
+@patch('courseraprogramming.commands.deploy.wait_for_grader')
+@patch('courseraprogramming.commands.deploy.register_image')
+@patch('courseraprogramming.commands.deploy.oauth2')
+@patch('courseraprogramming.commands.deploy.utils')
+def test_command_deploy_skips_items_with_failed_images(
+        utils, oauth2, register_image, wait_for_grader, publish_one):
+    args = make_args(
+        ('img1', 'item1', 'part1'),
+        ('img2', 'item1', 'part2'),
+        ('img3', 'item2', 'part1'))
+    args.quiet = 1
+    register_image.side_effect = fake_register_image
+    wait_for_grader.side_effect = \
+        lambda args, session, image, grader_id, location, registry_db=None: \
+        grader_id
+    publish_one.return_value = (publish.PUBLISHED, None)
+
+    with LogCapture() as logs:
+        assert deploy.command_deploy(args) == 1
+
+    publish_one.assert_called_once()
+    assert publish_one.call_args[0][3] == 'item2'
+    logs.check_present(
+        ('root', 'ERROR', 'img2: upload timed out'),
+        ('root', 'ERROR',
+         'Not publishing item item1: its grader was not deployed.'))
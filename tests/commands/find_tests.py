@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from courseraprogramming import main
+from courseraprogramming.commands import find
+from tests import fake_images
+
+
+def make_index():
+    return layers.ImageIndex.from_saved_image(
+        'sha256:abc',
+        fake_images.make_saved_image([[
+            ('grader', None),
+            ('grader/grader.py', b''),
+            ('grader/lib', None),
+            ('grader/lib/util.py', b''),
+            ('grader/lib/data.txt', b''),
+            ('usr/bin/python', ('symlink', 'python3')),
+        ]]))
+
+
+def test_find_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('find myimage /grader --name *.py'.split())
+    assert args.func == find.command_find
+    assert args.path == '/grader'
+    assert args.name == '*.py'
+    assert args.type is None
+
+
+def test_find_by_name():
+    assert find.find_paths(make_index(), '/', name='*.py') == [
+        '/grader/grader.py', '/grader/lib/util.py']
+
+
+def test_find_by_type_and_path():
+    index = make_index()
+    assert find.find_paths(index, '/grader', file_type='d') == [
+        '/grader', '/grader/lib']
+    assert find.find_paths(index, '/', file_type='l') == ['/usr/bin/python']
+    assert find.find_paths(index, '/', path_pattern='/grader/lib/*') == [
+        '/grader/lib/data.txt', '/grader/lib/util.py']
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from courseraprogramming import main
+from courseraprogramming.commands import grep
+from mock import MagicMock
+from tests import fake_images
+import io
+
+IMAGE_LAYERS = [
+    [
+        ('grader', None),
+        ('grader/grader.py', b'import os\nprint("old")\n'),
+        ('grader/tool.bin', b'\x7fELF\x00\x00print'),
+        ('etc', None),
+        ('etc/motd', b'Print me\n'),
+    ],
+    [
+        ('grader/grader.py', b'import sys\nprint("new")\n'),
+        ('grader/notes.txt', b'nothing here\n'),
+    ],
+]
+
+
+def run_grep(argv, image_layers=IMAGE_LAYERS):
+    args = main.build_parser().parse_args(['grep', 'img'] + argv)
+    index = layers.ImageIndex.from_saved_image(
+        'sha256:abc', fake_images.make_saved_image(image_layers))
+    d = MagicMock()
+    d.get_image.side_effect = \
+        lambda image: fake_images.make_saved_image(image_layers)
+    out = io.StringIO()
+    matched = grep.grep_image(d, index, args, out)
+    return matched, out.getvalue()
+
+
+def test_grep_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('grep -il myimage TODO /grader'.split())
+    assert args.func == grep.command_grep
+    assert args.pattern == 'TODO'
+    assert args.path == '/grader'
+    assert args.ignore_case
+    assert args.files_with_matches
+    assert not args.binary
+
+
+def test_grep_only_searches_merged_files():
+    matched, output = run_grep(['print', '/grader'])
+    assert matched == 1
+    assert output == '/grader/grader.py:2:print("new")\n', output
+
+
+def test_grep_ignore_case_and_files_with_matches():
+    matched, output = run_grep(['-i', '-l', 'PRINT'])
+    assert output == '/etc/motd\n/grader/grader.py\n', output
+
+
+def test_grep_binary_files():
+    matched, output = run_grep(['-a', 'print', '/grader'])
+    assert matched == 2
+    assert 'Binary file /grader/tool.bin matches\n' in output
+
+
+def test_grep_fixed_strings_and_include():
+    matched, output = run_grep(['-F', '("new")', '--include', '*.txt'])
+    assert matched == 0
+    matched, output = run_grep(['-F', '("new")', '--include', '*.py'])
+    assert matched == 1
+
+
+def test_grep_hardlinks_and_symlinked_paths():
+    matched, output = run_grep(['-l', 'bash', '/bin'], [
+        [
+            ('bin', ('symlink', 'usr/bin')),
+            ('usr', None),
+            ('usr/bin', None),
+            ('usr/bin/bash', b'#!bash\n'),
+            ('usr/bin/rbash', ('hardlink', 'usr/bin/bash')),
+        ],
+        [('usr/bin/.wh.bash', b'')],
+    ])
+    assert matched == 1
+    assert output == '/bin/rbash\n', output
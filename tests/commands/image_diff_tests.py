@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from courseraprogramming import main
+from courseraprogramming.commands import image_diff
+from tests import fake_images
+
+BASE_LAYER = [
+    ('usr', None),
+    ('usr/lib', None),
+    ('usr/lib/libc.so', b'c' * 100),
+]
+
+
+def make_index(image_id, grader_layer):
+    return layers.ImageIndex.from_saved_image(
+        image_id,
+        fake_images.make_saved_image([BASE_LAYER, grader_layer]))
+
+
+def test_image_diff_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('image-diff old:1 new:2 --path /grader'.split())
+    assert args.func == image_diff.command_image_diff
+    assert args.old == 'old:1'
+    assert args.new == 'new:2'
+    assert args.path == '/grader'
+
+
+def test_shared_layers():
+    old = make_index('sha256:old', [('grader', None)])
+    new = make_index('sha256:new', [('grader', None), ('grader/a', b'')])
+    assert image_diff.shared_layer_count(old, new) == 1
+    assert image_diff.shared_layer_count(old, old) == 2
+
+
+def test_diff_indexes():
+    old = make_index('sha256:old', [
+        ('grader', None),
+        ('grader/grader.py', b'v1'),
+        ('grader/same.txt', b'same'),
+        ('grader/removed.txt', b'gone'),
+    ])
+    new = make_index('sha256:new', [
+        ('grader', None),
+        ('grader/grader.py', b'v2 is longer'),
+        ('grader/same.txt', b'same'),
+        ('grader/added', None),
+        ('grader/added/data.bin', b'12345'),
+    ])
+    assert image_diff.diff_indexes(old, new) == [
+        ('A', '/grader/added/data.bin', 0, 5),
+        ('M', '/grader/grader.py', 2, 12),
+        ('D', '/grader/removed.txt', 4, 0),
+    ]
+    assert image_diff.diff_indexes(old, new, '/usr') == []
+
+
+def test_identical_images():
+    layer = [('grader', None), ('grader/grader.py', b'v1')]
+    old = make_index('sha256:old', layer)
+    new = make_index('sha256:new', layer)
+    assert image_diff.diff_indexes(old, new) == []
+
+
+def test_format_delta():
+    assert image_diff.format_delta(-2048) == '-2.0K'
+    assert image_diff.format_delta(12) == '+12'
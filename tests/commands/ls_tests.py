@@ -15,11 +15,11 @@
 # limitations under the License.
 
 import argparse
-import docker
+from courseraprogramming import layers
 from courseraprogramming import main
 from courseraprogramming.commands import ls
-from mock import MagicMock
 from mock import patch
+from tests import fake_images
 
 
 def test_ls_parsing_simple():
@@ -41,39 +41,82 @@ def test_ls_parsing_flags():
     assert args.human
 
 
-@patch('courseraprogramming.commands.ls.utils')
-def test_ls_run(utils):
+def test_ls_parsing_recursive():
+    parser = main.build_parser()
+    args = parser.parse_args('ls -R --rebuild-index img /grader'.split())
+    assert args.recursive
+    assert args.rebuild_index
+
 
-    docker_mock = MagicMock(spec=docker.Client)
-    docker_mock.create_container.return_value = {
-        'Id': 'really-long-container-id-hash',
-        'Warnings': None
-    }
-    docker_mock.wait.return_value = 0
-    docker_mock.logs.return_value = "grader.sh\ntestcases.txt\n"
-    utils.docker_client.return_value = docker_mock
+def make_index():
+    return layers.ImageIndex.from_saved_image(
+        'sha256:abc',
+        fake_images.make_saved_image([[
+            ('grader', None),
+            ('grader/grader.sh', b'#!/bin/sh\n'),
+            ('grader/.hidden', b''),
+            ('grader/tests', None),
+            ('grader/tests/testcases.txt', b'1' * 2048),
+            ('tests', ('symlink', 'grader/tests')),
+        ]]))
 
-    # Set up args
+
+def run_ls(dir, **flags):
     args = argparse.Namespace()
     args.imageId = 'testImageId'
-    args.dir = '/grader'
+    args.dir = dir
     args.l = False
     args.human = False
     args.a = False
-    args.no_rm = False
-
-    with patch('courseraprogramming.commands.ls.sys.stdout') as stdout:
-        # Run the command
-        ls.command_ls(args)
-
-    # Verify correct command output
-    stdout.write.assert_called_with(docker_mock.logs.return_value)
-
-    docker_mock.create_container.assert_called_with(
-        image='testImageId',
-        entrypoint='/bin/ls',
-        command=['/grader'])
-    docker_mock.start.assert_called_with(
-        docker_mock.create_container.return_value)
-    docker_mock.logs.assert_called_with(
-        docker_mock.create_container.return_value)
+    args.recursive = False
+    args.rebuild_index = False
+    for name, value in flags.items():
+        setattr(args, name, value)
+
+    with patch('courseraprogramming.commands.ls.utils.docker_client'), \
+            patch('courseraprogramming.commands.ls.layers.image_index') as \
+            image_index, \
+            patch('courseraprogramming.commands.ls.sys.stdout') as stdout:
+        image_index.return_value = make_index()
+        exit_code = ls.command_ls(args)
+    output = ''.join(c[0][0] for c in stdout.write.call_args_list)
+    return exit_code, output
+
+
+def test_ls_run():
+    exit_code, output = run_ls('/grader')
+    assert exit_code == 0
+    assert output == 'grader.sh\ntests\n', output
+
+
+def test_ls_run_all_long_human():
+    exit_code, output = run_ls('/grader/tests', a=True, l=True, human=True)
+    assert exit_code == 0
+    assert output == \
+        '-rw-r--r--     0     0     2.0K 2017-07-14 02:40 testcases.txt\n', \
+        output
+
+
+def test_ls_run_recursive():
+    exit_code, output = run_ls('/grader', recursive=True, a=True)
+    assert output == ('/grader:\n.hidden\ngrader.sh\ntests\n\n'
+                      '/grader/tests:\ntestcases.txt\n'), output
+
+
+def test_ls_run_glob():
+    exit_code, output = run_ls('/grader/*.sh')
+    assert output == '/grader/grader.sh\n', output
+
+
+def test_ls_run_missing():
+    exit_code, output = run_ls('/nope')
+    assert exit_code == 1
+    assert output == ''
+
+
+def test_ls_run_symlinked_directory():
+    exit_code, output = run_ls('/tests')
+    assert exit_code == 0
+    assert output == 'testcases.txt\n', output
+    exit_code, output = run_ls('/tests/testcases.txt', l=True)
+    assert output.endswith(' /tests/testcases.txt\n'), output
@@ -17,8 +17,14 @@
 from courseraprogramming.commands import oauth2
 
 import argparse
+import json
+import os
 import pickle
 import configparser
+import requests
+import shutil
+import tempfile
+import threading
 from mock import mock_open, MagicMock, patch
 import time
 
@@ -107,6 +113,23 @@ def check_cache_types_impl(
         }
 
 
+def test_configuration_is_kept():
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        cfg = oauth2.configuration()
+        assert oauth2.configuration() is cfg
+        with open('courseraprogramming.cfg', 'w') as f:
+            f.write('[oauth2]\nport = 1234\n')
+        changed = oauth2.configuration()
+        assert changed is not cfg
+        assert changed.getint('oauth2', 'port') == 1234
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
 def test_load_configuration():
     cfg = oauth2.configuration()
     assert cfg.get('oauth2', 'hostname') == 'localhost', 'hostname incorrect'
@@ -195,3 +218,178 @@ def loading_cache_checker(read_data, expected):
         oauth2_instanced = oauth2.CourseraOAuth2('id', 'secret', 'scopes')
         token_cache = oauth2_instanced.token_cache
         assert token_cache == expected, 'Token cache was: %s' % token_cache
+
+
+def make_cache_dir():
+    return tempfile.mkdtemp()
+
+
+def test_token_cache_round_trip():
+    cache_dir = make_cache_dir()
+    try:
+        cache_file = os.path.join(cache_dir, 'oauth2_cache.json')
+        tokens = {'token': 'abc', 'expires': 1438815118.5, 'refresh': 'def'}
+        oauth2.CourseraOAuth2(
+            'id', 'secret', 'scopes',
+            token_cache_file=cache_file).token_cache = tokens
+        with open(cache_file) as f:
+            assert json.load(f) == tokens
+        assert os.listdir(cache_dir) == ['oauth2_cache.json']
+        assert oauth2.CourseraOAuth2(
+            'id', 'secret', 'scopes',
+            token_cache_file=cache_file).token_cache == tokens
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_legacy_token_cache_migration():
+    cache_dir = make_cache_dir()
+    try:
+        cache_file = os.path.join(cache_dir, 'oauth2_cache.json')
+        legacy_file = os.path.join(cache_dir, 'oauth2_cache.pickle')
+        tokens = {'token': 'abc', 'expires': 1438815118.5}
+        with open(legacy_file, 'wb') as f:
+            pickle.dump(tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with patch.object(oauth2, 'LEGACY_TOKEN_CACHE', legacy_file):
+            oauth2_client = oauth2.CourseraOAuth2(
+                'id', 'secret', 'scopes', token_cache_file=cache_file)
+            assert oauth2_client.token_cache == tokens
+        assert not os.path.exists(legacy_file)
+        with open(cache_file) as f:
+            assert json.load(f) == tokens
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+class Tampered(object):
+    pass
+
+
+def test_token_cache_refuses_pickled_objects():
+    try:
+        oauth2._decode_token_cache(pickle.dumps({'token': Tampered()}))
+    except pickle.UnpicklingError:
+        pass
+    else:
+        assert False, 'pickled objects should not be loaded'
+
+
+def test_build_authorizer_uses_tokens_refreshed_elsewhere():
+    cache_dir = make_cache_dir()
+    try:
+        cache_file = os.path.join(cache_dir, 'oauth2_cache.json')
+        oauth2_client = oauth2.CourseraOAuth2(
+            'id', 'secret', 'scopes', token_cache_file=cache_file)
+        oauth2_client.token_cache = {
+            'token': 'stale', 'expires': time.time() - 10, 'refresh': 'r'}
+        # Another process refreshes the tokens.
+        oauth2.CourseraOAuth2(
+            'id', 'secret', 'scopes', token_cache_file=cache_file
+        ).token_cache = {
+            'token': 'fresh', 'expires': time.time() + 3600, 'refresh': 'r'}
+        with patch.object(oauth2_client,
+                          '_request_tokens_from_token_endpoint') as endpoint:
+            authorizer = oauth2_client.build_authorizer()
+            assert not endpoint.called
+        assert authorizer.token == 'fresh'
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_build_authorizer_refreshes_expired_tokens():
+    cache_dir = make_cache_dir()
+    try:
+        cache_file = os.path.join(cache_dir, 'oauth2_cache.json')
+        oauth2_client = oauth2.CourseraOAuth2(
+            'id', 'secret', 'scopes', token_cache_file=cache_file)
+        oauth2_client.token_cache = {
+            'token': 'stale', 'expires': time.time() - 10, 'refresh': 'r'}
+        with patch.object(oauth2_client,
+                          '_request_tokens_from_token_endpoint') as endpoint:
+            endpoint.return_value = {
+                'token': 'new', 'expires': time.time() + 3600}
+            authorizer = oauth2_client.build_authorizer()
+            assert endpoint.call_count == 1
+        assert authorizer.token == 'new'
+        with open(cache_file) as f:
+            assert json.load(f)['refresh'] == 'r'
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def make_refreshing_oauth2(expires_in=3600):
+    oauth2_instance = MagicMock()
+    oauth2_instance.token_cache = {
+        'token': 'old', 'expires': time.time() + expires_in}
+    oauth2_instance.refresh_tokens.return_value = {
+        'token': 'new', 'expires': time.time() + 3600}
+    return oauth2_instance
+
+
+def test_refreshing_authorizer_coalesces_refreshes():
+    oauth2_instance = make_refreshing_oauth2()
+    oauth2_instance.refresh_tokens.side_effect = \
+        lambda stale: time.sleep(0.05) or {
+            'token': 'new', 'expires': time.time() + 3600}
+    authorizer = oauth2.RefreshingOAuth2Auth(oauth2_instance)
+    try:
+        threads = [threading.Thread(target=authorizer.refresh,
+                                    kwargs={'stale_token': 'old'})
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert oauth2_instance.refresh_tokens.call_count == 1
+        assert authorizer.token == 'new'
+    finally:
+        authorizer.close()
+
+
+def test_refreshing_authorizer_refreshes_expired_token():
+    oauth2_instance = make_refreshing_oauth2(expires_in=-10)
+    authorizer = oauth2.RefreshingOAuth2Auth(oauth2_instance,
+                                             refresh_margin=0)
+    authorizer.close()
+    request = requests.Request('GET', 'https://example.com/').prepare()
+    authorizer(request)
+    assert request.headers['Authorization'] == 'Bearer new'
+
+
+def test_refreshing_authorizer_refreshes_in_background():
+    oauth2_instance = make_refreshing_oauth2(expires_in=60)
+    refreshed = threading.Event()
+    oauth2_instance.refresh_tokens.side_effect = \
+        lambda stale: refreshed.set() or {
+            'token': 'new', 'expires': time.time() + 3600}
+    authorizer = oauth2.RefreshingOAuth2Auth(oauth2_instance,
+                                             refresh_margin=120)
+    try:
+        assert refreshed.wait(5)
+    finally:
+        authorizer.close()
+    assert oauth2_instance.refresh_tokens.call_args[0] == ('old',)
+
+
+def test_refreshing_authorizer_retries_unauthorized_once():
+    oauth2_instance = make_refreshing_oauth2()
+    authorizer = oauth2.RefreshingOAuth2Auth(oauth2_instance)
+    authorizer.close()
+    request = authorizer(
+        requests.Request('GET', 'https://example.com/').prepare())
+    unauthorized = MagicMock(status_code=401, request=request)
+    retried = MagicMock(status_code=200, history=[])
+    unauthorized.connection.send.return_value = retried
+
+    result = authorizer._retry_unauthorized(unauthorized, timeout=10)
+    assert result is retried
+    assert retried.history == [unauthorized]
+    retry = unauthorized.connection.send.call_args[0][0]
+    assert retry.headers['Authorization'] == 'Bearer new'
+    assert unauthorized.connection.send.call_args[1] == {'timeout': 10}
+
+    # A retried request that is still unauthorized is returned as is.
+    retried.status_code = 401
+    retried.request = retry
+    assert authorizer._retry_unauthorized(retried) is retried
+    assert oauth2_instance.refresh_tokens.call_count == 1
@@ -21,6 +21,32 @@ from mock import ANY
 from mock import call
 from mock import MagicMock
 from mock import patch
+import io
+import os
+import shutil
+import tempfile
+
+
+# Several tests replace these module functions with fakes.
+get_write_access_token = publish.get_write_access_token
+get_authoring_pa_id = publish.get_authoring_pa_id
+publish_get_authoring_pa_ids = publish.get_authoring_pa_ids
+
+# Never talk to the OAuth2 token endpoint from tests.
+oauth2_patcher = patch('courseraprogramming.commands.publish.oauth2')
+# Nor write to the grader registry.
+registry_patcher = patch(
+    'courseraprogramming.registry.open_registry', return_value=None)
+
+
+def setup_module():
+    oauth2_patcher.start()
+    registry_patcher.start()
+
+
+def teardown_module():
+    registry_patcher.stop()
+    oauth2_patcher.stop()
 
 
 class PublishParams:
@@ -33,6 +59,7 @@ class PublishParams:
     authoring_pa_id = "{}~{}".format(course, item)
     quiet = 1
     additional_items = None
+    parallelism = 4
     config = None
     docker_url = None
     verbose = None
@@ -46,6 +73,11 @@ def fake_get_authoring_pa_id(oauth, course_id, item_id):
     return "{}~{}".format(course_id, item_id)
 
 
+def fake_get_authoring_pa_ids(session, course_id, item_ids):
+    return dict((item_id, "{}~{}".format(course_id, item_id))
+                for item_id in item_ids)
+
+
 # def fake_get_authoring_pa_id_item(oauth, course_id, item_id):
 #     return authoring_pa_id_item
 
@@ -72,6 +104,7 @@ def test_called_with_write_access_token():
 
 def test_multiple_items():
     publish.get_authoring_pa_id = fake_get_authoring_pa_id
+    publish.get_authoring_pa_ids = fake_get_authoring_pa_ids
     publish.get_write_access_token = fake_get_write_access_token
     publish.publish_item = MagicMock()
 
@@ -101,7 +134,7 @@ def test_multiple_items():
             "course2345~item5678",
             "token4567"
         )
-    ])
+    ], any_order=True)
 
 
 @patch('courseraprogramming.commands.publish.sys')
@@ -326,3 +359,274 @@ def test_upload_parsing_with_additional_items():
                              '--additional-items ITEM_2 ITEM_3 ITEM_4'.split())
     print(args.additional_items)
     assert args.additional_items == ['ITEM_2', 'ITEM_3', 'ITEM_4']
+
+
+@patch('courseraprogramming.commands.publish.sys')
+def test_fatal_error_takes_precedence(sys):
+    def fake_publish_item(session, endpoint, action, authoring_pa_id, token):
+        if authoring_pa_id.endswith('item3456'):
+            raise publish.GraderExecutorError(
+                status=publish.GraderExecutorStatus.PENDING)
+        if authoring_pa_id.endswith('item4567'):
+            raise publish.ValidationError()
+
+    publish.get_authoring_pa_id = fake_get_authoring_pa_id
+    publish.get_authoring_pa_ids = fake_get_authoring_pa_ids
+    publish.get_write_access_token = fake_get_write_access_token
+    publish.publish_item = fake_publish_item
+
+    PublishParams.additional_items = ['item4567', 'item5678']
+    publish.command_publish(PublishParams)
+    PublishParams.additional_items = None
+
+    sys.exit.assert_called_with(publish.ErrorCodes.FATAL_ERROR)
+
+
+def test_combine_errors():
+    assert publish.combine_errors([None, None]) is None
+    assert publish.combine_errors(
+        [None, publish.ErrorCodes.RETRYABLE_ERROR]) == \
+        publish.ErrorCodes.RETRYABLE_ERROR
+    assert publish.combine_errors([
+        publish.ErrorCodes.FATAL_ERROR,
+        publish.ErrorCodes.RETRYABLE_ERROR]) == publish.ErrorCodes.FATAL_ERROR
+
+
+def test_print_status_table():
+    out = io.StringIO()
+    publish.print_status_table([
+        ('item3456', 'published', 1.234),
+        ('item4567890', 'grader pending', 0.5),
+    ], out)
+    assert out.getvalue() == (
+        'ITEM         STATUS             SECONDS\n'
+        'item3456     published             1.23\n'
+        'item4567890  grader pending        0.50\n')
+
+
+def test_get_write_access_token_uses_session():
+    session = MagicMock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.json.return_value = {'elements': [{
+        'readyForPublish': True, 'writeAccessToken': 'token'}]}
+    token = get_write_access_token(
+        session, 'https://example.com/api', 'course~item')
+    assert token == 'token'
+    session.get.assert_called_with(
+        'https://example.com/api/course~item?fields=writeAccessToken')
+
+
+def test_publish_parsing_parallelism():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'publish COURSE_ID ITEM_ID --parallelism 8'.split())
+    assert args.parallelism == 8
+
+
+def make_response(status_code, body=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = body
+    return resp
+
+
+def executor_response(status):
+    return make_response(200, {'elements': [{'id': 'exec', 'status': status}]})
+
+
+@patch('courseraprogramming.commands.publish.time')
+def test_wait_for_executor(time):
+    time.time.return_value = 0
+    session = MagicMock()
+    session.get.side_effect = [
+        executor_response('PENDING'),
+        make_response(500),
+        executor_response('PENDING'),
+        executor_response('COMPLETED'),
+    ]
+    status = publish.wait_for_executor(session, 'https://ex', 'exec', 1000)
+    assert status == publish.GraderExecutorStatus.COMPLETED
+    session.get.assert_called_with('https://ex/exec')
+    assert [c[0][0] for c in time.sleep.call_args_list] == [5, 10, 20]
+
+
+@patch('courseraprogramming.commands.publish.time')
+def test_wait_for_executor_deadline(time):
+    time.time.side_effect = [0, 40, 100]
+    session = MagicMock()
+    session.get.return_value = executor_response('PENDING')
+    status = publish.wait_for_executor(session, 'https://ex', 'exec', 50)
+    assert status == publish.GraderExecutorStatus.PENDING
+    assert [c[0][0] for c in time.sleep.call_args_list] == [5, 10]
+
+
+@patch('courseraprogramming.commands.publish.time')
+def test_wait_for_executor_missing(time):
+    session = MagicMock()
+    session.get.return_value = make_response(404)
+    assert publish.wait_for_executor(session, 'https://ex', 'exec', 50) == \
+        publish.GraderExecutorStatus.MISSING
+
+
+@patch('courseraprogramming.commands.publish.time')
+def test_wait_for_location(time):
+    time.time.return_value = 0
+    session = MagicMock()
+    session.get.side_effect = [
+        executor_response('PENDING'),
+        executor_response('FAILED'),
+    ]
+    status = publish.wait_for_location(session, 'https://ex/loc', 1000)
+    assert status == publish.GraderExecutorStatus.FAILED
+    session.get.assert_called_with('https://ex/loc')
+
+
+class WaitParams(PublishParams):
+    wait = True
+    wait_timeout = 600
+    executor_endpoint = 'https://ex'
+
+
+@patch('courseraprogramming.commands.publish.wait_for_executor')
+def test_publish_when_ready(wait_for_executor):
+    publish.publish_item = MagicMock(side_effect=[
+        publish.GraderExecutorError(
+            publish.GraderExecutorStatus.PENDING, 'exec'),
+        None,
+    ])
+    wait_for_executor.return_value = publish.GraderExecutorStatus.COMPLETED
+    publish.publish_when_ready('session', WaitParams, 'course~item', 'token')
+    assert publish.publish_item.call_count == 2
+    wait_for_executor.assert_called_with('session', 'https://ex', 'exec', ANY)
+
+
+@patch('courseraprogramming.commands.publish.wait_for_executor')
+def test_publish_when_ready_failed_grader(wait_for_executor):
+    publish.publish_item = MagicMock(side_effect=publish.GraderExecutorError(
+        publish.GraderExecutorStatus.PENDING, 'exec'))
+    wait_for_executor.return_value = publish.GraderExecutorStatus.FAILED
+    try:
+        publish.publish_when_ready(
+            'session', WaitParams, 'course~item', 'token')
+    except publish.GraderExecutorError as e:
+        assert e.status == publish.GraderExecutorStatus.FAILED
+    else:
+        assert False, 'should raise for a failed grader'
+    assert publish.publish_item.call_count == 1
+
+
+@patch('courseraprogramming.commands.publish.sys')
+@patch('courseraprogramming.commands.publish.wait_for_executor')
+def test_publish_wait_still_pending(wait_for_executor, sys):
+    publish.get_authoring_pa_id = fake_get_authoring_pa_id
+    publish.get_write_access_token = fake_get_write_access_token
+    publish.publish_item = MagicMock(side_effect=publish.GraderExecutorError(
+        publish.GraderExecutorStatus.PENDING, 'exec'))
+    wait_for_executor.return_value = publish.GraderExecutorStatus.PENDING
+
+    publish.command_publish(WaitParams)
+
+    sys.exit.assert_called_with(publish.ErrorCodes.RETRYABLE_ERROR)
+
+
+def test_get_executor_id():
+    assert publish.get_executor_id(
+        {'details': [{'id': 'exec', 'status': 'PENDING'}]}) == 'exec'
+    assert publish.get_executor_id({'details': [{'id': ''}]}) is None
+    assert publish.get_executor_id({'details': {}}) is None
+
+
+def test_get_authoring_pa_id():
+    session = MagicMock()
+    session.get.return_value = make_response(
+        200, {'elements': [{'atomId': 'atom'}]})
+    assert get_authoring_pa_id(session, 'course', 'item') == 'atom'
+    session.get.assert_called_with(
+        'https://api.coursera.org/api/authoringItemContentRelations.v1/'
+        'course~item?fields=atomId')
+
+    session.get.return_value = make_response(404)
+    assert get_authoring_pa_id(session, 'course', 'item') == 'course~item'
+
+
+def test_get_authoring_pa_ids():
+    session = MagicMock()
+    session.get.return_value = make_response(
+        200, {'elements': [{'id': 'course~item1', 'atomId': 'atom1'}]})
+    assert publish_get_authoring_pa_ids(
+        session, 'course', ['item1', 'item2']) == {
+            'item1': 'atom1', 'item2': 'course~item2'}
+    session.get.assert_called_with(
+        'https://api.coursera.org/api/authoringItemContentRelations.v1',
+        params={'ids': 'course~item1,course~item2', 'fields': 'atomId'})
+
+    session.get.return_value = make_response(400)
+    assert publish_get_authoring_pa_ids(
+        session, 'course', ['item1', 'item2']) == {}
+
+
+def test_pa_id_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(directory, 'pa_id_cache.json')
+        cache = publish.AuthoringPaIdCache(file_name, ttl=60)
+        cache.put('course', 'item1', 'atom1')
+        cache.put('course', 'item2', 'atom2')
+        cache.invalidate('course', 'item2')
+        cache.save()
+
+        cache = publish.AuthoringPaIdCache(file_name, ttl=60)
+        assert cache.get('course', 'item1') == 'atom1'
+        assert cache.get('course', 'item2') is None
+        assert publish.AuthoringPaIdCache(file_name, ttl=0).get(
+            'course', 'item1') is None
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_prefetch_authoring_pa_ids():
+    cache = publish.AuthoringPaIdCache()
+    cache.put('course', 'item1', 'atom1')
+    with patch.object(publish, 'get_authoring_pa_ids') as bulk:
+        bulk.return_value = {'item2': 'atom2', 'item3': 'atom3'}
+        publish.prefetch_authoring_pa_ids(
+            'session', cache, 'course', ['item1', 'item2', 'item3'])
+        bulk.assert_called_with('session', 'course', ['item2', 'item3'])
+        assert cache.get('course', 'item3') == 'atom3'
+
+        # A single uncached item is resolved on its own.
+        publish.prefetch_authoring_pa_ids(
+            'session', cache, 'course', ['item1', 'item4'])
+        assert bulk.call_count == 1
+
+
+def test_stale_cached_pa_id_is_resolved_again():
+    cache = publish.AuthoringPaIdCache()
+    cache.put('course2345', 'item3456', 'stale')
+
+    def fake_get_token(session, get_endpoint, authoring_pa_id):
+        if authoring_pa_id == 'stale':
+            raise publish.ItemNotFoundError(authoring_pa_id)
+        return 'token4567'
+    publish.get_authoring_pa_id = lambda session, course, item: 'fresh'
+    publish.get_write_access_token = fake_get_token
+    publish.publish_item = MagicMock()
+
+    outcome, error = publish.publish_one(
+        'session', PublishParams, 'course2345', 'item3456', cache)
+    assert (outcome, error) == (publish.PUBLISHED, None)
+    assert cache.get('course2345', 'item3456') == 'fresh'
+    publish.publish_item.assert_called_with(
+        'session', 'fake-endpoint', 'fake-action', 'fresh', 'token4567')
+
+
+def test_unknown_resolved_pa_id_is_not_cached():
+    cache = publish.AuthoringPaIdCache()
+    with patch.object(publish, 'get_authoring_pa_id',
+                      return_value='missing'), \
+            patch.object(publish, 'publish_authoring_pa',
+                         side_effect=publish.ItemNotFoundError('missing')):
+        outcome, error = publish.publish_one(
+            'session', PublishParams, 'course2345', 'item3456', cache)
+    assert (outcome, error) == ('not found', publish.ErrorCodes.FATAL_ERROR)
+    assert cache.get('course2345', 'item3456') is None
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from courseraprogramming import main
+from courseraprogramming.commands import pull
+from mock import MagicMock
+from tests import fake_images
+import io
+import os
+import os.path
+import shutil
+import tarfile
+import tempfile
+
+FILES = {
+    '/grader/grader.py': b'print("hi")\n',
+    '/grader/data/input.txt': b'1 2 3\n',
+}
+
+
+def make_index(files, links=None):
+    entries = [('grader', None), ('grader/data', None),
+               ('grader/run', ('symlink', 'grader.py'))]
+    entries += [(path.lstrip('/'), data) for path, data in files.items()]
+    entries += [(path.lstrip('/'), ('hardlink', target.lstrip('/')))
+                for path, target in (links or {}).items()]
+    return layers.ImageIndex.from_saved_image(
+        'sha256:abc', fake_images.make_saved_image([entries]))
+
+
+def make_docker_mock(files, links=None):
+    """
+    Serves archives of single files, or of the whole /grader tree. links maps
+    hard links to the files they link to.
+    """
+    d = MagicMock()
+    links = links or {}
+
+    def get_archive(container, path):
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode='w') as archive:
+            for file_path, data in sorted(files.items()):
+                if path == '/grader':
+                    name = file_path[1:]
+                elif path == file_path:
+                    name = os.path.basename(file_path)
+                else:
+                    continue
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+            if path == '/grader':
+                # Docker archives later links to the same file as hard links.
+                for link_path, target in sorted(links.items()):
+                    info = tarfile.TarInfo(link_path[1:])
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = target[1:]
+                    archive.addfile(info)
+        stream.seek(0)
+        return (stream, None)
+    d.get_archive.side_effect = get_archive
+    return d
+
+
+def test_pull_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('pull myimage /grader /tmp/out'.split())
+    assert args.func == pull.command_pull
+    assert args.path == '/grader'
+    assert args.dest == '/tmp/out'
+    assert args.parallelism == 4
+
+
+def test_pull_then_incremental_sync():
+    dest = tempfile.mkdtemp()
+    try:
+        d = make_docker_mock(FILES)
+        index = make_index(FILES)
+        result = pull.pull(d, index, 'img', '/grader', dest, 2)
+        assert result == (2, 0, 18), result
+        assert d.get_archive.call_count == 1  # A single archive of the tree.
+        with open(os.path.join(dest, 'grader', 'grader.py'), 'rb') as f:
+            assert f.read() == b'print("hi")\n'
+        assert os.readlink(os.path.join(dest, 'grader', 'run')) == \
+            'grader.py'
+        assert int(os.stat(os.path.join(dest, 'grader', 'grader.py'))
+                   .st_mtime) == 1500000000
+
+        # Nothing changed: nothing is transferred.
+        assert pull.pull(d, index, 'img', '/grader', dest, 2) == (0, 2, 0)
+
+        # Only the changed file is fetched.
+        changed = dict(FILES)
+        changed['/grader/grader.py'] = b'print("bye")\n'
+        d = make_docker_mock(changed)
+        result = pull.pull(d, make_index(changed), 'img', '/grader', dest, 2)
+        assert result == (1, 1, 13), result
+        d.get_archive.assert_called_once_with(
+            d.create_container.return_value, '/grader/grader.py')
+        with open(os.path.join(dest, 'grader', 'grader.py'), 'rb') as f:
+            assert f.read() == b'print("bye")\n'
+    finally:
+        shutil.rmtree(dest)
+
+
+def test_pull_hard_links():
+    dest = tempfile.mkdtemp()
+    try:
+        links = {'/grader/data/copy.txt': '/grader/data/input.txt'}
+        d = make_docker_mock(FILES, links)
+        result = pull.pull(d, make_index(FILES, links), 'img', '/grader',
+                           dest, 2)
+        assert result == (3, 0, 18), result
+        with open(os.path.join(dest, 'grader', 'data', 'copy.txt'),
+                  'rb') as f:
+            assert f.read() == b'1 2 3\n'
+    finally:
+        shutil.rmtree(dest)
+
+
+def test_pull_replaces_directory_with_symlink():
+    dest = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(dest, 'grader', 'run', 'old'))
+        d = make_docker_mock(FILES)
+        pull.pull(d, make_index(FILES), 'img', '/grader', dest, 2)
+        assert os.readlink(os.path.join(dest, 'grader', 'run')) == \
+            'grader.py'
+    finally:
+        shutil.rmtree(dest)
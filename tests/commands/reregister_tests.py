@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+from courseraprogramming.commands import reregister
+
+from mock import MagicMock
+from mock import patch
+from testfixtures import LogCapture
+import json
+import os
+import shutil
+import tempfile
+
+# Never write to the grader registry from tests.
+registry_patcher = patch(
+    'courseraprogramming.registry.open_registry', return_value=None)
+
+
+def setup_module():
+    registry_patcher.start()
+
+
+def teardown_module():
+    registry_patcher.stop()
+
+
+def make_response(status_code, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    response.text = json.dumps(body)
+    return response
+
+
+def test_reregister_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'reregister GRADER_ID COURSE_ID ITEM_ID PART_ID'.split())
+    assert args.currentGraderId == 'GRADER_ID'
+    assert args.course == 'COURSE_ID'
+    assert args.item == 'ITEM_ID'
+    assert args.part == 'PART_ID'
+    assert args.course_all is None
+
+
+def test_reregister_parsing_course_all():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'reregister --course-all COURSE_ID --grader-cpu 2'.split())
+    assert args.currentGraderId is None
+    assert args.course_all == 'COURSE_ID'
+    assert args.grader_cpu == 2
+    assert args.parallelism == 4
+    assert args.rate == 5.0
+
+
+def test_reregister_requires_all_positionals():
+    parser = main.build_parser()
+    args = parser.parse_args('reregister GRADER_ID COURSE_ID'.split())
+    assert reregister.command_reregister(args) == 1
+
+
+@patch('courseraprogramming.commands.reregister.time')
+def test_rate_limiter(time):
+    time.time.return_value = 100
+    limiter = reregister.RateLimiter(4)
+    limiter.wait()
+    limiter.wait()
+    limiter.wait()
+    assert [c[0][0] for c in time.sleep.call_args_list] == [0.25, 0.5]
+
+
+def test_list_course_graders_pages():
+    session = MagicMock()
+    session.get.side_effect = [
+        make_response(200, {
+            'elements': [{'id': 'g1'}, {'id': 'g2'}],
+            'paging': {'next': '2', 'total': 3},
+        }),
+        make_response(200, {
+            'elements': [{'id': 'g3'}],
+            'paging': {'total': 3},
+        }),
+    ]
+    assert reregister.list_course_graders(
+        session, 'https://ex', 'course1', reregister.RateLimiter(0)) == \
+        ['g1', 'g2', 'g3']
+    assert 'start' not in session.get.call_args_list[0][1]['params']
+    assert session.get.call_args_list[1][1]['params']['start'] == '2'
+    assert session.get.call_args_list[1][1]['params']['q'] == 'listByCourse'
+
+
+def test_list_course_graders_error():
+    session = MagicMock()
+    session.get.return_value = make_response(403, {})
+    try:
+        reregister.list_course_graders(
+            session, 'https://ex', 'course1', reregister.RateLimiter(0))
+        assert False, 'listing should have failed'
+    except reregister.ReregisterError:
+        pass
+
+
+class TestCheckpoint:
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        checkpoint = reregister.Checkpoint(self.file_name, 'course1')
+        checkpoint.put('old1', 'new1')
+        checkpoint = reregister.Checkpoint(self.file_name, 'course1')
+        assert checkpoint.is_done('old1')
+        assert checkpoint.is_done('new1')
+        assert not checkpoint.is_done('old2')
+
+    def test_other_course(self):
+        reregister.Checkpoint(self.file_name, 'course1').put('old1', 'new1')
+        checkpoint = reregister.Checkpoint(self.file_name, 'course2')
+        assert not checkpoint.is_done('old1')
+
+    def fake_registry(self, parts):
+        grader_registry = MagicMock()
+        grader_registry.grader.return_value = None
+        grader_registry.parts.return_value = [
+            ('course1', item, part, executor)
+            for item, part, executor in parts]
+        return grader_registry
+
+    @patch('courseraprogramming.commands.reregister.update_assignment')
+    @patch('courseraprogramming.commands.reregister.register_grader')
+    @patch('courseraprogramming.commands.reregister.oauth2')
+    @patch('courseraprogramming.commands.reregister.requests')
+    def test_reregister_course_resumes(self, requests, oauth2,
+                                       register_grader, update_assignment):
+        reregister.Checkpoint(self.file_name, 'course1').put('g1', 'n1')
+        session = requests.Session.return_value
+        session.get.side_effect = lambda url, params=None: \
+            make_response(200, {
+                'elements': [{'id': 'g1'}, {'id': 'n1'}, {'id': 'g2'},
+                             {'id': 'unused'}],
+                'paging': {},
+            }) if params else make_response(200, {
+                'elements': [{'bucket': 'b', 'key': url[-2:]}],
+            })
+        register_grader.return_value = 'n2'
+        update_assignment.return_value = 0
+        grader_registry = self.fake_registry([
+            ('item1', 'part1', 'n1'),
+            ('item2', 'part1', 'g2'),
+            ('item2', 'part2', 'g2'),
+            ('item3', 'part1', 'deleted'),
+        ])
+        args = main.build_parser().parse_args(
+            ['reregister', '--course-all', 'course1', '--rate', '0',
+             '--checkpoint-file', self.file_name])
+        args.quiet = 1
+
+        with patch('courseraprogramming.registry.open_registry',
+                   return_value=grader_registry):
+            assert reregister.command_reregister(args) == 0
+
+        register_grader.assert_called_once_with(
+            session.auth, args, 'b', 'g2', registry_db=grader_registry)
+        assert update_assignment.call_args_list == [
+            ((session.auth, 'n2', args, 'item2', 'part1'),
+             {'registry_db': grader_registry}),
+            ((session.auth, 'n2', args, 'item2', 'part2'),
+             {'registry_db': grader_registry}),
+        ]
+        assert args.course == 'course1'
+        with open(self.file_name) as f:
+            assert json.load(f)['reregistered'] == {'g1': 'n1', 'g2': 'n2'}
+
+    @patch('courseraprogramming.commands.reregister.update_assignment')
+    @patch('courseraprogramming.commands.reregister.register_grader')
+    @patch('courseraprogramming.commands.reregister.oauth2')
+    @patch('courseraprogramming.commands.reregister.requests')
+    def test_reregister_course_part_failure(self, requests, oauth2,
+                                            register_grader,
+                                            update_assignment):
+        session = requests.Session.return_value
+        session.get.side_effect = lambda url, params=None: \
+            make_response(200, {
+                'elements': [{'id': 'g1'}],
+                'paging': {},
+            }) if params else make_response(200, {
+                'elements': [{'bucket': 'b', 'key': 'k'}],
+            })
+        register_grader.return_value = 'n1'
+        update_assignment.return_value = 1
+        args = main.build_parser().parse_args(
+            ['reregister', '--course-all', 'course1', '--rate', '0',
+             '--checkpoint-file', self.file_name])
+        args.quiet = 1
+
+        with patch('courseraprogramming.registry.open_registry',
+                   return_value=self.fake_registry([
+                       ('item1', 'part1', 'g1')])):
+            assert reregister.command_reregister(args) == 1
+        assert update_assignment.called
+        # Not checkpointed, so the next run tries again.
+        assert not os.path.exists(self.file_name)
+
+    @patch('courseraprogramming.commands.reregister.register_grader')
+    @patch('courseraprogramming.commands.reregister.oauth2')
+    @patch('courseraprogramming.commands.reregister.requests')
+    def test_reregister_course_failure(self, requests, oauth2,
+                                       register_grader):
+        session = requests.Session.return_value
+        session.get.side_effect = lambda url, params=None: \
+            make_response(200, {
+                'elements': [{'id': 'g1'}],
+                'paging': {},
+            }) if params else make_response(404, {})
+        args = main.build_parser().parse_args(
+            ['reregister', '--course-all', 'course1', '--rate', '0',
+             '--checkpoint-file', self.file_name])
+        args.quiet = 1
+
+        with patch('courseraprogramming.registry.open_registry',
+                   return_value=self.fake_registry([
+                       ('item1', 'part1', 'g1')])):
+            assert reregister.command_reregister(args) == 1
+        assert not register_grader.called
+        assert not os.path.exists(self.file_name)
+
+    @patch('courseraprogramming.commands.reregister.register_grader')
+    @patch('courseraprogramming.commands.reregister.oauth2')
+    @patch('courseraprogramming.commands.reregister.requests')
+    def test_reregister_course_no_known_parts(self, requests, oauth2,
+                                              register_grader):
+        session = requests.Session.return_value
+        session.get.return_value = make_response(200, {
+            'elements': [{'id': 'g1'}, {'id': 'g2'}],
+            'paging': {},
+        })
+        args = main.build_parser().parse_args(
+            ['reregister', '--course-all', 'course1', '--rate', '0',
+             '--checkpoint-file', self.file_name])
+        args.quiet = 1
+
+        with patch('courseraprogramming.registry.open_registry',
+                   return_value=self.fake_registry([])), \
+                LogCapture() as logs:
+            assert reregister.command_reregister(args) == 1
+        assert not register_grader.called
+        logs.check_present(
+            ('root', 'ERROR', 'The grader registry knows no part of course '
+             'course1 that uses one of its 2 graders, so there is nothing to '
+             'reregister. Parts are recorded by upload, deploy and '
+             'reregister run with this registry.'))
+
+    @patch('courseraprogramming.commands.reregister.oauth2')
+    def test_reregister_course_needs_registry(self, oauth2):
+        args = main.build_parser().parse_args(
+            ['reregister', '--course-all', 'course1'])
+        assert reregister.command_reregister(args) == 1
+        assert not oauth2.build_oauth2.called
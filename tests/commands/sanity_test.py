@@ -15,10 +15,21 @@
 # limitations under the License.
 
 import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from courseraprogramming import layers
 from courseraprogramming import main
 from courseraprogramming.commands import sanity
-from mock import mock_open, patch
+from mock import MagicMock, mock_open, patch
+from requests.exceptions import ReadTimeout
 from testfixtures import LogCapture
+from tests import fake_images
 
 # Set up mocking of the `open` call. See http://www.ichimonji10.name/blog/6/
 from sys import version_info
@@ -82,6 +93,54 @@ def test_command_sanity():
             "FROM debian",
             "",
             "ENTRYPOINT /grader.sh"], ()),
+        ("apt_without_cleanup", [
+            "FROM debian",
+            "RUN apt-get update && apt-get install -y python",
+            "RUN apt-get update && apt-get install -y gcc && \\",
+            "    rm -rf /var/lib/apt/lists/*",
+            "ENTRYPOINT /grader.sh"], (
+            ('root', 'WARNING', 'Line 1: apt-get without `rm -rf '
+                '/var/lib/apt/lists/*` in the same RUN leaves about 20 MB of '
+                'package lists in the layer.'),)),
+        ("pip_cache", [
+            "FROM python:3",
+            "RUN pip install numpy",
+            "RUN pip install --no-cache-dir scipy",
+            "ENV PIP_NO_CACHE_DIR=1",
+            "RUN pip3 install pandas",
+            "ENTRYPOINT /grader.sh"], (
+            ('root', 'WARNING', 'Line 1: pip install without --no-cache-dir '
+                'keeps a second copy of every downloaded package in the '
+                'layer, often tens of MB.'),
+            ('root', 'WARNING', 'Line 3: ENV-based environment variables '
+                'are stripped in the production environment for security '
+                'reasons. Please set any environment variables you need '
+                'in your grading script.'),)),
+        ("copy_context_before_install", [
+            "FROM python:3",
+            "COPY requirements.txt /grader/",
+            "RUN pip install --no-cache-dir -r /grader/requirements.txt",
+            "COPY . /grader",
+            "RUN pip install --no-cache-dir -e /grader",
+            "ENTRYPOINT /grader/grader.sh"], (
+            ('root', 'WARNING', 'Line 3: The whole build context (5.0M now) '
+                'is copied, but there is no .dockerignore file. Version '
+                'control directories, build outputs and local data all end up '
+                'in the image.'),
+            ('root', 'WARNING', 'Line 4: Dependencies are installed after '
+                'the whole build context is copied on line 3, so any source '
+                'change rebuilds and re-uploads this layer and the 1 '
+                'instructions after it. Copy only the dependency manifests '
+                'before installing.'),)),
+        ("many_runs", [
+            "FROM debian",
+            "RUN mkdir /grader",
+            "RUN chmod 755 /grader",
+            "RUN useradd grader",
+            "ENTRYPOINT /grader.sh"], (
+            ('root', 'WARNING', 'Lines 1-3: 3 consecutive RUN instructions '
+                'create 3 layers. Combining them with && saves 2 layers, and '
+                'keeps files deleted by a later step out of the image.'),)),
     ]
     for testcase in testCases:
         testFn = command_sanity_impl
@@ -94,7 +153,9 @@ def command_sanity_impl(dockerFile, expectedLogs):
     with LogCapture() as logs:
         open_ = mock_open(read_data='\n'.join(dockerFile))
         open_().readlines.return_value = dockerFile
-        with patch.object(builtins, 'open', open_, create=True):
+        with patch.object(builtins, 'open', open_, create=True), \
+                patch('courseraprogramming.commands.sanity.build_context_size',
+                      return_value=5 * 1024 * 1024):
             args = argparse.Namespace()
             args.docker_file = "."
             args.skip_environment = True
@@ -102,7 +163,358 @@ def command_sanity_impl(dockerFile, expectedLogs):
             logs.check(*expectedLogs)
 
 
+def parse_dockerfile(lines, has_dockerignore=False, context_size=None):
+    structure = []
+    for number, line in enumerate(lines):
+        instruction, _, value = line.partition(' ')
+        structure.append({'instruction': instruction, 'value': value,
+                          'startline': number})
+    return sanity.Dockerfile('/build/Dockerfile', structure,
+                             '\n'.join(lines), has_dockerignore,
+                             context_size)
+
+
+def test_performance_rule_impacts():
+    dockerfile = parse_dockerfile([
+        'FROM python:3',
+        'RUN apt-get update && apt-get install -y gcc',
+        'RUN pip install numpy',
+        'RUN mkdir /grader',
+        'COPY . /grader',
+        'RUN pip install --no-cache-dir -e /grader',
+        'RUN chmod 755 /grader',
+        'ENTRYPOINT /grader/grader.sh',
+    ], context_size=123456)
+    assert [f.impact for f in sanity.check_apt_lists(dockerfile)] == \
+        [sanity.APT_LISTS_SIZE_MB * 1024 * 1024]
+    assert [f.impact for f in sanity.check_pip_cache(dockerfile)] == \
+        [sanity.PIP_CACHE_SIZE_MB * 1024 * 1024]
+    # The install and the RUN after it.
+    assert [f.impact for f in sanity.check_dependency_order(dockerfile)] == \
+        [2]
+    assert [f.impact for f in sanity.check_consecutive_runs(dockerfile)] == \
+        [2]
+    assert [f.impact for f in sanity.check_dockerignore(dockerfile)] == \
+        [123456]
+
+
+def test_build_context_size():
+    directory = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(directory, 'sub'))
+        for name, size in [('a', 10), ('sub/b', 5)]:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'x' * size)
+        assert sanity.build_context_size(directory) == 15
+    finally:
+        shutil.rmtree(directory)
+
+
 def test_sanity_parsing():
     parser = main.build_parser()
     args = parser.parse_args('sanity'.split())
     assert args.func == sanity.command_sanity
+
+
+def test_sanity_parsing_options():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'sanity --image abc --format json --no-cache'.split())
+    assert args.image == 'abc'
+    assert args.format == 'json'
+    assert args.cache_file is None
+
+
+def test_copy_destination():
+    assert sanity.copy_destination('foo /grader/') == '/grader/'
+    assert sanity.copy_destination('--chown=1:1 foo bar /x') == '/x'
+    assert sanity.copy_destination('["a b", "/c"]') == '/c'
+    assert sanity.copy_destination('foo foo') == 'foo'
+
+
+def test_rule_registry_inputs():
+    names = [r.name for r in sanity.RULES]
+    assert len(names) == len(set(names))
+    for r in sanity.RULES:
+        for name in r.inputs:
+            assert name in sanity.INPUTS
+
+
+def test_image_rules():
+    image = {'Id': 'sha256:abc', 'Config': {'Entrypoint': None}}
+    inputs = sanity.Inputs.from_values(
+        {sanity.IMAGE_CONFIG: (image, 'sha256:abc')})
+    findings = sanity.run_rules(sanity.RULES, inputs, sanity.ResultCache())
+    assert [f.rule for f in findings] == ['image-entrypoint']
+    assert findings[0].text() == \
+        'The image sha256:abc does not define an ENTRYPOINT.'
+
+
+def test_run_rules_uses_cache():
+    calls = []
+
+    def check(value):
+        calls.append(value)
+        return [sanity.warning('Bad %s' % value, 3)]
+    rules = [sanity.Rule('test-rule', (sanity.DOCKERFILE,), check)]
+    cache = sanity.ResultCache()
+
+    def run(value, fingerprint):
+        inputs = sanity.Inputs.from_values(
+            {sanity.DOCKERFILE: (value, fingerprint)})
+        return sanity.run_rules(rules, inputs, cache)
+    first = run('x', 'hash1')
+    second = run('y', 'hash1')
+    third = run('z', 'hash2')
+    assert calls == ['x', 'z']
+    assert second[0].text() == first[0].text() == 'Line 3: Bad x'
+    assert second[0].rule == 'test-rule'
+    assert third[0].text() == 'Line 3: Bad z'
+
+
+def test_cache_hit_loads_no_image_inputs():
+    docker = make_script_docker({'/grader/grade.sh': b'pip install numpy\n'})
+    docker.inspect_image.return_value = {
+        'Id': 'sha256:abc',
+        'Config': {'Entrypoint': ['/grader/grade.sh'], 'WorkingDir': '/'}}
+    index = layers.ImageIndex.from_saved_image(
+        'sha256:abc', fake_images.make_saved_image([[('grader', None)]]))
+    args = main.build_parser().parse_args(
+        'sanity --skip-environment --image abc'.split())
+    directory = tempfile.mkdtemp()
+    try:
+        args.cache_file = os.path.join(directory, 'cache.json')
+        with patch('courseraprogramming.commands.sanity.utils.docker_client',
+                   return_value=docker), \
+                patch('courseraprogramming.commands.sanity.layers.image_index',
+                      return_value=index) as image_index:
+            with LogCapture() as logs:
+                sanity.command_sanity(args)
+            assert docker.create_container.call_count == 1
+            assert image_index.call_count == 1
+            with LogCapture() as cached_logs:
+                sanity.command_sanity(args)
+    finally:
+        shutil.rmtree(directory)
+    # Only the image id was needed to find every finding in the cache.
+    assert docker.create_container.call_count == 1
+    assert image_index.call_count == 1
+    assert str(cached_logs) == str(logs)
+    assert 'installs packages' in str(logs)
+
+
+def test_result_cache_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(directory, 'cache.json')
+        cache = sanity.ResultCache(file_name)
+        cache.put('key', [sanity.Finding(
+            logging.WARNING, 'Bad', 1, 2, impact=10, rule='r')])
+        cache.save()
+        findings = sanity.ResultCache(file_name).get('key')
+        assert findings[0].text() == 'Lines 1-2: Bad'
+        assert findings[0].level == logging.WARNING
+        assert findings[0].impact == 10
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_report_json():
+    out = io.StringIO()
+    sanity.report_json([
+        sanity.Finding(logging.WARNING, 'Bad', 1, rule='r'),
+        sanity.Finding(logging.INFO, 'Note', rule='s'),
+    ], out)
+    report = json.loads(out.getvalue())
+    assert report['counts'] == {'error': 0, 'warning': 1, 'info': 1}
+    assert report['findings'][0] == {
+        'rule': 'r', 'level': 'warning', 'line': 1, 'end_line': None,
+        'message': 'Bad', 'impact': None}
+
+
+def test_time_startup():
+    docker = MagicMock()
+    docker.create_container.return_value = {'Id': 'container'}
+    docker.logs.return_value = iter([b'', b'{"fractionalScore": 0}'])
+    docker.wait.return_value = 0
+    timing = sanity.time_startup(docker, 'image', '/tmp/empty', 10, '1g')
+    assert timing['exit_code'] == 0
+    assert timing['first_output'] is not None
+    assert timing['total'] >= timing['first_output'] >= 0
+    docker.create_host_config.assert_called_with(
+        binds=['/tmp/empty:/shared/submission'], network_mode='none',
+        mem_limit='1g', memswap_limit='1g')
+    docker.wait.assert_called_with({'Id': 'container'}, timeout=10)
+    docker.remove_container.assert_called_with(
+        {'Id': 'container'}, force=True)
+
+
+def test_time_startup_timeout():
+    docker = MagicMock()
+    docker.create_container.return_value = {'Id': 'container'}
+    docker.logs.return_value = iter([])
+    docker.wait.side_effect = ReadTimeout()
+    timing = sanity.time_startup(docker, 'image', '/tmp/empty', 10, '1g')
+    assert timing['exit_code'] is None
+    assert timing['first_output'] is None
+    docker.kill.assert_called_with({'Id': 'container'})
+    docker.remove_container.assert_called_with(
+        {'Id': 'container'}, force=True)
+
+
+def test_time_startup_silent_hang():
+    docker = MagicMock()
+    docker.create_container.return_value = {'Id': 'container'}
+    killed = threading.Event()
+
+    def silent_logs(*args, **kwargs):
+        # Like a grader that hangs without writing anything: the stream only
+        # ends once the container is killed.
+        killed.wait(5)
+        return iter([])
+    docker.logs.side_effect = silent_logs
+    docker.wait.side_effect = ReadTimeout()
+    docker.kill.side_effect = lambda container: killed.set()
+    begin = time.time()
+    timing = sanity.time_startup(docker, 'image', '/tmp/empty', 10, '1g')
+    assert time.time() - begin < 4
+    assert timing['exit_code'] is None
+    assert timing['first_output'] is None
+    docker.wait.assert_called_with({'Id': 'container'}, timeout=10)
+
+
+def startup_run(total, first_output=None, exit_code=0):
+    return {'create': 0.1, 'start': 0.2, 'first_output': first_output,
+            'total': total, 'exit_code': exit_code}
+
+
+def test_check_startup_latency():
+    findings = sanity.check_startup_latency({
+        'runs': [startup_run(1.0, 0.5), startup_run(3.0),
+                 startup_run(60.0, exit_code=None)],
+        'budget': 2.0,
+        'timeout': 60,
+    })
+    assert [f.text() for f in findings] == [
+        'Startup latency over 3 runs on an empty submission: median 3.00s, '
+        'worst 60.00s (create 0.10s, start 0.20s, first output 0.50s).',
+        'Worst-case startup latency of 60.00s exceeds the budget of 2.00s. '
+        'Every submission pays this cost; move imports, compilation and '
+        'warm-up work into the image build.',
+        '1 of 3 runs on an empty submission did not exit within 60 seconds.',
+    ]
+
+
+def test_startup_rule_is_not_cached():
+    cache = sanity.ResultCache()
+    startup = {'runs': [startup_run(1.0)], 'budget': 5.0, 'timeout': 60}
+    inputs = sanity.Inputs.from_values(
+        {sanity.STARTUP_TIMINGS: (startup, None)})
+    sanity.run_rules(sanity.RULES, inputs, cache)
+    assert cache.entries == {}
+
+
+def test_sanity_parsing_startup():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'sanity --image abc --measure-startup --startup-runs 3 '
+        '--startup-budget 1.5'.split())
+    assert args.measure_startup
+    assert args.startup_runs == 3
+    assert args.startup_budget == 1.5
+
+
+def make_script_docker(files):
+    "Fakes the archive API of a stopped container holding the given files."
+    docker = MagicMock()
+    docker.create_container.return_value = {'Id': 'container'}
+
+    def get_archive(container, path):
+        if path not in files:
+            raise IOError('Not found')
+        data = fake_images.make_layer([(os.path.basename(path), files[path])])
+        return io.BytesIO(data), None
+    docker.get_archive.side_effect = get_archive
+    return docker
+
+
+def test_entrypoint_programs():
+    assert sanity.entrypoint_programs(
+        {'Entrypoint': ['python3', '-u', '/grader/grade.py']}) == \
+        ['/grader/grade.py']
+    assert sanity.entrypoint_programs({'Entrypoint': ['/grader/grade']}) == \
+        ['/grader/grade']
+    assert sanity.entrypoint_programs(
+        {'Entrypoint': ['/bin/sh', '-c', 'cd /grader && ./run.sh']}) == \
+        ['./run.sh']
+    assert sanity.entrypoint_programs(
+        {'Entrypoint': None, 'Cmd': ['/run.sh']}) == ['/run.sh']
+
+
+def test_read_entrypoint_scripts():
+    docker = make_script_docker({
+        '/grader/grade.sh': b'#!/bin/sh\n./setup.sh\npython3 score.py\n',
+        '/grader/setup.sh': b'pip install numpy\n',
+        '/grader/score.py': b'import json\n',
+        '/grader/binary': b'\0ELF',
+    })
+    image = {'Id': 'sha256:abc', 'Config': {
+        'Entrypoint': ['/grader/grade.sh'], 'WorkingDir': '/'}}
+    scripts = sanity.read_entrypoint_scripts(docker, image)
+    assert [path for path, _ in scripts] == [
+        '/grader/grade.sh', '/grader/setup.sh', '/grader/score.py']
+    docker.remove_container.assert_called_with(
+        {'Id': 'container'}, force=True)
+
+    image['Config']['Entrypoint'] = ['/grader/binary']
+    assert sanity.read_entrypoint_scripts(docker, image) == []
+
+
+def test_check_entrypoint_slow_paths():
+    findings = sanity.check_entrypoint_slow_paths([
+        ('/grader/grade.sh', '#!/bin/sh\n'
+            '# pip install is done in the Dockerfile\n'
+            'echo make sure the submission exists\n'
+            'pip install --user numpy\n'
+            'curl -sO http://example.com/data.csv && python3 grade.py\n'),
+        ('/grader/grade.py', 'import subprocess\n'
+            'subprocess.check_call(["gcc", "-O2", "helper.c"])\n'),
+    ])
+    assert [f.text() for f in findings] == [
+        '/grader/grade.sh:4: `pip install --user numpy` installs packages on '
+        'every submission. This slows down grading, and fails in production '
+        'where graders run without network access. Do it in the Dockerfile '
+        'instead.',
+        '/grader/grade.sh:5: `curl -sO http://example.com/data.csv && '
+        'python3 grade.py` downloads files on every submission. This slows '
+        'down grading, and fails in production where graders run without '
+        'network access. Do it in the Dockerfile instead.',
+        '/grader/grade.py:2: `subprocess.check_call(["gcc", "-O2", '
+        '"helper.c"])` compiles code on every submission, which counts '
+        'against the grading timeout. Unless it builds the submission '
+        'itself, do it in the Dockerfile instead.',
+    ]
+
+
+def test_scan_script_quoted_words_are_not_commands():
+    for line in [
+        'echo "make sure your file is named main.py"',
+        'print("cc: done")',
+        'echo "curl is not available"',
+        'grep -q "make" log',
+        "echo 'gcc failed'",
+        'if [ -f Makefile ]; then echo "no make needed"; fi',
+    ]:
+        assert sanity.scan_script('/grader/grade.sh', line) == [], line
+
+
+def test_scan_script_commands_after_keywords():
+    for line in [
+        'if [ -f Makefile ]; then make; fi',
+        'for d in a b; do gcc -c $d.c; done',
+        'if true; then :; else curl -O http://example.com/data; fi',
+        'make',
+        'cd src && make',
+        "subprocess.check_call(['make', 'all'])",
+    ]:
+        assert len(sanity.scan_script('/grader/grade.sh', line)) == 1, line
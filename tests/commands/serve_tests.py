@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from courseraprogramming import main
+from courseraprogramming.commands import serve
+from mock import patch
+import io
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+
+def test_serve_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('serve --socket /tmp/x.sock'.split())
+    assert args.func == serve.command_serve
+    assert args.socket == '/tmp/x.sock'
+
+
+def test_frames():
+    out = io.BytesIO()
+    serve.write_frame(out, serve.STDOUT, b'hello')
+    serve.write_frame(out, serve.EXIT, serve.EXIT_CODE.pack(3))
+    f = io.BytesIO(out.getvalue())
+    assert serve.FRAME_HEADER.unpack(
+        serve.read_exactly(f, serve.FRAME_HEADER.size)) == (serve.STDOUT, 5)
+    assert serve.read_exactly(f, 5) == b'hello'
+    serve.read_exactly(f, serve.FRAME_HEADER.size)
+    assert serve.EXIT_CODE.unpack(serve.read_exactly(f, 4)) == (3, )
+    try:
+        serve.read_exactly(f, 1)
+        assert False, 'read_exactly should have failed'
+    except EOFError:
+        pass
+
+
+def test_exit_code():
+    assert serve.exit_code(SystemExit()) == 0
+    assert serve.exit_code(SystemExit(2)) == 2
+    with patch('courseraprogramming.commands.serve.sys'):
+        assert serve.exit_code(SystemExit('failed')) == 1
+
+
+def test_forward_unreachable():
+    directory = tempfile.mkdtemp()
+    try:
+        assert serve.forward(
+            os.path.join(directory, 'server.sock'), ['version']) is None
+    finally:
+        shutil.rmtree(directory)
+
+
+@patch('courseraprogramming.main.serve', create=True)
+def test_main_runs_agent_locally(serve_module):
+    with patch.dict(os.environ, {'COURSERAPROGRAMMING_SERVER': '/x.sock'}), \
+            patch('courseraprogramming.main.sys') as sys, \
+            patch('courseraprogramming.main.run') as run, \
+            patch('courseraprogramming.commands.serve.forward') as forward:
+        sys.argv = ['courseraprogramming', '-v', 'serve']
+        main.main()
+        assert not forward.called
+        run.assert_called_with(['-v', 'serve'])
+
+        sys.argv = ['courseraprogramming', 'ls', 'image', '/']
+        forward.return_value = 3
+        main.main()
+        forward.assert_called_with('/x.sock', ['ls', 'image', '/'])
+        sys.exit.assert_called_with(3)
+
+
+@patch('courseraprogramming.utils.docker_client')
+def test_warm_state_survives_forks(docker_client):
+    from courseraprogramming.commands import oauth2
+    args = main.build_parser().parse_args(['serve'])
+    serve.warm_up(args)
+    docker_client.assert_called_with(args)
+    cfg = oauth2.configuration()
+    # Commands run in children forked from the server, like this one.
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if oauth2.configuration() is cfg else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+
+def capture_version():
+    "Returns what `courseraprogramming -q version` prints, run in-process."
+    with patch('courseraprogramming.commands.version.print',
+               create=True) as fake_print:
+        main.run(['-q', 'version'])
+    return fake_print.call_args[0][0]
+
+
+def test_serve_over_socket():
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, 'server.sock')
+    server = serve.make_server(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert serve.server_is_running(socket_path)
+        assert serve.make_server(socket_path) is None
+
+        # The forked children inherit any patches, so collect the output
+        # through the frames rather than by patching sys.
+        stdout = io.BytesIO()
+        stderr = io.BytesIO()
+        assert serve.forward(
+            socket_path, ['-q', 'version'], stdout, stderr) == 0
+        assert serve.forward(
+            socket_path, ['no-such-command'], stdout, stderr) == 2
+        version = stdout.getvalue().splitlines()[-1].decode('utf-8')
+        assert version == capture_version()
+        assert b'invalid choice' in stderr.getvalue()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree(directory)
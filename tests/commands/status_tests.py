@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+from courseraprogramming import registry
+from courseraprogramming.commands import publish
+from courseraprogramming.commands import status
+from courseraprogramming.commands import upload
+
+from mock import MagicMock
+from mock import patch
+import io
+
+# Never write to the grader registry from tests.
+registry_patcher = patch(
+    'courseraprogramming.registry.open_registry', return_value=None)
+
+
+def setup_module():
+    registry_patcher.start()
+
+
+def teardown_module():
+    registry_patcher.stop()
+
+
+def executor_response(status):
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {'elements': [{'status': status}]}
+    return response
+
+
+def test_status_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('status g1 g2 --wait'.split())
+    assert args.func == status.command_status
+    assert args.grader == ['g1', 'g2']
+    assert args.wait
+    assert args.wait_timeout == 1800
+    assert args.course is None
+
+
+def test_upload_wait_ready_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args(
+        'upload IMAGE COURSE ITEM PART --wait-ready'.split())
+    assert args.wait_ready
+    assert args.wait_timeout == 1800
+
+
+@patch('courseraprogramming.commands.publish.time')
+def test_wait_for_location_transitions(time):
+    time.time.return_value = 0
+    session = MagicMock()
+    session.get.side_effect = [
+        executor_response('PENDING'),
+        executor_response('PENDING'),
+        executor_response('CLEANING'),
+        executor_response('COMPLETED'),
+    ]
+    seen = []
+    assert publish.wait_for_location(
+        session, 'https://ex/g1', 1000, seen.append) == \
+        publish.GraderExecutorStatus.COMPLETED
+    assert seen == ['PENDING', 'CLEANING', 'COMPLETED']
+    # The delay starts over when the status changes.
+    assert [c[0][0] for c in time.sleep.call_args_list] == [5, 10, 5]
+
+
+@patch('courseraprogramming.commands.status.time')
+@patch('courseraprogramming.commands.publish.time')
+def test_watch_grader(publish_time, time):
+    publish_time.time.return_value = 0
+    time.time.return_value = 1300
+    session = MagicMock()
+    session.get.side_effect = [
+        executor_response('PENDING'),
+        executor_response('COMPLETED'),
+    ]
+    on_transition = MagicMock()
+    assert status.watch_grader(session, 'g1', 'https://ex/g1', 1000,
+                               registered_at=1000,
+                               on_transition=on_transition) == \
+        ('COMPLETED', 300)
+    on_transition.assert_called_with('g1', 'COMPLETED', 1000)
+
+
+@patch('courseraprogramming.commands.status.time')
+def test_transition_printer(time):
+    time.time.return_value = 1120
+    time.strftime.return_value = '12:00:00'
+    out = io.StringIO()
+    printer = status.TransitionPrinter(out)
+    printer('g1', 'PENDING', None)
+    printer('g1', 'COMPLETED', 1000)
+    assert out.getvalue() == (
+        '12:00:00  g1: PENDING\n'
+        '12:00:00  g1: COMPLETED (120 seconds after registration)\n')
+
+
+def test_resolve_graders():
+    grader_registry = registry.Registry(':memory:')
+    grader_registry.record_grader('course1', 'g1', location='https://loc/g1',
+                                  registered=True)
+    grader_registry.record_grader('course1', 'g2', status='COMPLETED')
+    grader_registry.record_grader('course1', 'g3')
+    args = main.build_parser().parse_args(
+        'status g1 g4 https://loc/g5 --course course1'.split())
+    targets = status.resolve_graders(args, grader_registry)
+    assert [(grader, location) for grader, location, _ in targets] == [
+        ('g1', 'https://loc/g1'),
+        ('g4', args.executor_endpoint + '/g4'),
+        ('https://loc/g5', 'https://loc/g5'),
+        ('g3', args.executor_endpoint + '/g3'),
+    ]
+    assert targets[0][2] is not None
+    assert targets[1][2] is None
+
+
+@patch('courseraprogramming.commands.status.watch_grader')
+@patch('courseraprogramming.commands.status.oauth2')
+def test_command_status_exit_codes(oauth2, watch_grader):
+    args = main.build_parser().parse_args('status g1 g2'.split())
+    args.quiet = 1
+    watch_grader.side_effect = lambda session, grader, *rest: {
+        'g1': ('COMPLETED', None), 'g2': ('PENDING', None)}[grader]
+    assert status.command_status(args) == \
+        publish.ErrorCodes.RETRYABLE_ERROR
+
+    watch_grader.side_effect = lambda session, grader, *rest: {
+        'g1': ('COMPLETED', None), 'g2': ('FAILED', None)}[grader]
+    assert status.command_status(args) == publish.ErrorCodes.FATAL_ERROR
+
+    watch_grader.side_effect = None
+    watch_grader.return_value = ('COMPLETED', 12.0)
+    assert status.command_status(args) == 0
+
+
+def test_command_status_nothing_to_watch():
+    args = main.build_parser().parse_args('status'.split())
+    assert status.command_status(args) == 1
+
+
+@patch('courseraprogramming.commands.upload.status.watch_grader')
+def test_wait_until_ready(watch_grader):
+    args = main.build_parser().parse_args(
+        'upload IMAGE COURSE ITEM PART --wait-ready'.split())
+    args.quiet = 1
+    grader_registry = registry.Registry(':memory:')
+    watch_grader.return_value = ('COMPLETED', 42.0)
+    assert upload.wait_until_ready('auth', args, 'g1', 'https://loc/g1',
+                                   1000, grader_registry) == 0
+    assert watch_grader.call_args[0][1:3] == ('g1', 'https://loc/g1')
+    assert grader_registry.grader('g1')['status'] == 'COMPLETED'
+
+    watch_grader.return_value = ('PENDING', None)
+    assert upload.wait_until_ready('auth', args, 'g1', 'https://loc/g1',
+                                   1000) == publish.ErrorCodes.RETRYABLE_ERROR
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+from courseraprogramming import registry
+from courseraprogramming.commands import sync
+
+from mock import MagicMock
+from mock import patch
+import io
+import json
+
+
+def make_response(status_code, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    response.text = json.dumps(body)
+    return response
+
+
+def test_sync_parsing():
+    parser = main.build_parser()
+    args = parser.parse_args('sync course1 course2 --offline'.split())
+    assert args.func == sync.command_sync
+    assert args.course == ['course1', 'course2']
+    assert args.offline
+    assert args.registry is None
+
+
+def test_sync_course():
+    args = main.build_parser().parse_args('sync course1'.split())
+    grader_registry = registry.Registry(':memory:')
+    session = MagicMock()
+    session.get.side_effect = [
+        make_response(200, {
+            'elements': [
+                {'id': 'g1', 'bucket': 'b', 'key': 'k1'},
+                {'id': 'g2', 'status': 'COMPLETED'},
+            ],
+            'paging': {},
+        }),
+        make_response(200, {'elements': [{'bucket': 'b', 'key': 'k2'}]}),
+    ]
+    assert sync.sync_course(session, args, grader_registry, 'course1',
+                            MagicMock()) == 2
+    session.get.assert_called_with(args.register_endpoint + '/g2')
+    assert grader_registry.grader('g1')['key'] == 'k1'
+    assert grader_registry.grader('g2')['key'] == 'k2'
+    assert grader_registry.grader('g2')['status'] == 'COMPLETED'
+
+
+def test_print_registry():
+    grader_registry = registry.Registry(':memory:')
+    grader_registry.record_grader('course1', 'g1', bucket='b', key='k',
+                                  registered=True)
+    grader_registry.record_grader('course1', 'g2', replaces='g1',
+                                  registered=True)
+    grader_registry.record_part('course1', 'item1', 'part1', 'g2')
+    out = io.StringIO()
+    sync.print_registry(grader_registry, 'course1', out)
+    assert out.getvalue() == (
+        'Course course1:\n'
+        '  g1  UNKNOWN  s3://b/k\n'
+        '  g2  UNKNOWN  -\n'
+        '    replaces g1\n'
+        '    grades item1/part1\n')
+
+
+@patch('courseraprogramming.commands.sync.registry')
+def test_sync_registry_disabled(registry):
+    registry.open_registry.return_value = None
+    args = main.build_parser().parse_args('sync course1 --offline'.split())
+    assert sync.command_sync(args) == 1
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Builds in-memory `docker save` archives for tests.
+"""
+
+import hashlib
+import io
+import json
+import tarfile
+
+
+def make_layer(entries):
+    """
+    Builds a layer tar. entries is a list of (path, contents) tuples where
+    contents is bytes for a regular file, None for a directory, or a
+    ('symlink', target) or ('hardlink', target) tuple.
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as layer:
+        for path, contents in entries:
+            info = tarfile.TarInfo(path)
+            info.mtime = 1500000000
+            if contents is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                layer.addfile(info)
+            elif isinstance(contents, tuple):
+                info.type = tarfile.SYMTYPE if contents[0] == 'symlink' \
+                    else tarfile.LNKTYPE
+                info.linkname = contents[1]
+                layer.addfile(info)
+            else:
+                info.mode = 0o644
+                info.size = len(contents)
+                layer.addfile(info, io.BytesIO(contents))
+    return stream.getvalue()
+
+
+def make_saved_image(layers, history=None, entrypoint=None):
+    """
+    Builds the stream `docker save` would return for an image made of the
+    given layers. (See make_layer.) The manifest is written last, as docker
+    does.
+    """
+    layer_tars = [make_layer(entries) for entries in layers]
+    diff_ids = ['sha256:' + hashlib.sha256(t).hexdigest() for t in layer_tars]
+    config = {
+        'config': {'Entrypoint': entrypoint},
+        'rootfs': {'type': 'layers', 'diff_ids': diff_ids},
+        'history': history or [
+            {'created_by': 'layer %s' % i} for i in range(len(layers))],
+    }
+    config_bytes = json.dumps(config).encode('utf-8')
+    config_name = hashlib.sha256(config_bytes).hexdigest() + '.json'
+    layer_paths = ['%s/layer.tar' % d[len('sha256:'):] for d in diff_ids]
+    manifest = [{
+        'Config': config_name,
+        'RepoTags': ['test:latest'],
+        'Layers': layer_paths,
+    }]
+
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as archive:
+        def add(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        # Docker writes layers in an arbitrary order; reverse them to make
+        # sure the reader does not rely on the archive order.
+        for path, data in reversed(list(zip(layer_paths, layer_tars))):
+            add(path, data)
+        add(config_name, config_bytes)
+        add('manifest.json', json.dumps(manifest).encode('utf-8'))
+    stream.seek(0)
+    return stream
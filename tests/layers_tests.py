@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import layers
+from tests import fake_images
+import gzip
+import hashlib
+import json
+import os.path
+import shutil
+import tempfile
+
+
+BASE_LAYER = [
+    ('bin', None),
+    ('bin/sh', b'#!binary'),
+    ('etc', None),
+    ('etc/passwd', b'root:x:0:0'),
+    ('grader', None),
+    ('grader/old.py', b'old'),
+    ('grader/.hidden', b''),
+    ('tmp', None),
+    ('tmp/cache', None),
+    ('tmp/cache/big', b'x' * 4096),
+]
+
+TOP_LAYER = [
+    ('grader/.wh.old.py', b''),
+    ('grader/grader.py', b'print("hi")'),
+    ('grader/lib', None),
+    ('grader/lib/helpers.py', b'pass'),
+    ('tmp/cache/.wh..wh..opq', b''),
+    ('tmp/cache/fresh', b'y'),
+    ('usr/bin/python', ('symlink', 'python3')),
+]
+
+
+def build_index():
+    return layers.ImageIndex.from_saved_image(
+        'sha256:abc',
+        fake_images.make_saved_image([BASE_LAYER, TOP_LAYER]))
+
+
+def test_layers_in_manifest_order():
+    index = build_index()
+    assert len(index.layers) == 2
+    assert index.layers[0]['entries'][0][layers.PATH] == '/bin'
+    assert index.layers[1]['diff_id'].startswith('sha256:')
+
+
+def test_empty_layers():
+    index = layers.ImageIndex.from_saved_image(
+        'sha256:abc',
+        fake_images.make_saved_image([BASE_LAYER, [], TOP_LAYER]))
+    assert len(index.layers) == 3
+    assert index.layers[1]['entries'] == []
+    assert index.layers[1]['diff_id'].startswith('sha256:')
+    assert index.lookup('/grader/grader.py')[-1] == 2
+    assert index.lookup('/bin/sh')[-1] == 0
+
+
+def test_whiteouts_applied():
+    index = build_index()
+    assert index.lookup('/grader/old.py') is None
+    assert index.lookup('/tmp/cache/big') is None
+    assert index.listdir('/tmp/cache') == ['fresh']
+    assert index.listdir('/grader') == [
+        '.hidden', 'grader.py', 'lib']
+
+
+def test_implicit_parent_directories():
+    index = build_index()
+    assert index.lookup('/usr')[layers.TYPE] == layers.DIRECTORY
+    entry = index.lookup('/usr/bin/python', follow=False)
+    assert entry[layers.TYPE] == layers.SYMLINK
+    assert entry[layers.LINKNAME] == 'python3'
+
+
+def test_walk_and_glob():
+    index = build_index()
+    walked = [path for path, _ in index.walk('/grader')]
+    assert walked == ['/grader', '/grader/.hidden', '/grader/grader.py',
+                      '/grader/lib', '/grader/lib/helpers.py']
+    assert index.glob('/grader/*') == ['/grader/grader.py', '/grader/lib']
+    assert index.glob('/*/*.py') == ['/grader/grader.py']
+    assert index.glob('/grader/.h*') == ['/grader/.hidden']
+
+
+def test_save_and_load_round_trip():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        file_name = layers.index_file_name(cache_dir, 'sha256:abc')
+        build_index().save(file_name)
+        loaded = layers.ImageIndex.load(file_name)
+        assert loaded.image_id == 'sha256:abc'
+        assert loaded.listdir('/grader') == build_index().listdir('/grader')
+        assert os.path.basename(file_name) == 'sha256_abc.json.gz'
+        assert loaded.layers[0]['source'] == build_index().layers[0]['path']
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_load_rejects_old_versions():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        file_name = layers.index_file_name(cache_dir, 'sha256:abc')
+        data = build_index().to_dict()
+        # Version 2 indexes do not know the source of aliased layers.
+        data['version'] = 2
+        with gzip.open(file_name, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        try:
+            layers.ImageIndex.load(file_name)
+            assert False, 'load should have failed'
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_mode_string():
+    index = build_index()
+    assert layers.mode_string(index.lookup('/grader')) == 'drwxr-xr-x'
+    assert layers.mode_string(index.lookup('/etc/passwd')) == '-rw-r--r--'
+
+
+def test_content_hashes():
+    index = build_index()
+    assert index.lookup('/etc/passwd')[layers.HASH] == \
+        hashlib.sha256(b'root:x:0:0').hexdigest()
+    assert index.lookup('/grader')[layers.HASH] == ''
+
+
+MERGED_USR_LAYER = [
+    ('bin', ('symlink', 'usr/bin')),
+    ('lib', ('symlink', '/usr/lib')),
+    ('usr', None),
+    ('usr/bin', None),
+    ('usr/bin/bash', b'#!bash'),
+    ('usr/bin/sh', ('symlink', 'bash')),
+    ('usr/lib', None),
+    ('usr/lib/libc.so', b'libc'),
+    ('loop', ('symlink', 'loop')),
+]
+
+
+def test_lookup_resolves_symlinks():
+    index = layers.ImageIndex.from_saved_image(
+        'sha256:abc', fake_images.make_saved_image([MERGED_USR_LAYER]))
+    assert index.lookup('/bin')[layers.TYPE] == layers.DIRECTORY
+    assert index.lookup('/bin', follow=False)[layers.TYPE] == layers.SYMLINK
+    assert index.resolve('/bin/bash') == '/usr/bin/bash'
+    assert index.resolve('/bin/sh') == '/usr/bin/bash'
+    assert index.resolve('/bin/sh', follow=False) == '/usr/bin/sh'
+    assert index.resolve('/lib/../bin/sh') == '/usr/bin/bash'
+    assert index.lookup('/bin/missing') is None
+    assert index.lookup('/loop') is None
+    assert index.listdir('/bin') == ['bash', 'sh']
+    assert [path for path, _ in index.walk('/bin')] == [
+        '/bin', '/bin/bash', '/bin/sh']
+    assert index.glob('/bin/b*') == ['/bin/bash']
+
+
+def test_hardlinks_share_size_and_hash():
+    index = layers.ImageIndex.from_saved_image(
+        'sha256:abc', fake_images.make_saved_image([
+            [('usr', None), ('usr/bin', None),
+             ('usr/bin/python3.6', b'python'),
+             ('usr/bin/python3', ('hardlink', 'usr/bin/python3.6'))],
+            [('usr/bin/.wh.python3.6', b'')],
+        ]))
+    assert index.lookup('/usr/bin/python3.6') is None
+    entry = index.lookup('/usr/bin/python3')
+    assert entry[layers.TYPE] == layers.HARDLINK
+    assert entry[layers.SIZE] == len(b'python')
+    assert entry[layers.HASH] == hashlib.sha256(b'python').hexdigest()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+import json
+import os.path
+import subprocess
+import sys
+
+STARTUP_SCRIPT = '''
+import json
+import sys
+from courseraprogramming import main
+main.build_parser(sys.argv[1:]).parse_args(sys.argv[1:])
+print(json.dumps({'modules': sorted(sys.modules)}))
+'''
+
+HEAVY_MODULES = [
+    'docker',
+    'dockerfile_parse',
+    'multiprocessing',
+    'pkg_resources',
+    'requests_toolbelt',
+]
+
+
+def measure_startup(*argv):
+    "Returns the modules a fresh interpreter imports to parse argv."
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP_SCRIPT] + list(argv),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(output.decode('utf-8'))
+
+
+def test_find_command():
+    parser = main.build_parser([])
+    assert main.find_command(parser, ['ls', 'img', '/']) == 'ls'
+    assert main.find_command(
+        parser, ['-v', '--docker-url', 'ls', '--timeout', '5', 'cat']) == \
+        'cat'
+    assert main.find_command(parser, ['-c', 'x.cfg', 'version']) == 'version'
+    assert main.find_command(parser, ['-h']) is None
+    assert main.find_command(parser, ['unknown', 'ls']) is None
+
+
+def test_build_parser_for_one_command():
+    parser = main.build_parser(['version'])
+    args = parser.parse_args(['version'])
+    assert args.func.__module__ == 'courseraprogramming.commands.version'
+
+
+def test_build_parser_for_help_has_every_command():
+    parser = main.build_parser(['--help'])
+    subparsers = [action for action in parser._actions
+                  if action.dest == '-h'][0]
+    assert list(subparsers.choices) == [name for name, _ in main.COMMANDS]
+
+
+def test_startup_imports_only_the_command():
+    # What keeps startup fast, checked instead of timings that vary with the
+    # machine.
+    for argv in [['version'], ['configure', 'display-auth-cache'],
+                 ['ls', 'img', '/'], ['grep', 'img', 'pattern']]:
+        result = measure_startup(*argv)
+        for module in HEAVY_MODULES:
+            assert module not in result['modules'], (argv, module)
+        assert 'courseraprogramming.commands.upload' not in result['modules']
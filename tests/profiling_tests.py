@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import main
+from courseraprogramming import profiling
+from mock import patch
+import io
+import os.path
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+
+
+def test_categorize():
+    assert profiling.categorize(
+        ['courseraprogramming.commands.ls', 'docker.api.container',
+         'requests.sessions']) == profiling.DOCKER
+    assert profiling.categorize(
+        ['courseraprogramming.commands.publish', 'requests.sessions',
+         'urllib3.connectionpool']) == profiling.HTTP
+    assert profiling.categorize(
+        ['courseraprogramming.commands.publish', 'requests.sessions',
+         'socket']) == profiling.HTTP
+    assert profiling.categorize(
+        ['courseraprogramming.commands.serve', 'socket']) == profiling.IO
+    assert profiling.categorize(
+        ['courseraprogramming.commands.ls', 'dockerfile_parse.parser']) == \
+        profiling.LOCAL
+    assert profiling.categorize(
+        ['courseraprogramming.commands.deploy', 'concurrent.futures._base',
+         'threading']) == profiling.IDLE
+    assert profiling.categorize(
+        ['courseraprogramming.commands.publish'], busy=False) == \
+        profiling.IDLE
+    assert profiling.categorize(
+        ['courseraprogramming.commands.publish', 'requests.sessions'],
+        busy=False) == profiling.HTTP
+
+
+def test_profile_parsing():
+    args = main.build_parser(['--profile', 'out.prof', 'version']).parse_args(
+        ['--profile', 'out.prof', 'version'])
+    assert args.profile == 'out.prof'
+    assert args.func.__module__ == 'courseraprogramming.commands.version'
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop, ), name='worker')
+    worker.start()
+    sampler = profiling.Sampler(interval=0.001)
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    stop.set()
+    worker.join()
+    assert sampler.samples > 0
+    assert any(stack.startswith('worker;') and 'busy (' in stack
+               for stack in sampler.stacks)
+    assert not any(stack.startswith('profiler;') for stack in sampler.stacks)
+    assert sampler.categories[profiling.LOCAL] > 0
+    # The main thread, sleeping.
+    assert sampler.categories[profiling.IDLE] > 0
+
+
+def test_write_summary():
+    sampler = profiling.Sampler(interval=0.01)
+    sampler.samples = 4
+    sampler.categories.update({profiling.DOCKER: 3, profiling.LOCAL: 1})
+    out = io.StringIO()
+    profiling.write_summary(sampler, 0.04, out)
+    assert out.getvalue() == (
+        'Profiled 0.04 seconds, 4 samples every 10 ms.\n'
+        '  docker API       0.03 thread-seconds   75%\n'
+        '  HTTP             0.00 thread-seconds    0%\n'
+        '  I/O              0.00 thread-seconds    0%\n'
+        '  local            0.01 thread-seconds   25%\n'
+        '  idle             0.00 thread-seconds    0%\n')
+
+
+class TestRun:
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'out.prof')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @patch('courseraprogramming.profiling.sys.stderr')
+    def test_run(self, stderr):
+        def command(args):
+            time.sleep(0.02)
+            return args
+
+        assert profiling.run(command, 7, self.file_name, 0.001) == 7
+        stats = pstats.Stats(self.file_name)
+        assert any(name == 'command' for _, _, name in stats.stats)
+        with open(self.file_name + '.folded') as f:
+            lines = f.read().splitlines()
+        assert lines
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+    @patch('courseraprogramming.profiling.sys.stderr')
+    def test_run_failure(self, stderr):
+        def command(args):
+            raise ValueError('boom')
+
+        try:
+            profiling.run(command, None, self.file_name)
+            assert False, 'run should have raised'
+        except ValueError:
+            pass
+        assert os.path.exists(self.file_name)
+        assert os.path.exists(self.file_name + '.folded')
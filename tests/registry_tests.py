@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import registry
+from mock import patch
+from testfixtures import LogCapture
+import os.path
+import shutil
+import tempfile
+
+
+def test_record_grader_keeps_known_fields():
+    r = registry.Registry(':memory:')
+    r.record_grader('course1', 'g1', bucket='b', key='k', location='loc',
+                    registered=True)
+    r.record_grader('course1', 'g1', status='COMPLETED')
+    grader = r.grader('g1')
+    assert grader['bucket'] == 'b'
+    assert grader['key'] == 'k'
+    assert grader['location'] == 'loc'
+    assert grader['status'] == 'COMPLETED'
+    assert grader['registered_at'] is not None
+    assert r.grader('g2') is None
+
+
+def test_graders_and_parts():
+    r = registry.Registry(':memory:')
+    r.record_grader('course1', 'g1', registered=True)
+    r.record_grader('course1', 'g2', replaces='g1', registered=True)
+    r.record_grader('course2', 'g3')
+    r.record_part('course1', 'item1', 'part1', 'g1')
+    r.record_part('course1', 'item1', 'part2', 'g1')
+    r.record_part('course1', 'item1', 'part1', 'g2')
+    assert [g['executor_id'] for g in r.graders('course1')] == ['g1', 'g2']
+    assert r.graders('course1')[1]['replaces'] == 'g1'
+    assert r.parts(course_id='course1') == [
+        ('course1', 'item1', 'part1', 'g2'),
+        ('course1', 'item1', 'part2', 'g1'),
+    ]
+    assert r.parts(executor_id='g1') == [('course1', 'item1', 'part2', 'g1')]
+
+
+def test_record_publish():
+    r = registry.Registry(':memory:')
+    r.record_publish('course1', 'item1', 'published')
+    r.record_publish('course1', 'item1', 'grader pending')
+    assert r._read('SELECT outcome FROM items', ()) == [('grader pending', )]
+
+
+def test_unreadable_registry_reads_nothing():
+    r = registry.Registry(':memory:')
+    r.record_grader('course1', 'g1')
+    r.connection.execute('DROP TABLE graders')
+    r.connection.execute('DROP TABLE parts')
+    with LogCapture() as logs:
+        assert r.grader('g1') is None
+        assert r.graders('course1') == []
+        assert r.parts(course_id='course1') == []
+    assert 'Could not read the grader registry' in str(logs)
+
+
+class TestOpenRegistry:
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_creates_directory(self):
+        file_name = os.path.join(self.directory, 'sub', 'registry.sqlite3')
+        r = registry.open_registry(file_name)
+        r.record_grader('course1', 'g1')
+        r.close()
+        assert registry.open_registry(file_name).grader('g1') is not None
+
+    def test_disabled(self):
+        assert registry.open_registry('') is None
+
+    @patch('courseraprogramming.commands.oauth2.configuration')
+    def test_configured_path(self, configuration):
+        file_name = os.path.join(self.directory, 'registry.sqlite3')
+        configuration.return_value.get.return_value = file_name
+        registry.open_registry().close()
+        configuration.return_value.get.assert_called_with('registry', 'path')
+        assert os.path.exists(file_name)
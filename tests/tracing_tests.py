@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Coursera
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from courseraprogramming import tracing
+import io
+import json
+import os.path
+import requests
+import shutil
+import tempfile
+import threading
+
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+    "Answers every request with a 200 response with a 5 byte body."
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Length'] = '5'
+        response.raw = io.BytesIO(b'hello')
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def make_session(cls=requests.Session):
+    session = cls()
+    session.mount('http://', FakeAdapter())
+    session.mount('https://', FakeAdapter())
+    session.mount('http+docker://', FakeAdapter())
+    return session
+
+
+# docker-py clients are requests sessions defined in the docker package.
+DockerClient = type('Client', (requests.Session, ),
+                    {'__module__': 'docker.client'})
+
+
+def test_span_disabled():
+    with tracing.span(tracing.HTTP, 'GET x') as span:
+        span['status'] = 200
+    assert not tracing.enabled()
+
+
+class TestTracing:
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'trace.jsonl')
+        tracing.start(self.file_name, 'ls')
+
+    def tearDown(self):
+        tracing.stop()
+        shutil.rmtree(self.directory)
+
+    def spans(self):
+        tracing.stop()
+        with open(self.file_name) as f:
+            return [json.loads(line) for line in f]
+
+    def test_span(self):
+        with tracing.span(tracing.EXPORT, 'save img', image='img') as span:
+            span['bytes'] = 42
+        try:
+            with tracing.span(tracing.OAUTH2, 'refresh'):
+                raise ValueError('boom')
+        except ValueError:
+            pass
+        try:
+            with tracing.span(tracing.COMMAND, 'ls'):
+                raise SystemExit(2)
+        except SystemExit:
+            pass
+        spans = self.spans()
+        assert [(s['kind'], s['name']) for s in spans] == [
+            ('export', 'save img'), ('oauth2', 'refresh'), ('command', 'ls')]
+        assert spans[0]['bytes'] == 42
+        assert spans[0]['image'] == 'img'
+        assert spans[0]['command'] == 'ls'
+        assert spans[0]['duration'] >= 0
+        assert spans[1]['error'] == 'ValueError'
+        assert spans[2]['status'] == 2
+        assert len(set(s['run'] for s in spans)) == 1
+
+    def test_http_requests(self):
+        make_session().post('https://api.example.com/v1/items?q=1',
+                            data='abc')
+        make_session(DockerClient).get(
+            'http+docker://localunixsocket/v1.24/version')
+        spans = self.spans()
+        assert [(s['kind'], s['name']) for s in spans] == [
+            ('http', 'POST api.example.com/v1/items'),
+            ('docker', 'GET /v1.24/version'),
+        ]
+        assert spans[0]['status'] == 200
+        assert spans[0]['bytes'] == 5
+        assert spans[0]['bytes_sent'] == 3
+
+    def test_append(self):
+        with tracing.span(tracing.HTTP, 'first'):
+            pass
+        tracing.stop()
+        tracing.start(self.file_name, 'cat')
+        with tracing.span(tracing.HTTP, 'second'):
+            pass
+        spans = self.spans()
+        assert [s['command'] for s in spans] == ['ls', 'cat']
+        assert spans[0]['run'] != spans[1]['run']
+
+    def test_concurrent_writers(self):
+        # Two tracers stand for two runs appending to the same file. Their
+        # spans are larger than any stdio buffer.
+        other = tracing.Tracer(self.file_name, 'cat')
+        padding = 'x' * 20000
+
+        def write(tracer):
+            for _ in range(20):
+                tracer.write(tracing.HTTP, 'GET x', 0, 0,
+                             {'padding': padding})
+        threads = [threading.Thread(target=write, args=(tracer, ))
+                   for tracer in [tracing._tracer, other] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other.close()
+        spans = self.spans()
+        assert len(spans) == 80
+        assert set(s['padding'] for s in spans) == set([padding])
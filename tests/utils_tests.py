@@ -16,7 +16,12 @@
 
 from courseraprogramming import main
 from courseraprogramming import utils
+from mock import MagicMock
+from mock import patch
 import logging
+import os
+import shutil
+import tempfile
 
 # Set up mocking of the `open` call. See http://www.ichimonji10.name/blog/6/
 from sys import version_info
@@ -63,3 +68,69 @@ def test_no_timeout():
     parser = main.build_parser()
     args = parser.parse_args('version'.split())
     assert args.timeout == 60
+
+
+def test_docker_version_cache():
+    directory = tempfile.mkdtemp()
+    file_name = os.path.join(directory, 'versions.json')
+    try:
+        assert utils.load_docker_version('tcp://a:2375', file_name) is None
+        utils.save_docker_version(
+            'tcp://a:2375', {'ApiVersion': '1.23'}, file_name)
+        utils.save_docker_version(
+            'tcp://b:2375', {'ApiVersion': '1.24'}, file_name)
+        assert utils.load_docker_version('tcp://a:2375', file_name) == \
+            {'ApiVersion': '1.23'}
+        assert utils.load_docker_version('tcp://b:2375', file_name) == \
+            {'ApiVersion': '1.24'}
+        assert utils.load_docker_version('tcp://c:2375', file_name) is None
+        with patch('courseraprogramming.utils.time.time') as now:
+            now.return_value = os.path.getmtime(file_name) + 2 * 60 * 60
+            assert utils.load_docker_version(
+                'tcp://a:2375', file_name) is None
+    finally:
+        shutil.rmtree(directory)
+
+
+@patch('courseraprogramming.utils.save_docker_version')
+@patch('courseraprogramming.utils.load_docker_version')
+@patch('docker.Client')
+def test_docker_client_negotiates_once(client, load, save):
+    parser = main.build_parser()
+    args = parser.parse_args(
+        '--docker-url tcp://a:2375 ls image /'.split())
+    probe = MagicMock()
+    probe.version.return_value = {'ApiVersion': '1.23', 'Version': '1.11'}
+    conn = MagicMock()
+    client.side_effect = [probe, conn]
+    load.return_value = None
+    with patch('courseraprogramming.utils._platform', 'linux'), \
+            patch.dict(utils._docker_clients, clear=True):
+        assert utils.docker_client(args) is conn
+        assert utils.docker_client(args) is conn
+        assert utils.docker_version(args)['Version'] == '1.11'
+    probe.version.assert_called_with(api_version=False)
+    assert probe.close.called
+    client.assert_called_with(
+        base_url='tcp://a:2375', timeout=60, version='1.23')
+    save.assert_called_once_with('tcp://a:2375', probe.version.return_value)
+
+
+@patch('courseraprogramming.utils.load_docker_version')
+@patch('docker.Client')
+def test_docker_client_cached_version(client, load):
+    parser = main.build_parser()
+    args = parser.parse_args(
+        '--docker-url tcp://a:2375 ls image /'.split())
+    load.return_value = {'ApiVersion': '1.22'}
+    with patch('courseraprogramming.utils._platform', 'linux'), \
+            patch.dict(utils._docker_clients, clear=True):
+        first = utils.docker_client(args)
+        # A forked child must not reuse its parent's connection pools.
+        with patch('courseraprogramming.utils.os.getpid') as getpid:
+            getpid.return_value = -1
+            utils.docker_client(args)
+    assert client.call_count == 2
+    assert not first.version.called
+    client.assert_called_with(
+        base_url='tcp://a:2375', timeout=60, version='1.22')